@@ -0,0 +1,41 @@
+"""Recompute project summary columns
+
+Revision ID: 7f1aaf94f789
+Revises: 5b0e7d2c9a41
+Create Date: 2026-10-17 14:21:37.512096
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = '7f1aaf94f789'
+down_revision = '5b0e7d2c9a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The first backfill measured the json text as it was sent, and the API
+    # then counted escaped, compact JSON and numeric strings in total_cost.
+    # Both now follow app.budget.summarize_project_data: data::text of the
+    # jsonb document, and items whose qtyValue and unitPrice are JSON numbers.
+    op.execute("""
+        UPDATE project SET
+            data_size = coalesce(octet_length(data::text), 0),
+            total_cost = CASE WHEN jsonb_typeof(data->'budgetItems') = 'array' THEN (
+                SELECT round(coalesce(sum(
+                    (item->>'qtyValue')::numeric * (item->>'unitPrice')::numeric
+                ), 0), 2)
+                FROM jsonb_array_elements(data->'budgetItems') AS item
+                WHERE jsonb_typeof(item) = 'object'
+                    AND jsonb_typeof(item->'qtyValue') = 'number'
+                    AND jsonb_typeof(item->'unitPrice') = 'number'
+            ) END
+    """)
+
+
+def downgrade():
+    pass
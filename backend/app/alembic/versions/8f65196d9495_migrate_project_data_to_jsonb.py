@@ -0,0 +1,76 @@
+"""Migrate project data to JSONB
+
+Revision ID: 8f65196d9495
+Revises: 7439d25d267b
+Create Date: 2026-10-16 22:48:30.726772
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '8f65196d9495'
+down_revision = '7439d25d267b'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    # ALTER COLUMN ... TYPE jsonb would rewrite the table under an ACCESS
+    # EXCLUSIVE lock for the whole conversion. Copy into a new column in small
+    # committed batches instead, with a trigger covering concurrent writes, and
+    # only lock the table for the final swap.
+    op.add_column('project', sa.Column('data_jsonb', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.execute("""
+        CREATE FUNCTION project_data_jsonb_sync() RETURNS trigger AS $$
+        BEGIN
+            NEW.data_jsonb := NEW.data::jsonb;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER project_data_jsonb_sync
+        BEFORE INSERT OR UPDATE OF data ON project
+        FOR EACH ROW EXECUTE FUNCTION project_data_jsonb_sync()
+    """)
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        while True:
+            result = conn.execute(
+                sa.text("""
+                    UPDATE project SET data_jsonb = data::jsonb
+                    WHERE id IN (
+                        SELECT id FROM project
+                        WHERE data_jsonb IS NULL AND data IS NOT NULL
+                        LIMIT :batch_size
+                    )
+                """),
+                {"batch_size": BATCH_SIZE},
+            )
+            if result.rowcount == 0:
+                break
+    op.execute("LOCK TABLE project IN ACCESS EXCLUSIVE MODE")
+    op.execute("UPDATE project SET data_jsonb = data::jsonb WHERE data_jsonb IS NULL AND data IS NOT NULL")
+    op.execute("DROP TRIGGER project_data_jsonb_sync ON project")
+    op.execute("DROP FUNCTION project_data_jsonb_sync()")
+    op.drop_column('project', 'data')
+    op.alter_column('project', 'data_jsonb', new_column_name='data')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_project_data_path_ops', 'project', ['data'], unique=False, postgresql_using='gin', postgresql_ops={'data': 'jsonb_path_ops'}, postgresql_concurrently=True)
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('ix_project_data_path_ops', table_name='project', postgresql_using='gin', postgresql_ops={'data': 'jsonb_path_ops'})
+    op.alter_column('project', 'data',
+               existing_type=postgresql.JSONB(astext_type=sa.Text()),
+               type_=postgresql.JSON(astext_type=sa.Text()),
+               existing_nullable=True,
+               postgresql_using='data::json')
+    # ### end Alembic commands ###
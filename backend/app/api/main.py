@@ -1,6 +1,15 @@
 from fastapi import APIRouter
 
-from app.api.routes import items, line_items, login, private, projects, users, utils
+from app.api.routes import (
+    items,
+    line_items,
+    login,
+    models,
+    private,
+    projects,
+    users,
+    utils,
+)
 from app.core.config import settings
 
 api_router = APIRouter()
@@ -10,6 +19,7 @@ api_router.include_router(utils.router)
 api_router.include_router(items.router)
 api_router.include_router(line_items.router)
 api_router.include_router(projects.router)
+api_router.include_router(models.router)
 
 
 if settings.ENVIRONMENT == "local":
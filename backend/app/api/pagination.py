@@ -0,0 +1,147 @@
+import base64
+import json
+import uuid
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import literal, text, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import Select, SelectOfScalar
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models import CountType
+
+T = TypeVar("T")
+
+count_cache: TTLCache[tuple[str, str], int] = TTLCache(
+    name="list-counts",
+    maxsize=settings.LIST_COUNT_CACHE_MAX_SIZE,
+    ttl=settings.LIST_COUNT_CACHE_TTL_SECONDS,
+)
+
+
+def encode_cursor(created_at: datetime, id: uuid.UUID) -> str:
+    raw = json.dumps([created_at.isoformat(), str(id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(
+    statement: SelectOfScalar[T],
+    model: Any,
+    *,
+    skip: int,
+    limit: int,
+    cursor: str | None,
+) -> SelectOfScalar[T]:
+    """
+    Order a list query by (created_at, id) and restrict it to one page.
+
+    With a cursor the page starts right after the row it points to, which the
+    (created_at, id) indexes resolve with a single range scan; ``skip`` is
+    ignored. Without one, the classic offset is applied.
+    """
+    statement = statement.order_by(col(model.created_at), col(model.id))
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        statement = statement.where(
+            tuple_(model.created_at, model.id)
+            > tuple_(literal(created_at), literal(id))
+        )
+    else:
+        statement = statement.offset(skip)
+    return statement.limit(limit)
+
+
+def next_cursor(rows: Sequence[Any], limit: int) -> str | None:
+    """Cursor for the page after ``rows``, or None when this was the last one."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last.created_at, last.id)
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, whose parameters are bound as usual."""
+
+    inherit_cache = False
+
+    def __init__(self, statement: Select[Any] | SelectOfScalar[Any]) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")  # type: ignore[no-untyped-call,untyped-decorator]
+def _compile_explain(element: Explain, compiler: Any, **kw: Any) -> str:
+    statement: str = compiler.process(element.statement, **kw)
+    return f"EXPLAIN (FORMAT JSON) {statement}"
+
+
+async def _planner_estimate(
+    session: AsyncSession, statement: Select[Any] | SelectOfScalar[Any]
+) -> int:
+    conn = await session.connection()
+    # Compiled with the statement, so that bind processors (JSONB, JSONPATH...)
+    # adapt the parameters
+    result = await conn.execute(Explain(statement))
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def count_rows(
+    session: AsyncSession,
+    model: Any,
+    *whereclause: Any,
+    count_type: CountType,
+) -> int | None:
+    """
+    Count the rows of ``model`` matching ``whereclause`` the way ``count_type`` asks.
+
+    ``estimated`` reads ``pg_class.reltuples`` for an unfiltered table and the
+    planner's row estimate otherwise, so neither scans the table. ``cached``
+    serves an exact count for up to LIST_COUNT_CACHE_TTL_SECONDS.
+    """
+    if count_type == "none":
+        return None
+    statement = select(func.count()).select_from(model).where(*whereclause)
+    if count_type == "estimated":
+        if not whereclause:
+            conn = await session.connection()
+            reltuples = (
+                await conn.execute(
+                    text(
+                        "SELECT reltuples::bigint FROM pg_class "
+                        "WHERE oid = CAST(:name AS regclass)"
+                    ),
+                    {"name": f'"{model.__tablename__}"'},
+                )
+            ).scalar_one()
+            # -1 until the table has been vacuumed or analyzed once
+            if reltuples >= 0:
+                return int(reltuples)
+        return await _planner_estimate(session, select(model).where(*whereclause))
+    if count_type == "cached":
+        compiled = statement.compile()
+        key = (str(compiled), repr(sorted(compiled.params.items())))
+        cached = count_cache.get(key)
+        if cached is not None:
+            return cached
+        count = (await session.exec(statement)).one()
+        count_cache.set(key, count)
+        return count
+    return (await session.exec(statement)).one()
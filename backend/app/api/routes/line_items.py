@@ -1,14 +1,50 @@
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.api.deps import CurrentUser, SessionDep
+from app.api.deps import AsyncSessionDep, CurrentPrincipal
+from app.api.pagination import count_rows, next_cursor, paginate
+from app.budget import drop_line_item_budgets
+from app.exports import export_response
+from app.line_item_cache import (
+    get_line_items,
+    invalidate_line_items,
+    notify_line_items_changed,
+)
+from app.line_item_changes import line_item_changes
+from app.line_item_import import import_format, run_import, spool_upload
+from app.line_item_prices import prices_as_of
+from app.line_item_rollup import (
+    CompositionCycleError,
+    DerivedPriceError,
+    rollup_line_items,
+    set_components,
+)
+from app.line_item_search import search_line_items
 from app.models import (
+    CountType,
+    ExportFormat,
     LineItem,
+    LineItemBatchGet,
+    LineItemBatchGetResults,
+    LineItemChanges,
+    LineItemComponent,
+    LineItemComponentPublic,
+    LineItemComponentsPublic,
+    LineItemComponentsUpdate,
     LineItemCreate,
+    LineItemImport,
+    LineItemImportPublic,
+    LineItemPrice,
+    LineItemPricesAsOf,
+    LineItemPricesPublic,
+    LineItemPricesQuery,
     LineItemPublic,
+    LineItemSearchResults,
     LineItemsPublic,
     LineItemUpdate,
     Message,
@@ -18,83 +54,367 @@ router = APIRouter(prefix="/line-items", tags=["line_items"])  # /api/v1/line-it
 
 
 @router.get("/", response_model=LineItemsPublic)
-def read_line_items(
-    session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_line_items(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    count_type: CountType = "exact",
 ) -> Any:
     """Retrieve line items (catalog).
     - Everyone authenticated can list.
+    - Pass a page's ``next_cursor`` as ``cursor`` to fetch the page after it.
+    - ``count_type`` selects how ``count`` is computed, or skips it.
+    """
+    count = await count_rows(session, LineItem, count_type=count_type)
+    statement = paginate(
+        select(LineItem), LineItem, skip=skip, limit=limit, cursor=cursor
+    )
+    items = (await session.exec(statement)).all()
+    return LineItemsPublic(
+        data=items,
+        count=count,
+        count_type=count_type,
+        next_cursor=next_cursor(items, limit),
+    )
+
+
+@router.get("/search", response_model=LineItemSearchResults)
+async def search_catalog(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    q: str,
+    limit: int = Query(default=20, ge=1, le=100),
+    autocomplete: bool = False,
+) -> Any:
+    """Search line items by code and description, best matches first.
+    - Codes starting with ``q`` rank above description matches.
+    - Descriptions match by Spanish word stems; misspelled words are corrected
+      to the closest catalog word when nothing matches as typed.
+    - ``autocomplete`` also matches the last word of ``q`` as a prefix.
     """
-    count_statement = select(func.count()).select_from(LineItem)
-    count = session.exec(count_statement).one()
-    statement = select(LineItem).offset(skip).limit(limit)
-    items = session.exec(statement).all()
-    return LineItemsPublic(data=items, count=count)
+    hits = await search_line_items(session, q, limit=limit, autocomplete=autocomplete)
+    return LineItemSearchResults(data=hits)
+
+
+@router.post("/batch-get", response_model=LineItemBatchGetResults)
+async def batch_get_line_items(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, batch: LineItemBatchGet
+) -> Any:
+    """Get many line items at once, by ``ids`` and/or ``codes`` (up to 1000 each).
+    - Each id and code is answered under its own key, with null when there is
+      no such line item.
+    - Line items are served from this worker's cache where possible; the
+      rest are fetched with a single query, however many were asked for.
+    """
+    found = await get_line_items(session, ids=batch.ids, codes=batch.codes)
+    return LineItemBatchGetResults(
+        ids={id: found.get(id) for id in batch.ids},
+        codes={code: found.get(code) for code in batch.codes},
+    )
+
+
+@router.post("/prices", response_model=LineItemPricesAsOf)
+async def read_line_item_prices_as_of(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, query: LineItemPricesQuery
+) -> Any:
+    """Catalog prices at ``as_of`` of many line items, by ``ids`` and/or ``codes``.
+    - Each id and code is answered under its own key, with null when the line
+      item does not exist or had no price at that date.
+    - A single query, on the price history's index, prices them all.
+    """
+    prices = await prices_as_of(session, query.as_of, ids=query.ids, codes=query.codes)
+    return LineItemPricesAsOf(
+        as_of=query.as_of,
+        ids={id: prices.get(id) for id in query.ids},
+        codes={code: prices.get(code) for code in query.codes},
+    )
+
+
+@router.get("/changes", response_model=LineItemChanges)
+async def read_line_item_changes(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    since: str | None = None,
+    limit: int = Query(default=1000, ge=1, le=5000),
+) -> Any:
+    """Catalog changes after the watermark ``since``, to keep a local copy in sync.
+    - ``upserts`` are line items added or updated, ``deletes`` the ids of
+      removed ones.
+    - Pass ``next_since`` as ``since`` next time; more changes are waiting
+      while ``has_more`` is true.
+    - Without ``since`` the whole catalog is returned, page by page.
+    """
+    return await line_item_changes(session, since, limit)
+
+
+@router.get("/export")
+async def export_line_items(
+    current_user: CurrentPrincipal, format: ExportFormat = "csv"
+) -> StreamingResponse:
+    """
+    Download the whole catalog, ordered by code, as CSV, NDJSON or XLSX.
+
+    The columns start with those ``/line-items/import`` reads, so an edited
+    export can be imported back.
+    """
+    statement = select(  # type: ignore[call-overload]
+        LineItem.code,
+        LineItem.description,
+        LineItem.unit,
+        LineItem.unit_price,
+        LineItem.id,
+        LineItem.created_at,
+        LineItem.updated_at,
+    ).order_by(col(LineItem.code), col(LineItem.id))
+    return export_response(statement, format, "line-items")
+
+
+@router.post("/import", response_model=LineItemImportPublic, status_code=202)
+async def import_line_items(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    file: UploadFile,
+    background_tasks: BackgroundTasks,
+) -> Any:
+    """Import line items from a CSV or XLSX file. Superusers only.
+    - The first row names the columns: code, description, unit, unit_price.
+    - Rows are matched to the catalog by code: new codes are inserted and
+      existing ones updated.
+    - The import runs in the background; poll ``GET /line-items/import/{id}``.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    format = import_format(file.filename)
+    if format is None:
+        raise HTTPException(
+            status_code=400, detail="Only .csv and .xlsx files can be imported"
+        )
+    path = await spool_upload(file, suffix=f".{format}")
+    job = LineItemImport(
+        filename=(file.filename or "")[:255], created_by=current_user.id
+    )
+    session.add(job)
+    await session.commit()
+    await session.refresh(job)
+    background_tasks.add_task(run_import, job.id, path, format)
+    return job
+
+
+@router.get("/import/{id}", response_model=LineItemImportPublic)
+async def read_line_item_import(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Any:
+    """Get the progress or outcome of a line item import. Superusers only."""
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    job = await session.get(LineItemImport, id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job
 
 
 @router.get("/{id}", response_model=LineItemPublic)
-def read_line_item(
-    session: SessionDep, current_user: CurrentUser, id: uuid.UUID
+async def read_line_item(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
 ) -> Any:
     """Get line item by ID."""
-    obj = session.get(LineItem, id)
+    item = (await get_line_items(session, ids=[id])).get(id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Line item not found")
+    return item
+
+
+@router.get("/{id}/prices", response_model=LineItemPricesPublic)
+async def read_line_item_prices(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Any:
+    """Price history of a line item, the current price last."""
+    if not await session.get(LineItem, id):
+        raise HTTPException(status_code=404, detail="Line item not found")
+    statement = (
+        select(LineItemPrice)
+        .where(LineItemPrice.line_item_id == id)
+        .order_by(col(LineItemPrice.valid_from))
+    )
+    prices = (await session.exec(statement)).all()
+    return LineItemPricesPublic(data=prices)
+
+
+async def is_component(session: AsyncSession, id: uuid.UUID) -> bool:
+    statement = select(LineItemComponent.parent_id).where(
+        LineItemComponent.component_id == id
+    )
+    return (await session.exec(statement.limit(1))).first() is not None
+
+
+async def is_composite(session: AsyncSession, id: uuid.UUID) -> bool:
+    statement = select(LineItemComponent.component_id).where(
+        LineItemComponent.parent_id == id
+    )
+    return (await session.exec(statement.limit(1))).first() is not None
+
+
+async def read_components(
+    session: AsyncSession, obj: LineItem
+) -> LineItemComponentsPublic:
+    statement = (
+        select(LineItemComponent, LineItem)
+        .join(LineItem, col(LineItem.id) == LineItemComponent.component_id)
+        .where(LineItemComponent.parent_id == obj.id)
+        .order_by(col(LineItem.code), col(LineItem.id))
+    )
+    return LineItemComponentsPublic(
+        data=[
+            LineItemComponentPublic(
+                line_item=LineItemPublic.model_validate(item),
+                quantity=component.quantity,
+                amount=component.quantity * item.unit_price,
+            )
+            for component, item in await session.exec(statement)
+        ],
+        unit_price=obj.unit_price,
+    )
+
+
+@router.get("/{id}/components", response_model=LineItemComponentsPublic)
+async def read_line_item_components(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Any:
+    """Composition (APU) of a line item; empty for plain line items."""
+    obj = await session.get(LineItem, id)
     if not obj:
         raise HTTPException(status_code=404, detail="Line item not found")
-    return obj
+    return await read_components(session, obj)
+
+
+@router.put("/{id}/components", response_model=LineItemComponentsPublic)
+async def update_line_item_components(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    components_in: LineItemComponentsUpdate,
+) -> Any:
+    """Replace the composition (APU) of a line item. Superusers only.
+    - Its unit price becomes the sum of each component's quantity times its
+      unit price, and the composites it goes into are repriced.
+    - An empty list makes it a plain line item, keeping its last price.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    obj = await session.get(LineItem, id)
+    if not obj:
+        raise HTTPException(status_code=404, detail="Line item not found")
+    component_ids = {c.line_item_id for c in components_in.components}
+    if len(component_ids) < len(components_in.components):
+        raise HTTPException(status_code=400, detail="Components are repeated")
+    found = await get_line_items(session, ids=component_ids)
+    if len(found) < len(component_ids):
+        raise HTTPException(status_code=404, detail="Component not found")
+    conn = await session.connection()
+    try:
+        await set_components(conn, id, components_in.components)
+    except CompositionCycleError:
+        raise HTTPException(
+            status_code=400, detail="A line item cannot be a component of itself"
+        )
+    except DerivedPriceError:
+        raise HTTPException(status_code=400, detail="Derived unit price is too large")
+    await notify_line_items_changed(conn)
+    await session.commit()
+    invalidate_line_items()
+    await session.refresh(obj)
+    return await read_components(session, obj)
 
 
 @router.post("/", response_model=LineItemPublic)
-def create_line_item(
-    *, session: SessionDep, current_user: CurrentUser, item_in: LineItemCreate
+async def create_line_item(
+    *, session: AsyncSessionDep, current_user: CurrentPrincipal, item_in: LineItemCreate
 ) -> Any:
     """Create new line item. Superusers only."""
     if not current_user.is_superuser:
         raise HTTPException(status_code=400, detail="Not enough permissions")
     # enforce unique code at app level too (DB also has unique index)
     if item_in.code:
-        exists = session.exec(
-            select(LineItem).where(LineItem.code == item_in.code)
+        exists = (
+            await session.exec(select(LineItem).where(LineItem.code == item_in.code))
         ).first()
         if exists:
             raise HTTPException(status_code=400, detail="Code already exists")
     obj = LineItem.model_validate(item_in)
     session.add(obj)
-    session.commit()
-    session.refresh(obj)
+    await notify_line_items_changed(await session.connection())
+    await session.commit()
+    invalidate_line_items()
+    await session.refresh(obj)
     return obj
 
 
 @router.put("/{id}", response_model=LineItemPublic)
-def update_line_item(
-    *, session: SessionDep, current_user: CurrentUser, id: uuid.UUID, item_in: LineItemUpdate
+async def update_line_item(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    item_in: LineItemUpdate,
 ) -> Any:
     """Update line item. Superusers only."""
     if not current_user.is_superuser:
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    obj = session.get(LineItem, id)
+    obj = await session.get(LineItem, id)
     if not obj:
         raise HTTPException(status_code=404, detail="Line item not found")
     data = item_in.model_dump(exclude_unset=True)
     # handle unique code change
     new_code = data.get("code")
     if new_code and new_code != obj.code:
-        exists = session.exec(select(LineItem).where(LineItem.code == new_code)).first()
+        exists = (
+            await session.exec(select(LineItem).where(LineItem.code == new_code))
+        ).first()
         if exists:
             raise HTTPException(status_code=400, detail="Code already exists")
+    if "unit_price" in data and await is_composite(session, id):
+        raise HTTPException(
+            status_code=400,
+            detail="The unit price of a composite line item is derived from its components",
+        )
     obj.sqlmodel_update(data)
     session.add(obj)
-    session.commit()
-    session.refresh(obj)
+    await session.flush()
+    conn = await session.connection()
+    if "unit_price" in data:
+        try:
+            await rollup_line_items(conn, [id])
+        except DerivedPriceError:
+            raise HTTPException(
+                status_code=400, detail="Derived unit price is too large"
+            )
+    await notify_line_items_changed(conn)
+    await session.commit()
+    invalidate_line_items()
+    await session.refresh(obj)
     return obj
 
 
 @router.delete("/{id}")
-def delete_line_item(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Message:
+async def delete_line_item(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Message:
     """Delete a line item. Superusers only."""
     if not current_user.is_superuser:
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    obj = session.get(LineItem, id)
+    obj = await session.get(LineItem, id)
     if not obj:
         raise HTTPException(status_code=404, detail="Line item not found")
-    session.delete(obj)
-    session.commit()
+    if await is_component(session, id):
+        raise HTTPException(
+            status_code=400, detail="Line item is a component of other line items"
+        )
+    await drop_line_item_budgets(session, id)
+    await session.delete(obj)
+    await notify_line_items_changed(await session.connection())
+    await session.commit()
+    invalidate_line_items()
     return Message(message="Line item deleted successfully")
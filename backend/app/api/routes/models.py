@@ -0,0 +1,319 @@
+import uuid
+from typing import Annotated, Any
+
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Header, HTTPException, Request
+from fastapi.responses import Response
+from sqlalchemy.orm import defer
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.api.deps import AsyncSessionDep, CurrentPrincipal
+from app.core.config import settings
+from app.core.security import Principal
+from app.model_elements import index_blob, read_elements
+from app.model_storage import (
+    UploadBusyError,
+    UploadCompletedError,
+    UploadHashMismatchError,
+    UploadOffsetError,
+    UploadTooLargeError,
+    add_model,
+    append_chunk,
+    blob_response,
+    complete_upload,
+    compress_blob,
+    drop_unused_blobs,
+    locked_blob,
+    remove_blob_files,
+    remove_upload_files,
+    upload_offset,
+)
+from app.models import (
+    Message,
+    Model,
+    ModelBlob,
+    ModelElementPublic,
+    ModelElementsBatchGet,
+    ModelElementsBatchGetResults,
+    ModelPublic,
+    ModelsPublic,
+    ModelUpload,
+    ModelUploadCreate,
+    ModelUploadPublic,
+    Project,
+)
+from app.takeoff import extract_takeoff
+
+router = APIRouter(prefix="/models", tags=["models"])  # /api/v1/models
+
+
+async def check_project_access(
+    session: AsyncSession, current_user: Principal, project_id: uuid.UUID
+) -> None:
+    obj = await session.get(
+        Project,
+        project_id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+
+
+async def get_model(
+    session: AsyncSession, current_user: Principal, id: uuid.UUID
+) -> Model:
+    model = await session.get(Model, id)
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    await check_project_access(session, current_user, model.project_id)
+    return model
+
+
+async def get_upload(
+    session: AsyncSession, current_user: Principal, id: uuid.UUID
+) -> ModelUpload:
+    upload = await session.get(ModelUpload, id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    await check_project_access(session, current_user, upload.project_id)
+    return upload
+
+
+async def can_read_blob(
+    session: AsyncSession, current_user: Principal, sha256: str
+) -> bool:
+    """Whether a model the user can access is stored as blob ``sha256``."""
+    statement = select(Model.id).where(Model.sha256 == sha256)
+    if not current_user.is_superuser:
+        statement = statement.join(Project).where(Project.owner_id == current_user.id)
+    return (await session.exec(statement.limit(1))).first() is not None
+
+
+def upload_public(
+    upload: ModelUpload, offset: int, model: Model | None = None
+) -> ModelUploadPublic:
+    return ModelUploadPublic(
+        id=None if model else upload.id,
+        project_id=upload.project_id,
+        filename=upload.filename,
+        size=upload.size,
+        offset=offset,
+        model=ModelPublic.model_validate(model) if model else None,
+    )
+
+
+@router.get("/", response_model=ModelsPublic)
+async def read_models(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, project_id: uuid.UUID
+) -> Any:
+    """Model versions of a project, the latest first (only owner or superuser)."""
+    await check_project_access(session, current_user, project_id)
+    statement = (
+        select(Model)
+        .where(Model.project_id == project_id)
+        .order_by(col(Model.version).desc())
+    )
+    return ModelsPublic(data=(await session.exec(statement)).all())
+
+
+@router.post("/uploads", response_model=ModelUploadPublic)
+async def create_model_upload(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    upload_in: ModelUploadCreate,
+) -> Any:
+    """Start uploading a new model version of a project (only owner or superuser).
+    - Send the file with ``PATCH /models/uploads/{id}``, in one or more chunks.
+    - When ``sha256`` names a file already stored for a model the user can
+      access, the model is created at once and returned as ``model``; nothing
+      has to be uploaded. Otherwise the file is uploaded and must match it.
+    """
+    await check_project_access(session, current_user, upload_in.project_id)
+    if upload_in.size > settings.MODEL_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Model file is too large")
+    upload = ModelUpload.model_validate(
+        upload_in, update={"created_by": current_user.id}
+    )
+    # Naming a hash and size must not give access to someone else's file
+    if upload_in.sha256 and await can_read_blob(
+        session, current_user, upload_in.sha256
+    ):
+        blob = await locked_blob(session, upload_in.sha256)
+        if blob and blob.size == upload_in.size:
+            model = await add_model(
+                session,
+                blob,
+                project_id=upload.project_id,
+                filename=upload.filename,
+                created_by=upload.created_by,
+            )
+            await session.commit()
+            return upload_public(upload, blob.size, model)
+    session.add(upload)
+    await session.commit()
+    return upload_public(upload, 0)
+
+
+@router.get("/uploads/{id}", response_model=ModelUploadPublic)
+async def read_model_upload(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Any:
+    """Progress of an upload: ``offset`` is where the next chunk must start."""
+    upload = await get_upload(session, current_user, id)
+    return upload_public(upload, upload_offset(upload.id))
+
+
+@router.patch("/uploads/{id}", response_model=ModelUploadPublic)
+async def upload_model_chunk(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    upload_offset_header: Annotated[int, Header(alias="Upload-Offset", ge=0)],
+) -> Any:
+    """Append the request body to an upload, at byte ``Upload-Offset``.
+    - A chunk that does not start at the upload's ``offset`` is refused with
+      409; after an interruption, read the offset back and resume from it.
+    - The chunk that completes the file creates the model, returned as ``model``.
+    """
+    upload = await get_upload(session, current_user, id)
+    try:
+        offset = await append_chunk(upload, upload_offset_header, request.stream())
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail=f"Upload is at offset {e.offset}")
+    except UploadBusyError:
+        raise HTTPException(
+            status_code=409, detail="Another chunk of this upload is being sent"
+        )
+    except UploadTooLargeError:
+        raise HTTPException(
+            status_code=413, detail="Chunk goes past the size of the upload"
+        )
+    if offset < upload.size:
+        return upload_public(upload, offset)
+    try:
+        model, created = await complete_upload(session, upload)
+    except UploadCompletedError:
+        raise HTTPException(status_code=409, detail="Upload is already complete")
+    except UploadHashMismatchError:
+        await session.commit()
+        raise HTTPException(
+            status_code=422, detail="File does not match the declared sha256"
+        )
+    await session.commit()
+    if created:
+        background_tasks.add_task(compress_blob, model.sha256)
+        background_tasks.add_task(index_blob, model.sha256)
+        background_tasks.add_task(extract_takeoff, model.sha256)
+    return upload_public(upload, offset, model)
+
+
+@router.delete("/uploads/{id}")
+async def delete_model_upload(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Message:
+    """Abandon an upload and discard what was received of it."""
+    upload = await get_upload(session, current_user, id)
+    await session.delete(upload)
+    await session.commit()
+    remove_upload_files([id])
+    return Message(message="Upload deleted successfully")
+
+
+@router.get("/{id}", response_model=ModelPublic)
+async def read_model(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Any:
+    """Get model version by ID (only owner or superuser)."""
+    return await get_model(session, current_user, id)
+
+
+@router.get(
+    "/{id}/file",
+    response_class=Response,
+    responses={
+        206: {"description": "Partial content (Range)"},
+        304: {"description": "Not modified (If-None-Match)"},
+        416: {"description": "Range not satisfiable"},
+    },
+)
+async def download_model(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    range: Annotated[str | None, Header()] = None,
+    if_range: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+    accept_encoding: Annotated[str | None, Header()] = None,
+) -> Response:
+    """Download the IFC file of a model version (only owner or superuser).
+    - Single byte ranges are served as 206 Partial Content.
+    - Whole-file downloads are gzip-compressed for clients accepting it, once
+      the compressed copy has been made.
+    """
+    model = await get_model(session, current_user, id)
+    blob = await session.get(ModelBlob, model.sha256)
+    assert blob is not None
+    return blob_response(
+        blob,
+        model.filename,
+        range=range,
+        if_range=if_range,
+        if_none_match=if_none_match,
+        accept_encoding=accept_encoding,
+    )
+
+
+@router.get("/{id}/elements/{express_id}", response_model=ModelElementPublic)
+async def read_model_element(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    express_id: int,
+) -> Any:
+    """Get an element of a model version by its express id (``#123`` in the file).
+    - Its property sets and quantity sets (IfcElementQuantity) are included,
+      read from an index of the file built once after upload.
+    """
+    model = await get_model(session, current_user, id)
+    found = await anyio.to_thread.run_sync(read_elements, model.sha256, [express_id])
+    element = found[express_id]
+    if element is None:
+        raise HTTPException(status_code=404, detail="Element not found")
+    return element
+
+
+@router.post("/{id}/elements/batch-get", response_model=ModelElementsBatchGetResults)
+async def batch_get_model_elements(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    batch: ModelElementsBatchGet,
+) -> Any:
+    """Get many elements of a model version at once, by express id (up to 1000).
+    - Each id is answered under its own key, with null when there is no such
+      element.
+    """
+    model = await get_model(session, current_user, id)
+    found = await anyio.to_thread.run_sync(read_elements, model.sha256, batch.ids)
+    return ModelElementsBatchGetResults(ids=found)
+
+
+@router.delete("/{id}")
+async def delete_model(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Message:
+    """Delete a model version (only owner or superuser).
+    Its file is removed once no other model version uses it.
+    """
+    model = await get_model(session, current_user, id)
+    await session.delete(model)
+    await session.flush()
+    unused = await drop_unused_blobs(session, [model.sha256])
+    await session.commit()
+    remove_blob_files(unused)
+    return Message(message="Model deleted successfully")
@@ -1,98 +1,860 @@
+import json
 import uuid
-from typing import Any
+from datetime import datetime
+from typing import Annotated, Any, get_args
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+import anyio
+from fastapi import APIRouter, Body, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import cast, literal
+from sqlalchemy.dialects.postgresql import JSONPATH
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import defer, undefer
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.api.deps import CurrentUser, SessionDep
+from app.api.deps import AsyncSessionDep, CurrentPrincipal
+from app.api.pagination import count_rows, next_cursor, paginate
+from app.budget import (
+    BUDGET_ITEMS_KEY,
+    BudgetBreakdown,
+    budget_rates,
+    compute_budget,
+    join_line_prices,
+    line_unit_price,
+    merge_budget_items,
+    save_budget,
+    summarize_project_data,
+    sync_budget_lines,
+)
+from app.budget_rules import MappingRuleError, RuleMatcher, generate_budget_items
+from app.exports import export_response
+from app.json_patch import (
+    JsonPatchError,
+    JsonPatchTestFailed,
+    apply_json_patch,
+    apply_merge_patch,
+)
+from app.line_item_cache import get_line_items
+from app.model_storage import (
+    drop_unused_blobs,
+    remove_blob_files,
+    remove_upload_files,
+)
 from app.models import (
+    BudgetGroupBy,
+    BudgetTotal,
+    BudgetTotalsPublic,
+    CountType,
+    ExportFormat,
+    LineItem,
+    Model,
+    ModelPublic,
+    ModelUpload,
     Project,
+    ProjectBudget,
+    ProjectBudgetGenerate,
+    ProjectBudgetGenerated,
+    ProjectBudgetLine,
+    ProjectBudgetLinesBatch,
+    ProjectBudgetLinesPublic,
+    ProjectBudgetPublic,
     ProjectCreate,
     ProjectPublic,
+    ProjectRevision,
+    ProjectRevisionDocument,
+    ProjectRevisionPublic,
+    ProjectRevisionsPublic,
     ProjectsPublic,
+    ProjectSummariesPublic,
+    ProjectSummary,
+    ProjectTakeoff,
     ProjectUpdate,
+    TakeoffGroupBy,
     Message,
 )
+from app.revisions import load_revision, project_document, record_revision
+from app.takeoff import read_takeoff
 
 router = APIRouter(prefix="/projects", tags=["projects"])  # /api/v1/projects
 
 
+def project_etag(obj: Project) -> str:
+    return f'"{obj.version}"'
+
+
+def etag_matches(header: str | None, etag: str, *, weak: bool) -> bool:
+    """Whether an If-Match (strong) / If-None-Match (weak) header lists ``etag``."""
+    if header is None:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak:
+            candidate = candidate.removeprefix("W/")
+        if candidate in ("*", etag):
+            return True
+    return False
+
+
+def check_if_match(obj: Project, if_match: str | None) -> None:
+    if if_match is not None and not etag_matches(
+        if_match, project_etag(obj), weak=False
+    ):
+        raise HTTPException(
+            status_code=412, detail="Project has been modified since it was read"
+        )
+
+
+async def save_project(
+    session: AsyncSession,
+    obj: Project,
+    update: dict[str, Any],
+    author_id: uuid.UUID,
+) -> None:
+    """Apply ``update`` to a locked project, bump its version and record it."""
+    previous = project_document(obj)
+    if "data" in update:
+        update.update(summarize_project_data(update["data"]))
+    obj.sqlmodel_update(update)
+    obj.version += 1
+    record_revision(session, obj, previous, author_id)
+    session.add(obj)
+    await sync_budget_lines(session, obj, previous["data"])
+    await session.commit()
+    await session.refresh(obj)
+
+
+async def data_filters(
+    session: AsyncSession, contains: str | None, jsonpath: str | None
+) -> list[Any]:
+    """WHERE clauses on Project.data, all served by ix_project_data_path_ops."""
+    filters: list[Any] = []
+    if contains is not None:
+        try:
+            document = json.loads(contains)
+        except ValueError:
+            document = None
+        if not isinstance(document, dict | list):
+            raise HTTPException(
+                status_code=400, detail="contains must be a JSON object or array"
+            )
+        filters.append(col(Project.data).contains(document))
+    if jsonpath is not None:
+        path = cast(literal(jsonpath), JSONPATH)
+        try:
+            await session.exec(select(path))
+        except DBAPIError:
+            await session.rollback()
+            raise HTTPException(status_code=400, detail="Invalid JSONPath")
+        filters.append(col(Project.data).op("@?")(path))
+    return filters
+
+
 @router.get("/", response_model=ProjectsPublic)
-def read_projects(
-    session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_projects(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    count_type: CountType = "exact",
+    contains: str | None = None,
+    jsonpath: str | None = None,
 ) -> Any:
-    """Retrieve projects for current user. Superusers can see all."""
-    if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(Project)
-        count = session.exec(count_statement).one()
-        statement = select(Project).offset(skip).limit(limit)
-        items = session.exec(statement).all()
-    else:
-        count_statement = (
-            select(func.count()).select_from(Project).where(Project.owner_id == current_user.id)
-        )
-        count = session.exec(count_statement).one()
-        statement = (
-            select(Project)
-            .where(Project.owner_id == current_user.id)
-            .offset(skip)
-            .limit(limit)
+    """Retrieve projects for current user. Superusers can see all.
+    Pass a page's ``next_cursor`` as ``cursor`` to fetch the page after it;
+    ``count_type`` selects how ``count`` is computed, or skips it.
+    ``contains`` keeps projects whose data contains that JSON document, e.g.
+    {"budgetItems": [{"type": "IfcWall"}]}; ``jsonpath`` keeps those where the
+    JSONPath matches, e.g. $.budgetItems[*] ? (@.unitPrice > 100).
+    """
+    filters = await data_filters(session, contains, jsonpath)
+    if not current_user.is_superuser:
+        filters.append(Project.owner_id == current_user.id)
+    count = await count_rows(session, Project, *filters, count_type=count_type)
+    statement = paginate(
+        select(Project).where(*filters),
+        Project,
+        skip=skip,
+        limit=limit,
+        cursor=cursor,
+    )
+    items = (await session.exec(statement)).all()
+    return ProjectsPublic(
+        data=items,
+        count=count,
+        count_type=count_type,
+        next_cursor=next_cursor(items, limit),
+    )
+
+
+@router.get("/summary", response_model=ProjectSummariesPublic)
+async def read_project_summaries(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    count_type: CountType = "exact",
+    contains: str | None = None,
+    jsonpath: str | None = None,
+) -> Any:
+    """List projects without their data document (e.g. for a project picker).
+    Size, item count and total cost are kept up to date on every save; the
+    data column itself is never read, use GET /projects/{id} for it.
+    ``contains`` and ``jsonpath`` filter as on GET /projects/.
+    """
+    filters = await data_filters(session, contains, jsonpath)
+    if not current_user.is_superuser:
+        filters.append(Project.owner_id == current_user.id)
+    count = await count_rows(session, Project, *filters, count_type=count_type)
+    statement = paginate(
+        select(Project).options(defer(Project.data)).where(*filters),  # type: ignore[arg-type]
+        Project,
+        skip=skip,
+        limit=limit,
+        cursor=cursor,
+    )
+    items = (await session.exec(statement)).all()
+    return ProjectSummariesPublic(
+        data=items,
+        count=count,
+        count_type=count_type,
+        next_cursor=next_cursor(items, limit),
+    )
+
+
+@router.get("/budget-totals", response_model=BudgetTotalsPublic)
+async def read_budget_totals(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    group_by: BudgetGroupBy = "project",
+    project_id: uuid.UUID | None = None,
+    price_as_of: datetime | None = None,
+) -> Any:
+    """Budget line totals of the current user's projects (superusers: all),
+    grouped by project, catalog line item, IFC type, chapter or unit and
+    computed in SQL.
+    ``project_id`` restricts them to one project. With ``price_as_of`` lines
+    of catalog items are priced at the catalog price of that date.
+    """
+    columns: dict[BudgetGroupBy, Any] = {
+        "project": col(ProjectBudgetLine.project_id),
+        "line_item": col(ProjectBudgetLine.line_item_id),
+        "ifc_type": col(ProjectBudgetLine.ifc_type),
+        "chapter": col(ProjectBudgetLine.chapter),
+        "unit": col(ProjectBudgetLine.unit),
+    }
+    key = columns[group_by]
+    amount = col(ProjectBudgetLine.qty) * line_unit_price(price_as_of)
+    statement: Any = (
+        select(
+            key,
+            func.count(),
+            func.coalesce(func.sum(ProjectBudgetLine.qty), 0),
+            func.round(func.coalesce(func.sum(amount), 0), 2),
         )
-        items = session.exec(statement).all()
-    return ProjectsPublic(data=items, count=count)
+        .group_by(key)
+        .order_by(key)
+    )
+    statement = join_line_prices(statement, price_as_of)
+    if not current_user.is_superuser:
+        statement = statement.join(
+            Project, col(Project.id) == ProjectBudgetLine.project_id
+        ).where(Project.owner_id == current_user.id)
+    if project_id is not None:
+        statement = statement.where(ProjectBudgetLine.project_id == project_id)
+    rows = (await session.exec(statement)).all()
+    return BudgetTotalsPublic(
+        data=[
+            BudgetTotal(
+                key=None if value is None else str(value),
+                lines=lines,
+                qty=qty,
+                total=total,
+            )
+            for value, lines, qty, total in rows
+        ],
+        group_by=group_by,
+    )
 
 
-@router.get("/{id}", response_model=ProjectPublic)
-def read_project(
-    session: SessionDep, current_user: CurrentUser, id: uuid.UUID
+@router.get(
+    "/{id}",
+    response_model=ProjectPublic,
+    responses={304: {"description": "Not modified (If-None-Match)"}},
+)
+async def read_project(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> Any:
-    """Get project by ID (only owner or superuser)."""
-    obj = session.get(Project, id)
+    """Get project by ID (only owner or superuser).
+    The response carries an ETag; sending it back as If-None-Match returns an
+    empty 304 without reading or serialising data while the project is unchanged.
+    """
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
     if not obj:
         raise HTTPException(status_code=404, detail="Project not found")
     if not current_user.is_superuser and (obj.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
+    if etag_matches(if_none_match, project_etag(obj), weak=True):
+        return Response(status_code=304, headers={"ETag": project_etag(obj)})
+    # Reload version with data so the ETag describes the body actually sent
+    await session.refresh(obj, ["data", "version"])
+    response.headers["ETag"] = project_etag(obj)
     return obj
 
 
 @router.post("/", response_model=ProjectPublic)
-def create_project(
-    *, session: SessionDep, current_user: CurrentUser, project_in: ProjectCreate
+async def create_project(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    project_in: ProjectCreate,
+    response: Response,
 ) -> Any:
     """Create new project owned by current user."""
-    obj = Project.model_validate(project_in, update={"owner_id": current_user.id})
+    obj = Project.model_validate(
+        project_in,
+        update={"owner_id": current_user.id, **summarize_project_data(project_in.data)},
+    )
     session.add(obj)
-    session.commit()
-    session.refresh(obj)
+    record_revision(session, obj, None, current_user.id)
+    await sync_budget_lines(session, obj, None)
+    await session.commit()
+    await session.refresh(obj)
+    response.headers["ETag"] = project_etag(obj)
     return obj
 
 
 @router.put("/{id}", response_model=ProjectPublic)
-def update_project(
-    *, session: SessionDep, current_user: CurrentUser, id: uuid.UUID, project_in: ProjectUpdate
+async def update_project(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    project_in: ProjectUpdate,
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> Any:
-    """Update a project (only owner or superuser)."""
-    obj = session.get(Project, id)
+    """Update a project (only owner or superuser).
+    With If-Match, the update only applies if the project still has that ETag
+    and fails with 412 otherwise.
+    """
+    obj = await session.get(Project, id, with_for_update=True)
     if not obj:
         raise HTTPException(status_code=404, detail="Project not found")
     if not current_user.is_superuser and (obj.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    data = project_in.model_dump(exclude_unset=True)
-    obj.sqlmodel_update(data)
-    session.add(obj)
-    session.commit()
-    session.refresh(obj)
+    check_if_match(obj, if_match)
+    await save_project(
+        session, obj, project_in.model_dump(exclude_unset=True), current_user.id
+    )
+    response.headers["ETag"] = project_etag(obj)
+    return obj
+
+
+@router.patch(
+    "/{id}",
+    response_model=ProjectPublic,
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json-patch+json": {
+                    "schema": {"type": "array", "items": {"type": "object"}}
+                },
+                "application/merge-patch+json": {"schema": {"type": "object"}},
+            }
+        }
+    },
+)
+async def patch_project(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    patch: list[dict[str, Any]] | dict[str, Any] = Body(),
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
+) -> Any:
+    """Partially update a project (only owner or superuser).
+    The patch applies to the document {"name": ..., "data": ...}: a JSON array
+    is a JSON Patch (RFC 6902, e.g. "/data/budgetItems/3/qtyValue"), an object
+    is a JSON Merge Patch (RFC 7396). If-Match is honoured as on PUT.
+    """
+    obj = await session.get(Project, id, with_for_update=True)
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    check_if_match(obj, if_match)
+    # Applied in Python rather than as jsonb_set: save_project needs both
+    # documents anyway to record the revision, summarize and sync budget lines
+    document = project_document(obj)
+    try:
+        if isinstance(patch, list):
+            patched = apply_json_patch(document, patch)
+        else:
+            patched = apply_merge_patch(document, patch)
+    except JsonPatchTestFailed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except JsonPatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not isinstance(patched, dict) or set(patched) - {"name", "data"}:
+        raise HTTPException(status_code=422, detail="Only name and data can be patched")
+    try:
+        project_in = ProjectUpdate.model_validate(patched)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    if project_in.name is None or project_in.data is None:
+        raise HTTPException(status_code=422, detail="name and data cannot be removed")
+    await save_project(session, obj, project_in.model_dump(), current_user.id)
+    response.headers["ETag"] = project_etag(obj)
+    return obj
+
+
+@router.get("/{id}/budget-lines", response_model=ProjectBudgetLinesPublic)
+async def read_project_budget_lines(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    skip: int = 0,
+    limit: int = 100,
+    ifc_type: str | None = None,
+) -> Any:
+    """A project's budget items in order, from the budget line table (only
+    owner or superuser). ``ifc_type`` keeps the lines of that IFC type.
+    """
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    filters: list[Any] = [ProjectBudgetLine.project_id == id]
+    if ifc_type is not None:
+        filters.append(ProjectBudgetLine.ifc_type == ifc_type)
+    count = await count_rows(session, ProjectBudgetLine, *filters, count_type="exact")
+    statement = (
+        select(ProjectBudgetLine)
+        .where(*filters)
+        .order_by(col(ProjectBudgetLine.position))
+        .offset(skip)
+        .limit(limit)
+    )
+    lines = (await session.exec(statement)).all()
+    return ProjectBudgetLinesPublic(data=lines, count=count)
+
+
+@router.get("/{id}/budget", response_model=ProjectBudgetPublic)
+async def read_project_budget(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    price_as_of: datetime | None = None,
+) -> Any:
+    """A project's computed budget (only owner or superuser): exact subtotals
+    by line item, IFC type and chapter, then overheads, profit and tax from
+    data["budgetSettings"]. Served from the cache kept up to date on save.
+    ``price_as_of`` re-prices lines of catalog items at the catalog prices of
+    that date, in one query; lines whose item had no price then keep their own.
+    """
+    obj = await session.get(Project, id)
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    if price_as_of is not None:
+        breakdown = await compute_budget(session, obj, price_as_of)
+    else:
+        budget = await session.get(ProjectBudget, id)
+        if budget is None or budget.version != obj.version:
+            # Projects saved before budgets were cached
+            budget = await save_budget(session, obj, await compute_budget(session, obj))
+            await session.commit()
+        breakdown = BudgetBreakdown.from_json(budget.subtotals)
+    rates = budget_rates(obj.data)
+    return ProjectBudgetPublic(
+        project_id=id,
+        version=obj.version,
+        price_as_of=price_as_of,
+        by_line_item=breakdown.sorted_subtotals("line_item_id"),
+        by_ifc_type=breakdown.sorted_subtotals("ifc_type"),
+        by_chapter=breakdown.sorted_subtotals("chapter"),
+        overhead_pct=rates["overhead"],
+        profit_pct=rates["profit"],
+        tax_pct=rates["tax"],
+        **breakdown.totals(rates),
+    )
+
+
+@router.get("/{id}/budget/export")
+async def export_project_budget(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    format: ExportFormat = "csv",
+) -> StreamingResponse:
+    """Download a project's budget lines in order, with their amounts and
+    catalog codes, as CSV, NDJSON or XLSX (only owner or superuser).
+    """
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    line = ProjectBudgetLine
+    statement = (
+        select(  # type: ignore[call-overload, misc]
+            line.position,
+            line.key,
+            line.express_id,
+            line.name,
+            line.ifc_type,
+            line.chapter,
+            line.qty_name,
+            line.qty,
+            line.unit,
+            line.unit_price,
+            func.round(col(line.qty) * col(line.unit_price), 2).label("amount"),
+            col(LineItem.code).label("line_item_code"),
+        )
+        .outerjoin(LineItem, col(LineItem.id) == line.line_item_id)
+        .where(line.project_id == id)
+        .order_by(col(line.position))
+    )
+    return export_response(statement, format, f"budget-{id}")
+
+
+async def project_model(
+    session: AsyncSession, project_id: uuid.UUID, model_id: uuid.UUID | None
+) -> Model:
+    """Model version ``model_id`` of a project, or its latest one if None."""
+    statement = select(Model).where(Model.project_id == project_id)
+    if model_id is not None:
+        statement = statement.where(Model.id == model_id)
+    model = (
+        await session.exec(statement.order_by(col(Model.version).desc()).limit(1))
+    ).first()
+    if model is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return model
+
+
+@router.get("/{id}/takeoff", response_model=ProjectTakeoff)
+async def read_project_takeoff(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    group_by: str = "type",
+    qty: str | None = None,
+    model_id: uuid.UUID | None = None,
+) -> Any:
+    """Quantity takeoff of a project's IFC model (only owner or superuser): the
+    sum of each element quantity (IfcElementQuantity) per group of elements.
+    - ``group_by`` is a comma-separated list of ``type``, ``storey`` and
+      ``material``; totals are always per quantity name.
+    - ``qty`` keeps the quantities of these comma-separated names only.
+    - ``model_id`` picks a model version, the latest by default.
+    Quantities are extracted once after upload and summed in memory.
+    """
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    keys: list[TakeoffGroupBy] = []
+    for key in filter(None, (key.strip() for key in group_by.split(","))):
+        if key not in get_args(TakeoffGroupBy):
+            raise HTTPException(
+                status_code=400, detail=f"Cannot group the takeoff by {key}"
+            )
+        if key not in keys:
+            keys.append(key)  # type: ignore[arg-type]
+    quantities = None
+    if qty is not None:
+        quantities = {name.strip() for name in qty.split(",") if name.strip()}
+    model = await project_model(session, id, model_id)
+    totals = await anyio.to_thread.run_sync(
+        read_takeoff, model.sha256, keys, quantities
+    )
+    return ProjectTakeoff(
+        project_id=id,
+        model=ModelPublic.model_validate(model),
+        group_by=keys,
+        data=totals,
+    )
+
+
+@router.post("/{id}/budget-lines/batch", response_model=ProjectSummary)
+async def batch_project_budget_lines(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    batch: ProjectBudgetLinesBatch,
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
+) -> Any:
+    """Add, update and remove budget items in one save (only owner or superuser).
+    ``upsert`` items are matched to existing ones by "id" and merged into them,
+    or appended; ``delete`` lists the ids to remove. The project's data, budget
+    lines, version and history are updated together. If-Match is honoured as
+    on PUT.
+    """
+    obj = await session.get(Project, id, with_for_update=True)
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    check_if_match(obj, if_match)
+    if not all(isinstance(item.get("id"), str) for item in batch.upsert):
+        raise HTTPException(
+            status_code=422, detail="Every upserted budget item needs a string id"
+        )
+    data = dict(obj.data or {})
+    items = data.get(BUDGET_ITEMS_KEY)
+    items = list(items) if isinstance(items, list) else []
+    deleted = set(batch.delete)
+    items = [
+        item
+        for item in items
+        if not (isinstance(item, dict) and item.get("id") in deleted)
+    ]
+    data[BUDGET_ITEMS_KEY] = merge_budget_items(items, batch.upsert)
+    await save_project(session, obj, {"data": data}, current_user.id)
+    response.headers["ETag"] = project_etag(obj)
+    return obj
+
+
+@router.post("/{id}/budget/generate", response_model=ProjectBudgetGenerated)
+async def generate_project_budget(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    generate: ProjectBudgetGenerate,
+    response: Response,
+    model_id: uuid.UUID | None = None,
+    if_match: Annotated[str | None, Header()] = None,
+) -> Any:
+    """Budget a project's IFC model with mapping rules (only owner or superuser).
+    - Each rule budgets the elements of ``ifc_class`` that pass all of its
+      ``where`` conditions under the catalog line item ``line_item_code``, for
+      their quantity ``quantity`` times ``factor``.
+    - An element gets one item per line item, from the first rule mapping it
+      there. Items have ids "<express id>-<line item code>" and are merged into
+      the current budget items with those ids, or replace all of them with
+      ``replace``.
+    - ``model_id`` picks a model version, the latest by default.
+    The project's data, budget lines, version and history are updated together.
+    If-Match is honoured as on PUT.
+    """
+    # Matching takes seconds on large models, so the row is only locked once
+    # the items are ready
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    check_if_match(obj, if_match)
+    try:
+        matcher = RuleMatcher(generate.rules)
+    except MappingRuleError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    codes = {rule.line_item_code for rule in generate.rules}
+    line_items = await get_line_items(session, codes=codes)
+    missing = sorted(codes - line_items.keys())
+    if missing:
+        raise HTTPException(
+            status_code=422, detail=f"Line items not found: {', '.join(missing)}"
+        )
+    model = await project_model(session, id, model_id)
+    items, rule_items = await anyio.to_thread.run_sync(
+        generate_budget_items,
+        model.sha256,
+        matcher,
+        {code: line_items[code] for code in codes},
+    )
+    obj = await session.get(
+        Project,
+        id,
+        options=[undefer(Project.data)],  # type: ignore[arg-type]
+        populate_existing=True,
+        with_for_update=True,
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    check_if_match(obj, if_match)
+    data = dict(obj.data or {})
+    if not generate.replace:
+        current = data.get(BUDGET_ITEMS_KEY)
+        items = merge_budget_items(current if isinstance(current, list) else [], items)
+    data[BUDGET_ITEMS_KEY] = items
+    await save_project(session, obj, {"data": data}, current_user.id)
+    response.headers["ETag"] = project_etag(obj)
+    return ProjectBudgetGenerated(
+        project=ProjectSummary.model_validate(obj),
+        model=ModelPublic.model_validate(model),
+        items=len(items),
+        rule_items=rule_items,
+    )
+
+
+@router.get("/{id}/revisions", response_model=ProjectRevisionsPublic)
+async def read_project_revisions(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    skip: int = 0,
+    limit: int = 100,
+) -> Any:
+    """List a project's saved revisions, newest first (only owner or superuser).
+    Old revisions are thinned out to snapshots by the history compactor.
+    """
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    count = await count_rows(
+        session, ProjectRevision, ProjectRevision.project_id == id, count_type="exact"
+    )
+    statement = (
+        select(
+            ProjectRevision.version,
+            ProjectRevision.author_id,
+            ProjectRevision.created_at,
+            col(ProjectRevision.snapshot).is_not(None).label("is_snapshot"),
+        )
+        .where(ProjectRevision.project_id == id)
+        .order_by(col(ProjectRevision.version).desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    rows = (await session.exec(statement)).all()
+    return ProjectRevisionsPublic(
+        data=[
+            ProjectRevisionPublic(
+                version=version,
+                author_id=author_id,
+                created_at=created_at,
+                is_snapshot=is_snapshot,
+            )
+            for version, author_id, created_at, is_snapshot in rows
+        ],
+        count=count,
+    )
+
+
+@router.get("/{id}/revisions/{version}", response_model=ProjectRevisionDocument)
+async def read_project_revision(
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    version: int,
+) -> Any:
+    """Get a project as it was saved at ``version`` (only owner or superuser)."""
+    obj = await session.get(
+        Project,
+        id,
+        options=[defer(Project.data)],  # type: ignore[arg-type]
+    )
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    loaded = await load_revision(session, id, version)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    revision, document = loaded
+    return ProjectRevisionDocument(
+        version=revision.version,
+        author_id=revision.author_id,
+        created_at=revision.created_at,
+        is_snapshot=revision.snapshot is not None,
+        name=document["name"],
+        data=document["data"],
+    )
+
+
+@router.post("/{id}/revisions/{version}/restore", response_model=ProjectPublic)
+async def restore_project_revision(
+    *,
+    session: AsyncSessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    version: int,
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
+) -> Any:
+    """Save a past revision as the project's new current version.
+    History is kept: the restore is itself a new revision. If-Match is
+    honoured as on PUT.
+    """
+    obj = await session.get(Project, id, with_for_update=True)
+    if not obj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not current_user.is_superuser and (obj.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    check_if_match(obj, if_match)
+    loaded = await load_revision(session, id, version)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    _, document = loaded
+    await save_project(session, obj, dict(document), current_user.id)
+    response.headers["ETag"] = project_etag(obj)
     return obj
 
 
 @router.delete("/{id}")
-def delete_project(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Message:
+async def delete_project(
+    session: AsyncSessionDep, current_user: CurrentPrincipal, id: uuid.UUID
+) -> Message:
     """Delete a project (only owner or superuser)."""
-    obj = session.get(Project, id)
+    obj = await session.get(Project, id)
     if not obj:
         raise HTTPException(status_code=404, detail="Project not found")
     if not current_user.is_superuser and (obj.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    session.delete(obj)
-    session.commit()
+    models = await session.exec(select(Model.sha256).where(Model.project_id == id))
+    sha256s = list(models.all())
+    uploads = await session.exec(
+        select(ModelUpload.id).where(ModelUpload.project_id == id)
+    )
+    upload_ids = list(uploads.all())
+    await session.delete(obj)
+    await session.flush()
+    # Its models and uploads went with it
+    unused = await drop_unused_blobs(session, sha256s)
+    await session.commit()
+    remove_blob_files(unused)
+    remove_upload_files(upload_ids)
     return Message(message="Project deleted successfully")
@@ -1,8 +1,17 @@
+from typing import Any
+
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
-from app.models import Message
+from app.api.pagination import count_cache
+from app.core.cache import TTLCache
+from app.core.hashing import password_hasher
+from app.line_item_cache import line_item_cache
+from app.model_elements import model_elements_cache
+from app.models import CacheStats, Message, PasswordHashingStats
+from app.principal_cache import principal_cache
+from app.takeoff import takeoff_cache
 from app.utils import generate_test_email, send_email
 
 router = APIRouter(prefix="/utils", tags=["utils"])
@@ -26,6 +35,56 @@ def test_email(email_to: EmailStr) -> Message:
     return Message(message="Test email sent")
 
 
+@router.get(
+    "/cache-stats/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=list[CacheStats],
+)
+def cache_stats() -> list[CacheStats]:
+    """
+    Hit/miss counters of the in-process caches of this worker.
+    """
+    caches: list[TTLCache[Any, Any]] = [
+        principal_cache,
+        count_cache,
+        line_item_cache,
+        model_elements_cache,
+        takeoff_cache,
+    ]
+    return [
+        CacheStats(
+            name=cache.name,
+            hits=cache.hits,
+            misses=cache.misses,
+            size=len(cache),
+            maxsize=cache.maxsize,
+        )
+        for cache in caches
+    ]
+
+
+@router.get(
+    "/password-hashing-stats/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=list[PasswordHashingStats],
+)
+def password_hashing_stats() -> list[PasswordHashingStats]:
+    """
+    Per-operation latency of the password hashing pool of this worker.
+    """
+    return [
+        PasswordHashingStats(
+            operation=operation,
+            calls=stats.calls,
+            rejected=stats.rejected,
+            in_flight=password_hasher.in_flight,
+            avg_ms=1000 * stats.total_seconds / stats.calls if stats.calls else 0.0,
+            max_ms=1000 * stats.max_seconds,
+        )
+        for operation, stats in password_hasher.stats.items()
+    ]
+
+
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
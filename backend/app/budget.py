@@ -0,0 +1,441 @@
+import json
+import uuid
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any
+
+from sqlalchemy import delete, insert, or_
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.json_patch import json_equal
+from app.line_item_prices import price_as_of as line_item_price_as_of
+from app.models import (
+    BudgetSubtotal,
+    LineItem,
+    LineItemPrice,
+    Project,
+    ProjectBudget,
+    ProjectBudgetLine,
+)
+
+# Saved projects keep the BIM budget panel's BudgetItem list under this key
+BUDGET_ITEMS_KEY = "budgetItems"
+
+# and optional overhead/profit/tax percentages under this one, e.g.
+# {"overheadPct": 10, "profitPct": 5, "taxPct": 18}
+BUDGET_SETTINGS_KEY = "budgetSettings"
+BUDGET_RATE_KEYS = {"overhead": "overheadPct", "profit": "profitPct", "tax": "taxPct"}
+
+# ProjectBudgetLine columns the budget is subtotalled by
+SUBTOTAL_GROUPS = ("line_item_id", "ifc_type", "chapter")
+LINE_AMOUNT_COLUMNS: tuple[Any, ...] = (
+    col(ProjectBudgetLine.line_item_id),
+    col(ProjectBudgetLine.ifc_type),
+    col(ProjectBudgetLine.chapter),
+    col(ProjectBudgetLine.qty),
+    col(ProjectBudgetLine.unit_price),
+)
+
+CENTS = Decimal("0.01")
+
+INT32_RANGE = range(-(2**31), 2**31)
+
+
+def to_decimal(value: Any) -> Decimal | None:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        # str() first so floats keep their shortest repr instead of binary noise
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def to_cents(value: Decimal) -> Decimal:
+    # Half away from zero, like round() in the SQL aggregates and backfills
+    return value.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def budget_items(data: dict[str, Any] | None) -> list[dict[str, Any]] | None:
+    items = (data or {}).get(BUDGET_ITEMS_KEY)
+    if not isinstance(items, list):
+        return None
+    return [item for item in items if isinstance(item, dict)]
+
+
+def merge_budget_items(items: list[Any], upserts: list[dict[str, Any]]) -> list[Any]:
+    """
+    ``items`` with each of ``upserts`` merged into the item with the same "id",
+    or appended when there is none.
+    """
+    items = list(items)
+    positions = {
+        item["id"]: position
+        for position, item in reversed(list(enumerate(items)))
+        if isinstance(item, dict) and isinstance(item.get("id"), str)
+    }
+    for upsert in upserts:
+        position = positions.get(upsert["id"])
+        if position is None:
+            positions[upsert["id"]] = len(items)
+            items.append(upsert)
+        else:
+            items[position] = {**items[position], **upsert}
+    return items
+
+
+def json_size(data: dict[str, Any] | None) -> int:
+    """
+    Bytes of ``data::text`` for the stored jsonb: UTF-8 with ", " and ": "
+    separators, like the summary backfill measures it.
+    """
+    if data is None:
+        return 0
+    return len(json.dumps(data, ensure_ascii=False).encode())
+
+
+def summarize_project_data(data: dict[str, Any] | None) -> dict[str, Any]:
+    """Derived Project columns that let listings skip loading ``data``."""
+    items = budget_items(data)
+    total_cost: Decimal | None = None
+    if items is not None:
+        total_cost = Decimal(0)
+        for item in items:
+            qty = _number(item.get("qtyValue"))
+            unit_price = _number(item.get("unitPrice"))
+            if qty is not None and unit_price is not None:
+                total_cost += qty * unit_price
+        total_cost = to_cents(total_cost)
+    return {
+        "data_size": json_size(data),
+        "item_count": len(items or []),
+        "total_cost": total_cost,
+    }
+
+
+def _string(value: Any) -> str | None:
+    return value if isinstance(value, str) else None
+
+
+def _number(value: Any) -> Decimal | None:
+    # JSON numbers only, the same values the migration backfill can cast
+    if isinstance(value, int | float) and not isinstance(value, bool):
+        return to_decimal(value)
+    return None
+
+
+def _line_item_ref(item: dict[str, Any]) -> tuple[uuid.UUID | None, str | None]:
+    try:
+        line_item_id = uuid.UUID(item["lineItemId"])
+    except (KeyError, TypeError, ValueError, AttributeError):
+        line_item_id = None
+    return line_item_id, _string(item.get("lineItemCode"))
+
+
+def budget_line_row(
+    project_id: uuid.UUID,
+    position: int,
+    item: dict[str, Any],
+    line_items: dict[uuid.UUID | str, uuid.UUID],
+) -> dict[str, Any]:
+    """
+    The ProjectBudgetLine row of one budget item. ``line_items`` maps the
+    catalog ids and codes items refer to onto existing LineItem ids.
+    """
+    express_id = item.get("expressId")
+    line_item_id, line_item_code = _line_item_ref(item)
+    return {
+        "id": uuid.uuid4(),
+        "project_id": project_id,
+        "position": position,
+        "key": _string(item.get("id")),
+        "express_id": express_id
+        if isinstance(express_id, int)
+        and not isinstance(express_id, bool)
+        and express_id in INT32_RANGE
+        else None,
+        "name": _string(item.get("name")),
+        "ifc_type": _string(item.get("type")),
+        "chapter": _string(item.get("chapter")),
+        "qty_name": _string(item.get("qtyName")),
+        "qty": _number(item.get("qtyValue")),
+        "unit": _string(item.get("unit")),
+        "unit_price": _number(item.get("unitPrice")),
+        "line_item_id": (line_item_id and line_items.get(line_item_id))
+        or (line_item_code and line_items.get(line_item_code))
+        or None,
+    }
+
+
+def budget_rates(data: dict[str, Any] | None) -> dict[str, Decimal]:
+    """Overhead, profit and tax percentages from data["budgetSettings"]."""
+    settings = (data or {}).get(BUDGET_SETTINGS_KEY)
+    if not isinstance(settings, dict):
+        settings = {}
+    return {
+        rate: _number(settings.get(key)) or Decimal(0)
+        for rate, key in BUDGET_RATE_KEYS.items()
+    }
+
+
+class BudgetBreakdown:
+    """
+    Exact direct cost of a project's budget lines, subtotalled by line item,
+    IFC type and chapter.
+
+    Lines are added and removed one at a time with Decimal arithmetic, so
+    updating it for the few lines a save changed gives exactly the same result
+    as recomputing it from all of them.
+    """
+
+    def __init__(self) -> None:
+        self.subtotals: dict[str, dict[str | None, tuple[int, Decimal]]] = {
+            group: {} for group in SUBTOTAL_GROUPS
+        }
+
+    @staticmethod
+    def amount(line: Any) -> Decimal:
+        if line["qty"] is None or line["unit_price"] is None:
+            return Decimal(0)
+        return Decimal(line["qty"]) * Decimal(line["unit_price"])
+
+    def add(self, line: Any, sign: int = 1) -> None:
+        amount = self.amount(line) * sign
+        for group, subtotals in self.subtotals.items():
+            key = None if line[group] is None else str(line[group])
+            lines, total = subtotals.get(key, (0, Decimal(0)))
+            if lines + sign == 0:
+                subtotals.pop(key, None)
+            else:
+                subtotals[key] = (lines + sign, total + amount)
+
+    def remove(self, line: Any) -> bool:
+        """
+        Take ``line`` out, or return False and change nothing when it is not
+        in the subtotals (they are stale and have to be recomputed).
+        """
+        for group, subtotals in self.subtotals.items():
+            if (None if line[group] is None else str(line[group])) not in subtotals:
+                return False
+        self.add(line, sign=-1)
+        return True
+
+    def sorted_subtotals(self, group: str) -> list[BudgetSubtotal]:
+        """One group's subtotals in cents, ordered by key, the no-key one last."""
+        return [
+            BudgetSubtotal(key=key, lines=lines, amount=to_cents(amount))
+            for key, (lines, amount) in sorted(
+                self.subtotals[group].items(),
+                key=lambda entry: (entry[0] is None, entry[0] or ""),
+            )
+        ]
+
+    @property
+    def direct_cost(self) -> Decimal:
+        # Every line is in exactly one subtotal of each group
+        return sum(
+            (total for _, total in self.subtotals["ifc_type"].values()), Decimal(0)
+        )
+
+    def totals(self, rates: dict[str, Decimal]) -> dict[str, Decimal]:
+        """The budget summary, each figure rounded to cents as it is shown."""
+        direct_cost = to_cents(self.direct_cost)
+        overhead = to_cents(direct_cost * rates["overhead"] / 100)
+        profit = to_cents(direct_cost * rates["profit"] / 100)
+        subtotal = direct_cost + overhead + profit
+        tax = to_cents(subtotal * rates["tax"] / 100)
+        return {
+            "direct_cost": direct_cost,
+            "overhead": overhead,
+            "profit": profit,
+            "subtotal": subtotal,
+            "tax": tax,
+            "total": subtotal + tax,
+        }
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            group: [
+                [key, lines, str(total)] for key, (lines, total) in subtotals.items()
+            ]
+            for group, subtotals in self.subtotals.items()
+        }
+
+    @classmethod
+    def from_json(cls, value: dict[str, Any]) -> "BudgetBreakdown":
+        breakdown = cls()
+        for group in SUBTOTAL_GROUPS:
+            breakdown.subtotals[group] = {
+                key: (lines, Decimal(total)) for key, lines, total in value[group]
+            }
+        return breakdown
+
+
+async def _resolve_line_items(
+    session: AsyncSession, items: list[dict[str, Any]]
+) -> dict[uuid.UUID | str, uuid.UUID]:
+    ids, codes = set(), set()
+    for item in items:
+        line_item_id, line_item_code = _line_item_ref(item)
+        if line_item_id:
+            ids.add(line_item_id)
+        if line_item_code:
+            codes.add(line_item_code)
+    line_items: dict[uuid.UUID | str, uuid.UUID] = {}
+    if ids or codes:
+        found = await session.exec(
+            select(LineItem.id, LineItem.code).where(
+                or_(col(LineItem.id).in_(ids), col(LineItem.code).in_(codes))
+            )
+        )
+        for id, code in found:
+            line_items[id] = id
+            if code:
+                line_items[code] = id
+    return line_items
+
+
+def line_unit_price(price_as_of: datetime | None) -> Any:
+    """
+    A budget line's unit price: its own, or with ``price_as_of`` the catalog
+    price of its line item at that date when it had one. The query must then
+    be joined with ``join_line_prices``.
+    """
+    if price_as_of is None:
+        return col(ProjectBudgetLine.unit_price)
+    return func.coalesce(
+        col(LineItemPrice.unit_price), col(ProjectBudgetLine.unit_price)
+    )
+
+
+def join_line_prices(statement: Any, price_as_of: datetime | None) -> Any:
+    if price_as_of is None:
+        return statement
+    return statement.outerjoin(
+        LineItemPrice,
+        line_item_price_as_of(ProjectBudgetLine.line_item_id, price_as_of),
+    )
+
+
+async def compute_budget(
+    session: AsyncSession, project: Project, price_as_of: datetime | None = None
+) -> BudgetBreakdown:
+    """
+    Recompute a project's breakdown from all of its budget lines, in a single
+    query. With ``price_as_of`` lines of catalog items are priced as they were
+    at that date (see ``line_unit_price``).
+    """
+    breakdown = BudgetBreakdown()
+    # unit_price, the last amount column, may come from the price history
+    columns: tuple[Any, ...] = (
+        *LINE_AMOUNT_COLUMNS[:-1],
+        line_unit_price(price_as_of).label("unit_price"),
+    )
+    statement = select(*columns).where(col(ProjectBudgetLine.project_id) == project.id)
+    lines = await session.exec(join_line_prices(statement, price_as_of))
+    for line in lines:
+        breakdown.add(line._mapping)
+    return breakdown
+
+
+async def save_budget(
+    session: AsyncSession, project: Project, breakdown: BudgetBreakdown
+) -> ProjectBudget:
+    """Store ``breakdown`` as the project's cached budget for its version."""
+    rates = budget_rates(project.data)
+    totals = breakdown.totals(rates)
+    budget = await session.get(ProjectBudget, project.id)
+    if budget is None:
+        budget = ProjectBudget(project_id=project.id)
+    budget.sqlmodel_update(
+        {
+            "version": project.version,
+            "subtotals": breakdown.to_json(),
+            "direct_cost": breakdown.direct_cost,
+            "overhead_pct": rates["overhead"],
+            "profit_pct": rates["profit"],
+            "tax_pct": rates["tax"],
+            "total": totals["total"],
+        }
+    )
+    session.add(budget)
+    project.budget_total = totals["total"]
+    session.add(project)
+    return budget
+
+
+async def drop_line_item_budgets(
+    session: AsyncSession, line_item_id: uuid.UUID
+) -> None:
+    """
+    Drop the cached budgets of projects with lines of a line item about to be
+    deleted: its subtotals go with it, and they are recomputed when next read.
+    """
+    await session.exec(  # type: ignore[call-overload]
+        delete(ProjectBudget).where(
+            col(ProjectBudget.project_id).in_(
+                select(ProjectBudgetLine.project_id).where(
+                    ProjectBudgetLine.line_item_id == line_item_id
+                )
+            )
+        )
+    )
+
+
+async def sync_budget_lines(
+    session: AsyncSession, project: Project, previous_data: dict[str, Any] | None
+) -> None:
+    """
+    Bring the project's ProjectBudgetLine rows and cached budget up to date
+    after its data changed from ``previous_data``.
+
+    Only the positions whose budget item changed are rewritten, and the cached
+    subtotals are adjusted by exactly those lines when they were current for
+    the previous version; otherwise the budget is recomputed from all lines.
+    """
+    old_items = budget_items(previous_data) or []
+    new_items = budget_items(project.data) or []
+    changed = [
+        position
+        for position in range(max(len(old_items), len(new_items)))
+        if position >= len(old_items)
+        or position >= len(new_items)
+        or not json_equal(old_items[position], new_items[position])
+    ]
+    await session.flush()
+    budget = await session.get(ProjectBudget, project.id)
+    breakdown = None
+    if budget is not None and budget.version == project.version - 1:
+        breakdown = BudgetBreakdown.from_json(budget.subtotals)
+    if changed:
+        removed = await session.exec(  # type: ignore[call-overload]
+            delete(ProjectBudgetLine)
+            .where(
+                col(ProjectBudgetLine.project_id) == project.id,
+                col(ProjectBudgetLine.position).in_(changed),
+            )
+            .returning(*LINE_AMOUNT_COLUMNS)
+        )
+        if breakdown is not None:
+            for line in removed:
+                if not breakdown.remove(line._mapping):
+                    breakdown = None
+                    break
+        added = [
+            new_items[position] for position in changed if position < len(new_items)
+        ]
+        line_items = await _resolve_line_items(session, added)
+        rows = [
+            budget_line_row(project.id, position, new_items[position], line_items)
+            for position in changed
+            if position < len(new_items)
+        ]
+        if rows:
+            await session.exec(insert(ProjectBudgetLine), params=rows)  # type: ignore[call-overload]
+        if breakdown is not None:
+            for row in rows:
+                breakdown.add(row)
+    if breakdown is None:
+        breakdown = await compute_budget(session, project)
+    await save_budget(session, project, breakdown)
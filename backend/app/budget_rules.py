@@ -0,0 +1,426 @@
+"""
+Budget items generated from a stored IFC model by mapping rules.
+
+A rule budgets the elements of an IFC class whose properties pass its
+conditions under a catalog line item, for one of their quantities (see
+MappingRule). The rules of a request are compiled once into a matcher that
+works on columns rather than testing every rule against every element:
+
+- The rows of the model's takeoff (one per element quantity, see
+  app.takeoff) are sorted by IFC type and quantity name, so the candidate
+  rows of a rule are a slice found by binary search.
+- Only the properties the conditions name are read from the file, and
+  quantities come from the takeoff unless a condition names their set. Each
+  one becomes a column of its distinct values and of the value every element
+  has. A condition is tested once per distinct value and turned into a mask
+  over the model's elements, which its rules then index; conditions repeated
+  across rules are evaluated once.
+"""
+
+import json
+import re
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from app.model_elements import REF, ElementIndex, open_model_elements, property_value
+from app.models import LineItemPublic, MappingRule, MappingRuleCondition
+from app.step_file import Ref, StepFile, decode_string
+from app.takeoff import (
+    QUANTITY,
+    TRAILING_REFS,
+    Takeoff,
+    join_definitions,
+    open_takeoff,
+)
+
+# Properties whose values conditions compare, besides quantities
+PROPERTY_TYPES = (
+    "IFCPROPERTYSINGLEVALUE",
+    "IFCPROPERTYENUMERATEDVALUE",
+    "IFCPROPERTYLISTVALUE",
+)
+# The Name properties and quantities start with
+FIRST_STRING = re.compile(rb"#\d+\s*=\s*[A-Z0-9_]+\s*\(\s*'((?:[^']|'')*)'", re.I)
+# The Name of an IfcRoot, after its GlobalId and OwnerHistory
+ROOT_NAME = re.compile(
+    rb"#\d+\s*=\s*[A-Z0-9_]+\s*\(\s*'[^']*'\s*,\s*(?:#\d+|\$)\s*,"
+    rb"\s*(?:'((?:[^']|'')*)'|\$)",
+    re.I,
+)
+NUMERIC_OPERATORS = {
+    "lt": np.less,
+    "le": np.less_equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+}
+
+PropertyKey = tuple[str | None, str]
+
+
+class MappingRuleError(ValueError):
+    """A mapping rule cannot be compiled."""
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, int | float) and not isinstance(value, bool)
+
+
+def is_scalar(value: Any) -> bool:
+    return value is None or isinstance(value, str | int | float)
+
+
+def value_key(value: Any) -> tuple[bool, Any]:
+    # True == 1 as a dict key, but a boolean property is not a number
+    return isinstance(value, bool), value
+
+
+def property_key(condition: MappingRuleCondition) -> PropertyKey:
+    """The set name (None for any set) and name of a condition's property."""
+    set_name, dot, name = condition.property.partition(".")
+    return (set_name, name) if dot else (None, set_name)
+
+
+def root_name(step: StepFile, id: int) -> str | None:
+    """The Name of IfcRoot entity ``id``."""
+    match = ROOT_NAME.match(step.raw(id))
+    if match is not None:
+        return None if match[1] is None else decode_string(match[1])
+    args = step.entity(id).args
+    return args[2] if len(args) > 2 and isinstance(args[2], str) else None
+
+
+class PropertyColumn:
+    """
+    The values of a property: its distinct ``values``, and for every element
+    having it (by position among the model's elements) the code of its value
+    in them. Each item of a list value is a value.
+    """
+
+    def __init__(
+        self,
+        values: list[Any],
+        positions: npt.NDArray[np.int64],
+        codes: npt.NDArray[np.int64],
+    ) -> None:
+        self.values = values
+        self.positions = positions
+        self.codes = codes
+        self._codes: dict[tuple[bool, Any], int] | None = None
+        self._numbers: npt.NDArray[np.float64] | None = None
+
+    def selected_values(self, op: str, value: Any) -> npt.NDArray[np.bool_]:
+        """Which of the distinct values pass ``op`` (any but "ne") ``value``."""
+        if op in NUMERIC_OPERATORS:
+            if self._numbers is None:
+                self._numbers = np.array(
+                    [float(v) if is_number(v) else np.nan for v in self.values],
+                    dtype=np.float64,
+                )
+            # Comparisons with NaN, the values that are not numbers, are false
+            return NUMERIC_OPERATORS[op](self._numbers, value)  # type: ignore[no-any-return]
+        selected = np.zeros(len(self.values), dtype=bool)
+        if op == "exists":
+            selected[:] = True
+        elif op == "contains":
+            needle = value.casefold()
+            for i, v in enumerate(self.values):
+                selected[i] = isinstance(v, str) and needle in v.casefold()
+        else:
+            if self._codes is None:
+                self._codes = {value_key(v): code for code, v in enumerate(self.values)}
+            for v in value if op == "in" else [value]:
+                code = self._codes.get(value_key(v))
+                if code is not None:
+                    selected[code] = True
+        return selected
+
+    def elements(self, op: str, value: Any, count: int) -> npt.NDArray[np.bool_]:
+        """Mask of the ``count`` elements having a value that passes the test."""
+        mask = np.zeros(count, dtype=bool)
+        mask[self.positions[self.selected_values(op, value)[self.codes]]] = True
+        return mask
+
+
+def property_columns(
+    step: StepFile,
+    elements: ElementIndex,
+    takeoff: Takeoff,
+    element_ids: npt.NDArray[Any],
+    element_of_row: npt.NDArray[np.int64],
+    keys: Collection[PropertyKey],
+) -> dict[PropertyKey, PropertyColumn]:
+    """
+    The columns of properties and quantities ``keys`` over the elements of
+    ``takeoff``: ``element_ids`` (sorted) and, for each row, the position of
+    its element in them. Only properties with a wanted name are parsed, and quantities are
+    read from the takeoff unless a set name is given.
+    """
+    names = {name for _, name in keys}
+    # Quantities are only read for names looked up in a given set, and that
+    # the takeoff has quantities of
+    qualified = {name for set_name, name in keys if set_name is not None}
+    quantity_ids = {name: i for i, name in enumerate(takeoff.tables["quantities"])}
+    set_quantities = qualified & quantity_ids.keys()
+    decoded: dict[bytes, str] = {}
+    # The name and the values (list items apart) of each wanted property or
+    # quantity, and whether it is a quantity
+    found: dict[int, tuple[str, list[tuple[tuple[bool, Any], Any]], bool]] = {}
+    set_types: set[str] = set()
+    quantity_types = (
+        [type for type in step.index.types if type.startswith("IFCQUANTITY")]
+        if set_quantities
+        else []
+    )
+    # Values by the text after the name: most properties repeat a few values
+    parsed: dict[bytes, Any] = {}
+
+    def distinct_values(value: Any) -> list[tuple[tuple[bool, Any], Any]]:
+        items = value if isinstance(value, list) else [value]
+        try:
+            return list({value_key(item): item for item in items}.items())
+        except TypeError:
+            # Nested lists and bounded, table or complex values
+            return []
+
+    for type in (*PROPERTY_TYPES, *quantity_types):
+        quantity = type.startswith("IFCQUANTITY")
+        wanted = set_quantities if quantity else names
+        for id in step.ids_of_type(type):
+            raw = step.raw(id)
+            match = (QUANTITY if quantity else FIRST_STRING).match(raw)
+            if match is None:
+                entity = step.entity(id)
+                if entity.args[0] in wanted:
+                    value = property_value(step, entity)
+                    found[id] = (entity.args[0], distinct_values(value), quantity)
+                    set_types.add(entity.type)
+                continue
+            if (name := decoded.get(match[1])) is None:
+                name = decoded[match[1]] = decode_string(match[1])
+            if name not in wanted:
+                continue
+            if quantity:
+                value = float(match[2])
+            elif (value := parsed.get(raw[match.end() :], parsed)) is parsed:
+                value = parsed[raw[match.end() :]] = property_value(
+                    step, step.entity(id)
+                )
+            found[id] = (name, distinct_values(value), quantity)
+            set_types.add(type)
+
+    # Per key, the set and value code of each occurrence, and the values
+    sets: dict[PropertyKey, list[int]] = {key: [] for key in keys}
+    codes: dict[PropertyKey, list[int]] = {key: [] for key in keys}
+    values: dict[PropertyKey, dict[tuple[bool, Any], tuple[int, Any]]] = {
+        key: {} for key in keys
+    }
+    quantity_sets = any(type.startswith("IFCQUANTITY") for type in set_types)
+    property_sets = any(not type.startswith("IFCQUANTITY") for type in set_types)
+    for set_id in step.ids_of_type(
+        *(["IFCPROPERTYSET"] if property_sets else []),
+        *(["IFCELEMENTQUANTITY"] if quantity_sets else []),
+    ):
+        # HasProperties and Quantities end the sets
+        match = TRAILING_REFS.search(step.raw(set_id))
+        if match is not None:
+            members = [int(id) for id in REF.findall(match[1])]
+        else:
+            refs = step.entity(set_id).args[-1]
+            members = [ref.id for ref in refs or () if isinstance(ref, Ref)]
+        set_name: str | None = None
+        for member in members:
+            if member not in found:
+                continue
+            name, items, quantity = found[member]
+            if qualified and set_name is None:
+                set_name = root_name(step, set_id)
+            for key in dict.fromkeys([(None, name), (set_name, name)]):
+                # Quantities are in the takeoff for keys without a set name
+                if key not in sets or (quantity and key[0] is None):
+                    continue
+                distinct = values[key]
+                for item_key, item in items:
+                    code, _ = distinct.setdefault(item_key, (len(distinct), item))
+                    sets[key].append(set_id)
+                    codes[key].append(code)
+
+    columns = {}
+    for key in keys:
+        element_of, occurrence = join_definitions(
+            elements, np.array(sets[key], dtype=np.int64)
+        )
+        # Elements without quantities are in no budget: leave them out
+        positions = np.searchsorted(element_ids, element_of)
+        inside = positions < len(element_ids)
+        inside[inside] = element_ids[positions[inside]] == element_of[inside]
+        position_parts = [positions[inside]]
+        code_parts = [np.array(codes[key], dtype=np.int64)[occurrence[inside]]]
+        set_name, name = key
+        if set_name is None and name in quantity_ids:
+            rows = np.flatnonzero(takeoff.columns["quantity_id"] == quantity_ids[name])
+            numbers, inverse = np.unique(takeoff.values[rows], return_inverse=True)
+            distinct = values[key]
+            number_codes = [
+                distinct.setdefault((False, number), (len(distinct), number))[0]
+                for number in numbers.tolist()
+            ]
+            position_parts.append(element_of_row[rows])
+            code_parts.append(np.array(number_codes, dtype=np.int64)[inverse])
+        columns[key] = PropertyColumn(
+            [value for _, value in values[key].values()],
+            np.concatenate(position_parts),
+            np.concatenate(code_parts),
+        )
+    return columns
+
+
+def check_condition(condition: MappingRuleCondition) -> None:
+    op, value = condition.op, condition.value
+    if op in NUMERIC_OPERATORS:
+        valid, expected = is_number(value), "a number"
+    elif op == "contains":
+        valid, expected = isinstance(value, str), "a string"
+    elif op == "in":
+        valid = isinstance(value, list) and all(is_scalar(v) for v in value)
+        expected = "a list of strings, numbers or booleans"
+    elif op in ("eq", "ne"):
+        valid, expected = is_scalar(value), "a string, number, boolean or null"
+    else:
+        valid, expected = True, ""
+    if not valid:
+        raise MappingRuleError(
+            f"{condition.property} {op} needs {expected}, not {json.dumps(value)}"
+        )
+
+
+class RuleMatcher:
+    """Mapping rules compiled for evaluation over whole models."""
+
+    def __init__(self, rules: Sequence[MappingRule]) -> None:
+        self.rules = list(rules)
+        for i, rule in enumerate(self.rules, 1):
+            for condition in rule.where:
+                try:
+                    check_condition(condition)
+                except MappingRuleError as e:
+                    raise MappingRuleError(f"Rule {i}: {e}") from None
+        self.keys = {
+            property_key(condition) for rule in self.rules for condition in rule.where
+        }
+        # The last rule of each line item, after which who it was mapped to
+        # is not needed anymore
+        self.last_rules = {rule.line_item_code: i for i, rule in enumerate(self.rules)}
+
+    def match(
+        self, step: StepFile, elements: ElementIndex, takeoff: Takeoff
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """
+        The takeoff rows the rules budget, by rule then express id: the rule
+        and the row of every item. An element is budgeted under a line item
+        by the first rule mapping it there only.
+        """
+        express_ids = takeoff.columns["express_id"]
+        element_ids, element_of_row = np.unique(express_ids, return_inverse=True)
+        columns = property_columns(
+            step, elements, takeoff, element_ids, element_of_row, self.keys
+        )
+        masks: dict[str, npt.NDArray[np.bool_]] = {}
+
+        def passing(condition: MappingRuleCondition) -> npt.NDArray[np.bool_]:
+            key = json.dumps(
+                [condition.property, condition.op, condition.value], sort_keys=True
+            )
+            mask = masks.get(key)
+            if mask is None:
+                column = columns[property_key(condition)]
+                # Elements without the property are not equal to the value
+                op = "eq" if condition.op == "ne" else condition.op
+                mask = column.elements(op, condition.value, len(element_ids))
+                if condition.op == "ne":
+                    mask = ~mask
+                masks[key] = mask
+            return mask
+
+        types = {name: i for i, name in enumerate(takeoff.tables["types"])}
+        quantities = {name: i for i, name in enumerate(takeoff.tables["quantities"])}
+        keys = takeoff.columns["type_id"].astype(np.int64) * len(quantities)
+        keys += takeoff.columns["quantity_id"]
+        order = np.lexsort((express_ids, keys))
+        keys = keys[order]
+
+        rule_ids, rows = [], []
+        mapped: dict[str, npt.NDArray[np.bool_]] = {}
+        for i, rule in enumerate(self.rules):
+            type_id = types.get(rule.ifc_class.upper())
+            quantity_id = quantities.get(rule.quantity)
+            if type_id is not None and quantity_id is not None:
+                key = type_id * len(quantities) + quantity_id
+                start = np.searchsorted(keys, key, side="left")
+                end = np.searchsorted(keys, key, side="right")
+                selected = order[start:end]
+                for condition in rule.where:
+                    selected = selected[passing(condition)[element_of_row[selected]]]
+                element = element_of_row[selected]
+                # Rows are by express id: an element with the quantity in two
+                # sets is budgeted once, as it is once per line item
+                first = np.ones(len(selected), dtype=bool)
+                first[1:] = element[1:] != element[:-1]
+                code = rule.line_item_code
+                if code not in mapped:
+                    mapped[code] = np.zeros(len(element_ids), dtype=bool)
+                first &= ~mapped[code][element]
+                mapped[code][element[first]] = True
+                rule_ids.append(np.full(np.count_nonzero(first), i, dtype=np.int64))
+                rows.append(selected[first])
+            if self.last_rules[rule.line_item_code] == i:
+                mapped.pop(rule.line_item_code, None)
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(rule_ids), np.concatenate(rows)
+
+
+def generate_budget_items(
+    sha256: str, matcher: RuleMatcher, line_items: Mapping[str, LineItemPublic]
+) -> tuple[list[dict[str, Any]], list[int]]:
+    """
+    The budget items the rules of ``matcher`` generate from blob ``sha256``,
+    and how many each rule generated. ``line_items`` are the rules' catalog
+    line items by code. Blocking: call it from a worker thread.
+    """
+    model = open_model_elements(sha256)
+    takeoff = open_takeoff(sha256)
+    rule_ids, rows = matcher.match(model.step, model.elements, takeoff)
+    types, quantities = takeoff.tables["types"], takeoff.tables["quantities"]
+    items = []
+    for rule_id, express_id, type_id, quantity_id, value in zip(
+        rule_ids.tolist(),
+        takeoff.columns["express_id"][rows].tolist(),
+        takeoff.columns["type_id"][rows].tolist(),
+        takeoff.columns["quantity_id"][rows].tolist(),
+        takeoff.values[rows].tolist(),
+        strict=True,
+    ):
+        rule = matcher.rules[rule_id]
+        line_item = line_items[rule.line_item_code]
+        item = {
+            # The same for the same element and line item, so that generating
+            # again updates the items instead of duplicating them
+            "id": f"{express_id}-{rule.line_item_code}",
+            "expressId": express_id,
+            "name": root_name(model.step, express_id) or f"Element {express_id}",
+            "type": types[type_id],
+            "qtyName": quantities[quantity_id],
+            "qtyValue": value * rule.factor,
+            "unit": line_item.unit,
+            "unitPrice": float(line_item.unit_price),
+            "lineItemId": str(line_item.id),
+            "lineItemCode": rule.line_item_code,
+        }
+        if rule.chapter is not None:
+            item["chapter"] = rule.chapter
+        items.append(item)
+    counts = np.bincount(rule_ids, minlength=len(matcher.rules))
+    return items, counts.tolist()
@@ -35,6 +35,15 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # Authenticated principals are cached per worker to skip the user lookup,
+    # and dropped on every worker when the user changes (app.principal_cache);
+    # set either value to 0 to disable the cache
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10_000
+    # bcrypt runs in a process pool per worker (0 means one process per core);
+    # calls beyond the queue depth are rejected with 503
+    PASSWORD_HASH_WORKERS: int = 0
+    PASSWORD_HASH_QUEUE_DEPTH: int = 64
     FRONTEND_HOST: str = "http://localhost:5173"
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
 
@@ -56,6 +65,34 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str = ""
     POSTGRES_DB: str = ""
+    POSTGRES_POOL_SIZE: int = 5
+    POSTGRES_MAX_OVERFLOW: int = 10
+    # Lifetime of list counts requested with count_type=cached
+    LIST_COUNT_CACHE_TTL_SECONDS: int = 30
+    LIST_COUNT_CACHE_MAX_SIZE: int = 1_000
+    # Catalog line items are cached per worker and dropped on every worker when
+    # the catalog changes (Postgres NOTIFY); the TTL is only a backstop. Set
+    # either value to 0 to disable the cache
+    LINE_ITEM_CACHE_TTL_SECONDS: int = 3600
+    LINE_ITEM_CACHE_MAX_SIZE: int = 50_000
+    # Project history: a full snapshot every N revisions bounds reconstruction
+    # to N - 1 deltas. The compactor (every COMPACT_INTERVAL seconds, 0 turns
+    # it off) drops deltas older than RETENTION_DAYS that a later snapshot
+    # supersedes, so old history is kept at snapshot granularity.
+    PROJECT_REVISION_SNAPSHOT_INTERVAL: int = 20
+    PROJECT_REVISION_RETENTION_DAYS: int = 30
+    PROJECT_REVISION_COMPACT_INTERVAL_SECONDS: int = 3600
+    # IFC models are stored on disk by SHA-256 under MODEL_STORAGE_DIR (shared
+    # by all workers); uploads declaring more than MODEL_MAX_SIZE bytes are
+    # refused
+    MODEL_STORAGE_DIR: str = "data/models"
+    MODEL_MAX_SIZE: int = 2 * 1024**3
+    # Models whose element index each worker keeps open (memory-mapped)
+    MODEL_ELEMENTS_CACHE_MAX_SIZE: int = 8
+    MODEL_ELEMENTS_CACHE_TTL_SECONDS: int = 3600
+    # Models whose quantity takeoff columns each worker keeps in memory
+    TAKEOFF_CACHE_MAX_SIZE: int = 8
+    TAKEOFF_CACHE_TTL_SECONDS: int = 3600
 
     @computed_field  # type: ignore[prop-decorator]
     @property
@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from app.core.config import settings
+from app.core.security import get_password_hash, verify_password
+
+T = TypeVar("T")
+
+
+class HashingQueueFullError(Exception):
+    """Raised when the hashing service already has ``queue_depth`` calls pending."""
+
+
+class HashingUnavailableError(Exception):
+    """Raised when the worker pool breaks again right after being replaced."""
+
+
+@dataclass
+class HashingOperationStats:
+    calls: int = 0
+    rejected: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated process pool so hashing never occupies the AnyIO
+    threadpool or the event loop, and concurrent logins use every core.
+
+    At most ``queue_depth`` calls may be running or waiting at once; anything
+    beyond that is rejected immediately with ``HashingQueueFullError`` instead of
+    queueing unboundedly behind a login burst. A broken pool is replaced and the
+    call retried once before giving up with ``HashingUnavailableError``.
+    """
+
+    def __init__(self, *, workers: int, queue_depth: int) -> None:
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.in_flight = 0
+        self.stats = {
+            "hash": HashingOperationStats(),
+            "verify": HashingOperationStats(),
+        }
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn avoids forking a process that already runs threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            # Another call may have replaced it already
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def _run(self, operation: str, fn: Any, *args: Any) -> Any:
+        stats = self.stats[operation]
+        if self.in_flight >= self.queue_depth:
+            stats.rejected += 1
+            raise HashingQueueFullError(operation)
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            # A worker that dies (OOM killer, segfault) breaks the whole pool:
+            # replace it and retry once rather than failing every later call
+            for _ in range(2):
+                executor = self._get_executor()
+                try:
+                    return await loop.run_in_executor(executor, fn, *args)
+                except BrokenProcessPool:
+                    self._replace_executor(executor)
+            raise HashingUnavailableError(operation)
+        finally:
+            self.in_flight -= 1
+            elapsed = time.perf_counter() - start
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+    async def hash_password(self, password: str) -> str:
+        hashed: str = await self._run("hash", get_password_hash, password)
+        return hashed
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        valid: bool = await self._run(
+            "verify", verify_password, plain_password, hashed_password
+        )
+        return valid
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1,
+    queue_depth=settings.PASSWORD_HASH_QUEUE_DEPTH,
+)
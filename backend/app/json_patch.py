@@ -0,0 +1,207 @@
+"""
+JSON Patch (RFC 6902) and JSON Merge Patch (RFC 7396) for JSON documents.
+
+The apply functions return a new document and leave their input untouched, so
+a patch that fails halfway never leaves a partially applied result behind.
+``make_json_patch`` computes the patch between two documents.
+"""
+
+import copy
+import re
+from typing import Any
+
+# RFC 6901 array index: ASCII digits without leading zeros
+ARRAY_INDEX = re.compile(r"0|[1-9][0-9]*")
+
+
+class JsonPatchError(ValueError):
+    """The patch is malformed or does not apply to the document."""
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """A ``test`` operation did not match the document."""
+
+
+def parse_pointer(pointer: str) -> list[str]:
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    return [
+        token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")
+    ]
+
+
+def _array_index(container: list[Any], token: str, *, allow_end: bool) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    if not ARRAY_INDEX.fullmatch(token):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JsonPatchError(f"Array index out of range: {token}")
+    return index
+
+
+def _resolve(doc: Any, tokens: list[str]) -> Any:
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise JsonPatchError(f"Path not found: {token!r}")
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[_array_index(doc, token, allow_end=False)]
+        else:
+            raise JsonPatchError(f"Cannot traverse into a scalar at {token!r}")
+    return doc
+
+
+def _add(doc: Any, tokens: list[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent = _resolve(doc, tokens[:-1])
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, key, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add a member to a scalar at {key!r}")
+    return doc
+
+
+def _remove(doc: Any, tokens: list[str]) -> tuple[Any, Any]:
+    if not tokens:
+        raise JsonPatchError("Cannot remove the whole document")
+    parent = _resolve(doc, tokens[:-1])
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchError(f"Path not found: {key!r}")
+        return doc, parent.pop(key)
+    if isinstance(parent, list):
+        return doc, parent.pop(_array_index(parent, key, allow_end=False))
+    raise JsonPatchError(f"Cannot remove a member of a scalar at {key!r}")
+
+
+def apply_json_patch(doc: Any, operations: list[dict[str, Any]]) -> Any:
+    doc = copy.deepcopy(doc)
+    for operation in operations:
+        op = operation.get("op")
+        path = operation.get("path")
+        if not isinstance(path, str):
+            raise JsonPatchError("Every operation needs a string 'path'")
+        tokens = parse_pointer(path)
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise JsonPatchError(f"'{op}' needs a 'value'")
+        if op == "add":
+            doc = _add(doc, tokens, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            doc, _ = _remove(doc, tokens)
+        elif op == "replace":
+            _resolve(doc, tokens)
+            if tokens:
+                doc, _ = _remove(doc, tokens)
+            doc = _add(doc, tokens, copy.deepcopy(operation["value"]))
+        elif op in ("move", "copy"):
+            from_path = operation.get("from")
+            if not isinstance(from_path, str):
+                raise JsonPatchError(f"'{op}' needs a string 'from'")
+            from_tokens = parse_pointer(from_path)
+            if op == "move":
+                if tokens[: len(from_tokens)] == from_tokens and tokens != from_tokens:
+                    raise JsonPatchError("Cannot move a value into one of its children")
+                doc, value = _remove(doc, from_tokens)
+            else:
+                value = copy.deepcopy(_resolve(doc, from_tokens))
+            doc = _add(doc, tokens, value)
+        elif op == "test":
+            if not json_equal(_resolve(doc, tokens), operation["value"]):
+                raise JsonPatchTestFailed(f"Test failed at {path!r}")
+        else:
+            raise JsonPatchError(f"Unknown operation: {op!r}")
+    return doc
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = copy.deepcopy(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def json_equal(a: Any, b: Any) -> bool:
+    # Unlike ==, keeps JSON's distinction between true/1 and 1/1.0
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(json_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(map(json_equal, a, b))
+    return bool(a == b)
+
+
+def make_json_patch(source: Any, target: Any, path: str = "") -> list[dict[str, Any]]:
+    """
+    A JSON Patch turning ``source`` into ``target``.
+
+    Objects are diffed key by key and arrays element by element after trimming
+    their common prefix and suffix, so editing one field of one array item
+    yields a single ``replace`` rather than a copy of the whole array.
+    """
+    if json_equal(source, target):
+        return []
+    if isinstance(source, dict) and isinstance(target, dict):
+        ops: list[dict[str, Any]] = []
+        for key in source:
+            if key not in target:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in target.items():
+            child = f"{path}/{_escape(key)}"
+            if key in source:
+                ops.extend(make_json_patch(source[key], value, child))
+            else:
+                ops.append({"op": "add", "path": child, "value": copy.deepcopy(value)})
+        return ops
+    if isinstance(source, list) and isinstance(target, list):
+        start = 0
+        while (
+            start < len(source)
+            and start < len(target)
+            and json_equal(source[start], target[start])
+        ):
+            start += 1
+        end = 0
+        while (
+            end < len(source) - start
+            and end < len(target) - start
+            and json_equal(source[-1 - end], target[-1 - end])
+        ):
+            end += 1
+        old = source[start : len(source) - end]
+        new = target[start : len(target) - end]
+        paired = min(len(old), len(new))
+        ops = []
+        for i in range(paired):
+            ops.extend(make_json_patch(old[i], new[i], f"{path}/{start + i}"))
+        for _ in range(len(old) - paired):
+            ops.append({"op": "remove", "path": f"{path}/{start + paired}"})
+        for i in range(paired, len(new)):
+            ops.append(
+                {
+                    "op": "add",
+                    "path": f"{path}/{start + i}",
+                    "value": copy.deepcopy(new[i]),
+                }
+            )
+        return ops
+    return [{"op": "replace", "path": path, "value": copy.deepcopy(target)}]
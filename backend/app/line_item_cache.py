@@ -0,0 +1,139 @@
+"""
+Per-worker cache of catalog line items, kept coherent across workers.
+
+Lookups of line items by id or code are read through a bounded in-process
+cache. Every catalog write sends a NOTIFY on CATALOG_CHANNEL in its own
+transaction, so it is delivered on commit; each worker LISTENs on a connection
+of its own and drops its whole cache when one arrives. The catalog changes
+rarely, so dropping everything is simpler and cheaper than tracking which
+entries a write touched.
+
+The cache is only filled while the listener is connected: a worker that may
+have missed notifications reads from the database instead.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections.abc import Collection
+from typing import Any
+
+import psycopg
+from psycopg import sql
+from sqlalchemy import Uuid, any_, bindparam, or_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import String, col, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import LineItem, LineItemPublic
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = "lineitem_changed"
+LISTEN_RETRY_SECONDS = 5
+
+# Keyed by id (UUID) and by code (str)
+line_item_cache: TTLCache[uuid.UUID | str, LineItemPublic] = TTLCache(
+    name="line-items",
+    maxsize=settings.LINE_ITEM_CACHE_MAX_SIZE,
+    ttl=settings.LINE_ITEM_CACHE_TTL_SECONDS,
+)
+
+_listening = False
+# Bumped on every invalidation, so a lookup that raced with one does not put
+# what it read before the change back into the cache
+_generation = 0
+
+
+def invalidate_line_items() -> None:
+    global _generation
+    _generation += 1
+    line_item_cache.clear()
+
+
+async def notify_line_items_changed(conn: AsyncConnection) -> None:
+    """Tell every worker that the catalog changed, once ``conn`` commits."""
+    await conn.execute(text(f"NOTIFY {CATALOG_CHANNEL}"))
+
+
+def with_ids_or_codes(ids: Collection[uuid.UUID], codes: Collection[str]) -> Any:
+    """Condition matching the line items with any of ``ids`` or ``codes``."""
+    # One array parameter each, rather than an IN list that grows with the batch
+    id_array = bindparam("ids", list(ids), type_=ARRAY(Uuid))
+    code_array = bindparam("codes", list(codes), type_=ARRAY(String))
+    return or_(
+        col(LineItem.id) == any_(id_array), col(LineItem.code) == any_(code_array)
+    )
+
+
+async def get_line_items(
+    session: AsyncSession,
+    *,
+    ids: Collection[uuid.UUID] = (),
+    codes: Collection[str] = (),
+) -> dict[uuid.UUID | str, LineItemPublic]:
+    """
+    The line items with any of ``ids`` or ``codes``, keyed by the id or code
+    they were asked by. Missing ones are left out.
+    """
+    found: dict[uuid.UUID | str, LineItemPublic] = {}
+    requested: set[uuid.UUID | str] = {*ids, *codes}
+    for key in requested:
+        item = line_item_cache.get(key)
+        if item is not None:
+            found[key] = item
+    missing_ids = list({id for id in ids if id not in found})
+    missing_codes = list({code for code in codes if code not in found})
+    if not missing_ids and not missing_codes:
+        return found
+
+    generation = _generation
+    statement = select(LineItem).where(with_ids_or_codes(missing_ids, missing_codes))
+    objs = (await session.exec(statement)).all()
+    cache = _listening and generation == _generation
+    for obj in objs:
+        item = LineItemPublic.model_validate(obj)
+        keys: list[uuid.UUID | str] = [item.id]
+        if item.code is not None:
+            keys.append(item.code)
+        for key in keys:
+            if key in requested:
+                found[key] = item
+            if cache:
+                line_item_cache.set(key, item)
+    return found
+
+
+async def listen_for_catalog_changes() -> None:
+    """Drop the cache whenever the catalog changes; runs for the app's lifetime."""
+    global _listening
+    conninfo = async_engine.url.set(drivername="postgresql").render_as_string(
+        hide_password=False
+    )
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(
+                conninfo, autocommit=True
+            ) as conn:
+                await conn.execute(
+                    sql.SQL("LISTEN {}").format(sql.Identifier(CATALOG_CHANNEL))
+                )
+                # Whatever changed before now went unnoticed
+                invalidate_line_items()
+                _listening = True
+                async for _ in conn.notifies():
+                    invalidate_line_items()
+        except (psycopg.Error, OSError):
+            logger.warning(
+                "Line item cache listener disconnected, retrying in %ss",
+                LISTEN_RETRY_SECONDS,
+                exc_info=True,
+            )
+        finally:
+            _listening = False
+            invalidate_line_items()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
@@ -0,0 +1,94 @@
+"""
+Delta sync of the line item catalog.
+
+A client keeps a copy of the catalog and asks for what changed after a
+watermark: line items whose ``updated_at`` is later, and deletions logged in
+``lineitemdeletion`` by a trigger. Both are read in (timestamp, id) order off
+their own index, merged, and the watermark is the (timestamp, id) of the last
+change returned, encoded like a list cursor.
+
+Timestamps are those of the writing transaction's start, so a transaction
+still in progress may later commit changes dated before ones already visible.
+Only changes dated before the start of the oldest open transaction are
+returned; the rest wait for the next sync, so none is ever skipped.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import literal, tuple_
+from sqlmodel import col, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.api.pagination import decode_cursor, encode_cursor
+from app.models import LineItem, LineItemChanges, LineItemDeletion, LineItemPublic
+
+# Changes of transactions still open are dated after this
+HORIZON = text(
+    """
+    SELECT least(clock_timestamp(), min(xact_start)) FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_type = 'client backend'
+        AND pid <> pg_backend_pid()
+    """
+)
+
+
+def _window(
+    changed_at: Any,
+    id: Any,
+    after: tuple[datetime, uuid.UUID] | None,
+    horizon: datetime,
+) -> list[Any]:
+    conditions = [changed_at < horizon]
+    if after is not None:
+        conditions.append(
+            tuple_(changed_at, id) > tuple_(literal(after[0]), literal(after[1]))
+        )
+    return conditions
+
+
+async def line_item_changes(
+    session: AsyncSession, since: str | None, limit: int
+) -> LineItemChanges:
+    """Up to ``limit`` catalog changes after the watermark ``since``, oldest first."""
+    after = decode_cursor(since) if since else None
+    conn = await session.connection()
+    horizon = (await conn.execute(HORIZON)).scalar_one()
+
+    updated = (
+        await session.exec(
+            select(LineItem)
+            .where(*_window(col(LineItem.updated_at), col(LineItem.id), after, horizon))
+            .order_by(col(LineItem.updated_at), col(LineItem.id))
+            .limit(limit + 1)
+        )
+    ).all()
+    deleted = (
+        await session.exec(
+            select(LineItemDeletion)
+            .where(
+                *_window(
+                    col(LineItemDeletion.deleted_at),
+                    col(LineItemDeletion.id),
+                    after,
+                    horizon,
+                )
+            )
+            .order_by(col(LineItemDeletion.deleted_at), col(LineItemDeletion.id))
+            .limit(limit + 1)
+        )
+    ).all()
+
+    changes: list[tuple[Any, uuid.UUID, LineItem | None]] = [
+        *((item.updated_at, item.id, item) for item in updated),
+        *((deletion.deleted_at, deletion.id, None) for deletion in deleted),
+    ]
+    changes.sort(key=lambda change: (change[0], change[1]))
+    page = changes[:limit]
+    return LineItemChanges(
+        upserts=[LineItemPublic.model_validate(item) for _, _, item in page if item],
+        deletes=[id for _, id, item in page if item is None],
+        next_since=encode_cursor(page[-1][0], page[-1][1]) if page else since,
+        has_more=len(changes) > limit,
+    )
@@ -0,0 +1,259 @@
+"""
+Bulk import of the line item catalog from CSV or XLSX files.
+
+An upload is spooled to a temporary file and imported by a background job:
+its rows are streamed into a temporary staging table with COPY, checked in
+SQL, and merged into ``lineitem`` by a single ``INSERT ... ON CONFLICT (code)``.
+Rows already in the catalog with the same values are left untouched. The job's
+progress and outcome are kept on a LineItemImport row for clients to poll.
+"""
+
+import csv
+import logging
+import os
+import tempfile
+import uuid
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any
+from zipfile import BadZipFile
+
+import anyio
+import openpyxl
+from fastapi import UploadFile
+from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import update
+from sqlmodel import col, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import async_engine
+from app.line_item_cache import invalidate_line_items, notify_line_items_changed
+from app.line_item_rollup import DerivedPriceError, rollup_line_items
+from app.models import LineItemImport
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ("code", "description", "unit", "unit_price")
+IMPORT_FORMATS = {".csv": "csv", ".xlsx": "xlsx"}
+BATCH_SIZE = 5000
+MAX_ERRORS = 100
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class ImportFileError(ValueError):
+    """The file cannot be read as a catalog."""
+
+
+def import_format(filename: str | None) -> str | None:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return IMPORT_FORMATS.get(extension)
+
+
+async def spool_upload(file: UploadFile, suffix: str) -> str:
+    """Copy an upload to a temporary file, chunk by chunk, and return its path."""
+    fd, path = tempfile.mkstemp(prefix="lineitem-import-", suffix=suffix)
+    os.close(fd)
+    async with await anyio.open_file(path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await out.write(chunk)
+    return path
+
+
+def read_csv(path: str) -> Iterator[list[Any]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        try:
+            dialect: Any = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        yield from csv.reader(f, dialect)
+
+
+def read_xlsx(path: str) -> Iterator[list[Any]]:
+    # Read-only mode streams the sheet instead of loading the whole workbook
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        if sheet is None:
+            return
+        for row in sheet.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def _cell(value: Any) -> str | None:
+    return (str(value).strip() or None) if value is not None else None
+
+
+def import_rows(path: str, format: str) -> Iterator[tuple[Any, ...]]:
+    """
+    Rows of the file as (line, code, description, unit, unit_price), with
+    blank cells as None. The first row must name the columns, in any order.
+    """
+    rows = read_xlsx(path) if format == "xlsx" else read_csv(path)
+    try:
+        names = [(_cell(name) or "").lower() for name in next(rows, None) or []]
+        missing = [column for column in IMPORT_COLUMNS if column not in names]
+        if missing:
+            raise ImportFileError(f"Missing columns: {', '.join(missing)}")
+        positions = [names.index(column) for column in IMPORT_COLUMNS]
+        for line, row in enumerate(rows, start=2):
+            values = [_cell(row[i]) if i < len(row) else None for i in positions]
+            if any(values):
+                yield (line, *values)
+    except (
+        OSError,
+        UnicodeDecodeError,
+        csv.Error,
+        BadZipFile,
+        InvalidFileException,
+    ) as e:
+        raise ImportFileError(f"Cannot read the file: {e}") from e
+
+
+STAGING_TABLE = """
+    CREATE TEMP TABLE lineitem_import_row (
+        line integer PRIMARY KEY,
+        code text,
+        description text,
+        unit text,
+        unit_price text,
+        reason text
+    ) ON COMMIT DROP
+"""
+
+# First problem with each row, if any
+CHECK_ROWS = r"""
+    UPDATE lineitem_import_row SET reason = CASE
+        WHEN code IS NULL THEN 'code is required'
+        WHEN length(code) > 50 THEN 'code is longer than 50 characters'
+        WHEN description IS NULL THEN 'description is required'
+        WHEN length(description) > 255 THEN 'description is longer than 255 characters'
+        WHEN unit IS NULL THEN 'unit is required'
+        WHEN length(unit) > 10 THEN 'unit is longer than 10 characters'
+        WHEN unit_price IS NULL THEN 'unit_price is required'
+        WHEN unit_price !~ '^[0-9]+(\.[0-9]+)?$'
+            THEN 'unit_price must be a non-negative amount'
+        WHEN round(unit_price::numeric, 2) >= 1e10 THEN 'unit_price must be below 10^10'
+    END
+"""
+
+# A code repeated in the file is imported from its last row
+CHECK_DUPLICATES = """
+    UPDATE lineitem_import_row AS r SET reason = 'code is repeated on line ' || d.last
+    FROM (
+        SELECT code, max(line) AS last FROM lineitem_import_row
+        WHERE reason IS NULL GROUP BY code HAVING count(*) > 1
+    ) AS d
+    WHERE r.code = d.code AND r.line < d.last AND r.reason IS NULL
+"""
+
+# xmax is 0 on freshly inserted rows, set on the ones that were updated
+UPSERT = """
+    WITH upserted AS (
+        INSERT INTO lineitem (id, code, description, unit, unit_price)
+        SELECT gen_random_uuid(), code, description, unit, round(unit_price::numeric, 2)
+        FROM lineitem_import_row WHERE reason IS NULL
+        ON CONFLICT (code) DO UPDATE SET
+            description = excluded.description,
+            unit = excluded.unit,
+            unit_price = excluded.unit_price,
+            updated_at = now()
+        WHERE (lineitem.description, lineitem.unit, lineitem.unit_price)
+            IS DISTINCT FROM (excluded.description, excluded.unit, excluded.unit_price)
+        RETURNING id, xmax = 0 AS inserted
+    )
+    SELECT
+        count(*) FILTER (WHERE inserted),
+        count(*) FILTER (WHERE NOT inserted),
+        (SELECT count(*) FROM lineitem_import_row WHERE reason IS NULL),
+        coalesce(array_agg(id) FILTER (WHERE NOT inserted), '{}')
+    FROM upserted
+"""
+
+
+async def set_import(id: uuid.UUID, **values: Any) -> None:
+    async with AsyncSession(async_engine) as session:
+        statement = update(LineItemImport).where(col(LineItemImport.id) == id)
+        await session.exec(statement.values(**values))  # type: ignore[call-overload]
+        await session.commit()
+
+
+async def import_line_items(id: uuid.UUID, path: str, format: str) -> None:
+    rows = import_rows(path, format)
+
+    def next_batch() -> list[tuple[Any, ...]]:
+        return list(islice(rows, BATCH_SIZE))
+
+    async with async_engine.connect() as conn:
+        await conn.exec_driver_sql(STAGING_TABLE)
+        raw: Any = (await conn.get_raw_connection()).driver_connection
+        await set_import(id, status="loading")
+        rows_read = 0
+        # Parsing runs on a worker thread so big files never block the loop
+        while batch := await anyio.to_thread.run_sync(next_batch):
+            async with raw.cursor().copy(
+                "COPY lineitem_import_row (line, code, description, unit, unit_price)"
+                " FROM STDIN"
+            ) as copy:
+                for row in batch:
+                    await copy.write_row(row)
+            rows_read += len(batch)
+            await set_import(id, rows_read=rows_read)
+
+        await set_import(id, status="upserting")
+        await conn.exec_driver_sql("ANALYZE lineitem_import_row")
+        await conn.exec_driver_sql(CHECK_ROWS)
+        await conn.exec_driver_sql(CHECK_DUPLICATES)
+        errors = [
+            {"line": line, "code": code, "reason": reason}
+            for line, code, reason in await conn.exec_driver_sql(
+                "SELECT line, code, reason FROM lineitem_import_row"
+                f" WHERE reason IS NOT NULL ORDER BY line LIMIT {MAX_ERRORS}"
+            )
+        ]
+        inserted, updated, valid, updated_ids = (await conn.execute(text(UPSERT))).one()
+        # Composites priced in the file get their derived price back
+        try:
+            await rollup_line_items(conn, updated_ids)
+        except DerivedPriceError as e:
+            raise ImportFileError(f"Derived unit price of line item {e} is too large")
+        if inserted or updated:
+            await notify_line_items_changed(conn)
+        await conn.commit()
+    invalidate_line_items()
+    await set_import(
+        id,
+        status="done",
+        inserted=inserted,
+        updated=updated,
+        unchanged=valid - inserted - updated,
+        rejected=rows_read - valid,
+        errors=errors,
+        finished_at=datetime.now(timezone.utc),
+    )
+
+
+async def run_import(id: uuid.UUID, path: str, format: str) -> None:
+    """Background job for an import; removes the spooled file when done."""
+    try:
+        await import_line_items(id, path, format)
+    except ImportFileError as e:
+        await set_import(
+            id,
+            status="failed",
+            detail=str(e)[:255],
+            finished_at=datetime.now(timezone.utc),
+        )
+    except Exception:
+        logger.exception("Line item import %s failed", id)
+        await set_import(
+            id,
+            status="failed",
+            detail="Unexpected error while importing",
+            finished_at=datetime.now(timezone.utc),
+        )
+    finally:
+        os.unlink(path)
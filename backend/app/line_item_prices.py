@@ -0,0 +1,59 @@
+"""
+Price history of the line item catalog.
+
+Triggers on lineitem keep a LineItemPrice row for every price a line item has
+had, valid over [valid_from, valid_to). The price in effect at a date is found
+through the GiST index of their exclusion constraint, so pricing a batch of
+line items, or a whole budget, as of any date is a single indexed join.
+"""
+
+import uuid
+from collections.abc import Collection
+from datetime import datetime
+from decimal import Decimal
+from typing import Any
+
+from sqlalchemy import DateTime, and_, cast
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.line_item_cache import with_ids_or_codes
+from app.models import LineItem, LineItemPrice
+
+
+def in_effect_at(at: datetime) -> Any:
+    """Condition matching the LineItemPrice rows in effect at ``at``."""
+    # The exclusion constraint's expression, so that its index is used
+    valid = func.tstzrange(col(LineItemPrice.valid_from), col(LineItemPrice.valid_to))
+    return valid.op("@>")(cast(at, DateTime(timezone=True)))
+
+
+def price_as_of(line_item_id: Any, at: datetime) -> Any:
+    """Join condition of LineItemPrice onto ``line_item_id``'s price at ``at``."""
+    return and_(col(LineItemPrice.line_item_id) == line_item_id, in_effect_at(at))
+
+
+async def prices_as_of(
+    session: AsyncSession,
+    at: datetime,
+    *,
+    ids: Collection[uuid.UUID] = (),
+    codes: Collection[str] = (),
+) -> dict[uuid.UUID | str, Decimal]:
+    """
+    Catalog prices at ``at`` of the line items with any of ``ids`` or
+    ``codes``, keyed by the id or code they were asked by. Line items that had
+    no price then are left out.
+    """
+    statement = (
+        select(col(LineItem.id), col(LineItem.code), col(LineItemPrice.unit_price))
+        .join(LineItemPrice, price_as_of(LineItem.id, at))
+        .where(with_ids_or_codes(set(ids), set(codes)))
+    )
+    requested: set[uuid.UUID | str] = {*ids, *codes}
+    prices: dict[uuid.UUID | str, Decimal] = {}
+    for id, code, unit_price in await session.exec(statement):
+        for key in (id, code):
+            if key in requested:
+                prices[key] = unit_price
+    return prices
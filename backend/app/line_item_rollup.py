@@ -0,0 +1,192 @@
+"""
+Composite line items (APU, unit price analysis).
+
+A line item with components is priced from them: its unit_price is the sum of
+each component's quantity (its yield per unit of the parent) times the
+component's unit_price, rounded to cents like Postgres' round(). Components may be composites
+themselves, so compositions form a DAG over the catalog; a composition that
+would close a cycle is refused when it is saved.
+
+When prices or compositions change, ``rollup_line_items`` recomputes only the
+composites that depend on what changed, components before the composites they
+go into, and writes the prices that actually moved. Those writes go through
+lineitem like any other, so they bump ``updated_at`` and land in the price
+history. Rollups and composition changes take a transaction-level advisory
+lock, so concurrent ones never price from each other's stale state.
+"""
+
+import uuid
+from collections.abc import Collection
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import text
+
+from app.models import LineItemComponentIn
+
+CENT = Decimal("0.01")
+# Upper bound of lineitem.unit_price, a NUMERIC(12, 2)
+MAX_UNIT_PRICE = Decimal("1e10")
+
+ROLLUP_LOCK = text("SELECT pg_advisory_xact_lock(hashtext('lineitem_rollup'))")
+
+# The composites among ``ids`` and every composite they go into, directly or
+# through others. UNION stops at rows already seen, so it ends even on cycles
+AFFECTED_COMPOSITES = text(
+    """
+    WITH RECURSIVE affected(id) AS (
+        SELECT parent_id FROM lineitemcomponent
+        WHERE component_id = ANY(CAST(:ids AS uuid[]))
+        UNION
+        SELECT c.parent_id FROM lineitemcomponent c JOIN affected a
+            ON c.component_id = a.id
+    )
+    SELECT id FROM affected
+    UNION
+    SELECT parent_id FROM lineitemcomponent WHERE parent_id = ANY(CAST(:ids AS uuid[]))
+    """
+)
+
+COMPOSITIONS = text(
+    """
+    SELECT c.parent_id, c.component_id, c.quantity, l.unit_price
+    FROM lineitemcomponent c JOIN lineitem l ON l.id = c.component_id
+    WHERE c.parent_id = ANY(CAST(:ids AS uuid[]))
+    """
+)
+
+CURRENT_PRICES = text(
+    "SELECT id, unit_price FROM lineitem WHERE id = ANY(CAST(:ids AS uuid[]))"
+)
+
+SET_PRICES = text(
+    """
+    UPDATE lineitem SET unit_price = p.unit_price, updated_at = now()
+    FROM unnest(CAST(:ids AS uuid[]), CAST(:prices AS numeric[])) AS p(id, unit_price)
+    WHERE lineitem.id = p.id
+    """
+)
+
+# Whether ``parent`` is among ``components`` or anything they are made of
+REACHES_PARENT = text(
+    """
+    WITH RECURSIVE below(id) AS (
+        SELECT unnest(CAST(:components AS uuid[]))
+        UNION
+        SELECT c.component_id FROM lineitemcomponent c JOIN below b
+            ON c.parent_id = b.id
+    )
+    SELECT EXISTS (SELECT FROM below WHERE id = :parent)
+    """
+)
+
+
+class CompositionCycleError(ValueError):
+    """A composition would make a line item a component of itself."""
+
+
+class DerivedPriceError(ValueError):
+    """A derived unit price does not fit in the catalog."""
+
+
+async def set_components(
+    conn: AsyncConnection,
+    parent_id: uuid.UUID,
+    components: Collection[LineItemComponentIn],
+) -> None:
+    """
+    Replace the composition of ``parent_id`` and reprice it and the composites
+    it goes into. The components must exist and not repeat; raises
+    CompositionCycleError if one of them is made of the parent.
+    """
+    await conn.execute(ROLLUP_LOCK)
+    component_ids = [component.line_item_id for component in components]
+    reaches_parent = await conn.execute(
+        REACHES_PARENT, {"components": component_ids, "parent": parent_id}
+    )
+    if reaches_parent.scalar_one():
+        raise CompositionCycleError(str(parent_id))
+    await conn.execute(
+        text("DELETE FROM lineitemcomponent WHERE parent_id = :parent"),
+        {"parent": parent_id},
+    )
+    if components:
+        await conn.execute(
+            text(
+                "INSERT INTO lineitemcomponent (parent_id, component_id, quantity)"
+                " VALUES (:parent, :component, :quantity)"
+            ),
+            [
+                {
+                    "parent": parent_id,
+                    "component": component.line_item_id,
+                    "quantity": component.quantity,
+                }
+                for component in components
+            ],
+        )
+    await rollup_line_items(conn, [parent_id])
+
+
+async def rollup_line_items(conn: AsyncConnection, ids: Collection[uuid.UUID]) -> int:
+    """
+    Reprice the composites among ``ids`` and those depending on them, after
+    their prices or compositions changed in this transaction. Returns how many
+    prices moved.
+    """
+    await conn.execute(ROLLUP_LOCK)
+    affected = list(
+        (await conn.execute(AFFECTED_COMPOSITES, {"ids": list(ids)})).scalars()
+    )
+    if not affected:
+        return 0
+
+    # Components outside ``affected`` keep their price; the others are priced
+    # here once all of their own components are
+    prices: dict[uuid.UUID, Decimal] = {}
+    components: dict[uuid.UUID, list[tuple[uuid.UUID, Decimal]]] = {
+        id: [] for id in affected
+    }
+    pending: dict[uuid.UUID, int] = dict.fromkeys(affected, 0)
+    used_by: dict[uuid.UUID, list[uuid.UUID]] = {}
+    rows = await conn.execute(COMPOSITIONS, {"ids": affected})
+    for parent_id, component_id, quantity, unit_price in rows:
+        components[parent_id].append((component_id, quantity))
+        if component_id in pending:
+            pending[parent_id] += 1
+            used_by.setdefault(component_id, []).append(parent_id)
+        else:
+            prices[component_id] = unit_price
+
+    ready = [id for id, count in pending.items() if count == 0]
+    derived: dict[uuid.UUID, Decimal] = {}
+    while ready:
+        id = ready.pop()
+        price = sum(
+            (
+                quantity * prices[component_id]
+                for component_id, quantity in components[id]
+            ),
+            Decimal(0),
+        ).quantize(CENT, ROUND_HALF_UP)
+        if price >= MAX_UNIT_PRICE:
+            raise DerivedPriceError(str(id))
+        prices[id] = derived[id] = price
+        for parent_id in used_by.get(id, ()):
+            pending[parent_id] -= 1
+            if pending[parent_id] == 0:
+                ready.append(parent_id)
+    if len(derived) < len(affected):
+        raise CompositionCycleError(
+            ", ".join(str(id) for id, count in pending.items() if count)
+        )
+
+    current = dict(
+        (await conn.execute(CURRENT_PRICES, {"ids": affected})).tuples().all()
+    )
+    moved = {id: price for id, price in derived.items() if current[id] != price}
+    if moved:
+        await conn.execute(
+            SET_PRICES, {"ids": list(moved), "prices": list(moved.values())}
+        )
+    return len(moved)
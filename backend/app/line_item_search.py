@@ -0,0 +1,132 @@
+"""
+Ranked search over the line item catalog.
+
+Every lookup is bounded by an index so latency stays flat as the catalog grows:
+
+- Codes starting with the query come first, from the ``lower(code)`` pattern
+  index in code order. Codes are only matched by prefix.
+- Descriptions are matched with Spanish full text search on ``search_vector``
+  (``to_tsvector('spanish', description)``). Only the first SEARCH_CANDIDATES
+  matches are ranked, so a word shared by half the catalog costs no more than
+  a rare one.
+- When nothing matches, each query word is replaced by its closest word in
+  the catalog (pg_trgm similarity on the small ``lineitemword`` table) and
+  the full text search is run once more.
+"""
+
+import re
+from typing import Any
+
+from sqlalchemy import Float, bindparam, literal, or_, union_all
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased
+from sqlmodel import String, col, func, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import LineItem, LineItemSearchHit
+
+SEARCH_CONFIG = "spanish"
+SEARCH_CANDIDATES = 500
+WORD = re.compile(r"\w+")
+
+search_vector = LineItem.__table__.c.search_vector  # type: ignore[attr-defined]
+
+# For each query word, the closest catalog word above the pg_trgm similarity
+# threshold, or the word itself
+CORRECT_WORDS = text(
+    """
+    SELECT coalesce(
+        (SELECT word FROM lineitemword WHERE word % q.word
+         ORDER BY word <-> q.word LIMIT 1),
+        q.word
+    )
+    FROM unnest(:words) WITH ORDINALITY AS q(word, n)
+    ORDER BY q.n
+    """
+).bindparams(bindparam("words", type_=ARRAY(String)))
+
+
+def code_prefix_pattern(q: str) -> str:
+    escaped = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def prefix_tsquery(words: list[str]) -> Any:
+    """
+    All words, the last one as a prefix: what has been typed so far.
+
+    The prefix is also taken unstemmed from the ``simple`` config, since a
+    partial word is often a Spanish stopword ("con", "de", "la") that the
+    search config would drop.
+    """
+    *complete, last = words
+    prefix = func.to_tsquery(SEARCH_CONFIG, f"{last}:*").op("||")(
+        func.to_tsquery("simple", f"{last}:*")
+    )
+    if not complete:
+        return prefix
+    return func.plainto_tsquery(SEARCH_CONFIG, " ".join(complete)).op("&&")(prefix)
+
+
+def search_statement(tsquery: Any, code_pattern: str | None, limit: int) -> Any:
+    # Byte order, so both the LIKE prefix and the ORDER BY use one index
+    code_key = func.lower(LineItem.code).collate("C")
+    code_match = code_key.like(code_pattern) if code_pattern else None
+    branches = []
+    if tsquery is not None:
+        text_hits = select(
+            LineItem,
+            # Normalized to [0, 1) so code matches (rank 1) stay on top
+            func.ts_rank_cd(search_vector, tsquery, 32).label("rank"),
+        ).where(search_vector.op("@@")(tsquery))
+        if code_match is not None:
+            text_hits = text_hits.where(or_(col(LineItem.code).is_(None), ~code_match))
+        branches.append(text_hits.limit(SEARCH_CANDIDATES))
+    if code_match is not None:
+        branches.append(
+            select(LineItem, literal(1.0, Float).label("rank"))
+            .where(code_match)
+            .order_by(code_key)
+            .limit(limit)
+        )
+    hits = union_all(*(branch.subquery().select() for branch in branches)).subquery()
+    item = aliased(LineItem, hits)
+    return (
+        select(item, hits.c.rank).order_by(hits.c.rank.desc(), hits.c.code).limit(limit)
+    )
+
+
+async def correct_words(session: AsyncSession, words: list[str]) -> list[str]:
+    conn = await session.connection()
+    result = await conn.execute(CORRECT_WORDS, {"words": words})
+    return list(result.scalars())
+
+
+async def search_line_items(
+    session: AsyncSession, q: str, *, limit: int, autocomplete: bool = False
+) -> list[LineItemSearchHit]:
+    """
+    Line items matching ``q``, best first.
+
+    With ``autocomplete`` the last word of ``q`` is matched as a prefix, as
+    when completing what a user is typing, and misspellings are not corrected.
+    """
+    q = q.strip()
+    if not q:
+        return []
+    words = WORD.findall(q.lower())
+    code_pattern = code_prefix_pattern(q)
+    if autocomplete:
+        tsquery = prefix_tsquery(words) if words else None
+    else:
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rows = (await session.exec(search_statement(tsquery, code_pattern, limit))).all()
+    if not rows and words and not autocomplete:
+        corrected = await correct_words(session, words)
+        if corrected != words:
+            tsquery = func.plainto_tsquery(SEARCH_CONFIG, " ".join(corrected))
+            rows = (await session.exec(search_statement(tsquery, None, limit))).all()
+    return [
+        LineItemSearchHit.model_validate(item, update={"rank": rank})
+        for item, rank in rows
+    ]
@@ -1,10 +1,24 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
 from app.core.config import settings
+from app.core.db import async_engine
+from app.core.hashing import (
+    HashingQueueFullError,
+    HashingUnavailableError,
+    password_hasher,
+)
+from app.line_item_cache import line_item_cache, listen_for_catalog_changes
+from app.principal_cache import listen_for_principal_changes, principal_cache
+from app.revisions import run_compactor
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -14,12 +28,59 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    compactor = None
+    if settings.PROJECT_REVISION_COMPACT_INTERVAL_SECONDS > 0:
+        compactor = asyncio.create_task(run_compactor())
+    catalog_listener = None
+    if line_item_cache.enabled:
+        catalog_listener = asyncio.create_task(listen_for_catalog_changes())
+    principal_listener = None
+    if principal_cache.enabled:
+        principal_listener = asyncio.create_task(listen_for_principal_changes())
+    yield
+    if compactor is not None:
+        compactor.cancel()
+    if catalog_listener is not None:
+        catalog_listener.cancel()
+    if principal_listener is not None:
+        principal_listener.cancel()
+    password_hasher.shutdown()
+    await async_engine.dispose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
+
+@app.exception_handler(HashingQueueFullError)
+async def hashing_queue_full_handler(
+    _request: Request, _exc: HashingQueueFullError
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many concurrent password operations, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(HashingUnavailableError)
+async def hashing_unavailable_handler(
+    _request: Request, _exc: HashingUnavailableError
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Password hashing is unavailable, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+
 # Set all CORS enabled origins
 if settings.all_cors_origins:
     app.add_middleware(
@@ -0,0 +1,316 @@
+"""
+Properties and quantities of the elements of stored IFC models.
+
+Property sets and quantity sets (IfcElementQuantity) hang off an element
+through IfcRelDefinesByProperties, which points from the relationship to the
+element and not the other way round. Finding them for one element would mean
+scanning every relationship of the file, so that is done once per stored
+file, right after upload, and kept next to the blob:
+
+- ``<sha256>.idx`` is the StepIndex of the file (see app.step_file).
+- ``<sha256>.elements`` maps every element to its property definitions, as
+  sorted arrays (CSR): element ids, where each one's definitions start, and
+  the definition ids.
+
+A request then costs two binary searches and parsing the handful of
+entities it returns, whatever the size of the model. Each worker keeps the
+most recently used models open, memory-mapped. Blobs are immutable and named
+by their content, so what is cached never goes stale.
+"""
+
+import bisect
+import re
+import struct
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import anyio
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.model_storage import blob_path, remove_blob_files
+from app.models import ModelElementPropertySet, ModelElementPublic
+from app.step_file import Entity, Ref, StepFile, Typed, save_atomically
+
+ELEMENTS_MAGIC = b"ELEMIDX1"
+ELEMENTS_HEADER = struct.Struct("<8sQQ2s")
+
+# The related objects and the relating one(s) ending a relationship instance
+RELATED_AND_RELATING = re.compile(
+    rb",\s*\(([#\d\s,]*)\)\s*,\s*(#\d+|\([#\d\s,]*\))\s*\)\s*;\Z"
+)
+REF = re.compile(rb"#(\d+)")
+# IfcGloballyUniqueId: 128 bits in 22 characters of IFC's base 64
+GLOBAL_ID = re.compile(r"[0-9A-Za-z_$]{22}")
+# Nesting of complex properties followed at most, against malformed cycles
+MAX_DEPTH = 8
+
+
+def related_and_relating(step: StepFile, rel_id: int) -> tuple[list[int], list[int]]:
+    """
+    The ids of the related objects and of the relating one(s) of a
+    relationship ending in both, such as IfcRelDefinesByProperties,
+    IfcRelContainedInSpatialStructure or IfcRelAssociatesMaterial.
+    """
+    # These last two parameters are references only: read them off the end of
+    # the instance rather than parsing it all
+    match = RELATED_AND_RELATING.search(step.raw(rel_id))
+    if match is not None:
+        related = [int(id) for id in REF.findall(match[1])]
+        return related, [int(id) for id in REF.findall(match[2])]
+    related_refs, relating = step.entity(rel_id).args[-2:]
+    # IFC4 allows a set of property sets (IfcPropertySetDefinitionSet)
+    relating_refs = relating if isinstance(relating, tuple) else (relating,)
+    return (
+        [ref.id for ref in related_refs or () if isinstance(ref, Ref)],
+        [ref.id for ref in relating_refs if isinstance(ref, Ref)],
+    )
+
+
+class ElementIndex:
+    """The property definitions of every element of a file, by element id."""
+
+    def __init__(
+        self,
+        element_ids: "array[int]",
+        starts: "array[int]",
+        definition_ids: "array[int]",
+    ) -> None:
+        self.element_ids = element_ids
+        self.starts = starts
+        self.definition_ids = definition_ids
+
+    @classmethod
+    def build(cls, step: StepFile) -> "ElementIndex":
+        pairs: list[tuple[int, int]] = []
+        for rel_id in step.ids_of_type("IFCRELDEFINESBYPROPERTIES"):
+            related, definitions = related_and_relating(step, rel_id)
+            pairs.extend(
+                (element, definition)
+                for element in related
+                for definition in definitions
+            )
+        pairs.sort()
+        typecode = step.index.ids.typecode
+        element_ids, starts = array(typecode), array("I")
+        definition_ids = array(typecode, (definition for _, definition in pairs))
+        for i, (element, _) in enumerate(pairs):
+            if not element_ids or element_ids[-1] != element:
+                element_ids.append(element)
+                starts.append(i)
+        starts.append(len(pairs))
+        return cls(element_ids, starts, definition_ids)
+
+    def definitions(self, id: int) -> "array[int]":
+        i = bisect.bisect_left(self.element_ids, id)
+        if i == len(self.element_ids) or self.element_ids[i] != id:
+            return array(self.definition_ids.typecode)
+        return self.definition_ids[self.starts[i] : self.starts[i + 1]]
+
+    def save(self, f: BinaryIO) -> None:
+        f.write(
+            ELEMENTS_HEADER.pack(
+                ELEMENTS_MAGIC,
+                len(self.element_ids),
+                len(self.definition_ids),
+                (self.element_ids.typecode + self.starts.typecode).encode(),
+            )
+        )
+        for column in (self.element_ids, self.starts, self.definition_ids):
+            column.tofile(f)
+
+    @classmethod
+    def load(cls, f: BinaryIO) -> "ElementIndex":
+        magic, elements, definitions, typecodes = ELEMENTS_HEADER.unpack(
+            f.read(ELEMENTS_HEADER.size)
+        )
+        if magic != ELEMENTS_MAGIC:
+            raise ValueError("Not an element index")
+        id_typecode, start_typecode = typecodes.decode()
+        element_ids, starts = array(id_typecode), array(start_typecode)
+        definition_ids = array(id_typecode)
+        element_ids.fromfile(f, elements)
+        starts.fromfile(f, elements + 1)
+        definition_ids.fromfile(f, definitions)
+        return cls(element_ids, starts, definition_ids)
+
+
+def index_paths(sha256: str) -> tuple[Path, Path]:
+    path = blob_path(sha256)
+    return path.with_name(f"{sha256}.idx"), path.with_name(f"{sha256}.elements")
+
+
+def plain(value: Any) -> Any:
+    """A parameter without its IFC type (IFCLABEL('x') is 'x')."""
+    if isinstance(value, Typed):
+        return plain(value.value)
+    if isinstance(value, tuple):
+        return [plain(v) for v in value]
+    return value
+
+
+def property_value(step: StepFile, entity: Entity, depth: int = 0) -> Any:
+    """The value of an IfcProperty or IfcPhysicalQuantity, without IFC types."""
+    args = entity.args
+    if entity.type == "IFCPROPERTYSINGLEVALUE":
+        return plain(args[2])
+    if entity.type in ("IFCPROPERTYENUMERATEDVALUE", "IFCPROPERTYLISTVALUE"):
+        return plain(args[2]) or []
+    if entity.type == "IFCPROPERTYBOUNDEDVALUE":
+        return {"upper": plain(args[2]), "lower": plain(args[3])}
+    if entity.type == "IFCPROPERTYTABLEVALUE":
+        return {"defining": plain(args[2]), "defined": plain(args[3])}
+    if entity.type.startswith("IFCQUANTITY"):
+        return plain(args[3])
+    if entity.type == "IFCCOMPLEXPROPERTY":
+        return properties(step, args[3], depth + 1)
+    if entity.type == "IFCPHYSICALCOMPLEXQUANTITY":
+        return properties(step, args[2], depth + 1)
+    return None
+
+
+def properties(step: StepFile, refs: Any, depth: int = 0) -> dict[str, Any]:
+    """The values of the properties or quantities ``refs``, by name."""
+    if depth > MAX_DEPTH:
+        return {}
+    return {
+        entity.args[0]: property_value(step, entity, depth)
+        for entity in entities(step, refs)
+        if isinstance(entity.args[0], str)
+    }
+
+
+def entities(step: StepFile, refs: Any) -> list[Entity]:
+    return [
+        step.entity(ref.id)
+        for ref in refs or ()
+        if isinstance(ref, Ref) and ref.id in step
+    ]
+
+
+class ModelElements:
+    """An IFC file open for element lookups, with its two indexes."""
+
+    def __init__(self, step: StepFile, elements: ElementIndex) -> None:
+        self.step = step
+        self.elements = elements
+
+    def _property_set(self, entity: Entity, refs: Any) -> ModelElementPropertySet:
+        name = entity.args[2] if len(entity.args) > 2 else None
+        return ModelElementPropertySet(
+            id=entity.id,
+            type=entity.type,
+            name=name if isinstance(name, str) else None,
+            properties=properties(self.step, refs),
+        )
+
+    def element(self, id: int) -> ModelElementPublic:
+        """Element ``id`` with its property and quantity sets; KeyError if absent."""
+        entity = self.step.entity(id)
+        element = ModelElementPublic(
+            id=id,
+            type=entity.type,
+            attributes=list(entity.args),
+            property_sets=[],
+            quantity_sets=[],
+            quantities={},
+        )
+        args = entity.args
+        # IfcRoot: GlobalId, OwnerHistory, Name, Description, ...
+        if (
+            len(args) >= 4
+            and isinstance(args[0], str)
+            and GLOBAL_ID.fullmatch(args[0])
+            and (args[1] is None or isinstance(args[1], Ref))
+        ):
+            element.global_id = args[0]
+            element.name = args[2] if isinstance(args[2], str) else None
+            element.description = args[3] if isinstance(args[3], str) else None
+
+        definitions = [Ref(i) for i in self.elements.definitions(id)]
+        for definition in entities(self.step, definitions):
+            if definition.type == "IFCELEMENTQUANTITY":
+                quantity_set = self._property_set(definition, definition.args[5])
+                element.quantity_sets.append(quantity_set)
+                element.quantities.update(
+                    (name, value)
+                    for name, value in quantity_set.properties.items()
+                    if isinstance(value, int | float) and not isinstance(value, bool)
+                )
+            elif definition.type == "IFCPROPERTYSET":
+                property_set = self._property_set(definition, definition.args[4])
+                element.property_sets.append(property_set)
+            else:
+                # Predefined property sets (IfcDoorLiningProperties...) hold
+                # attributes, not properties
+                element.property_sets.append(self._property_set(definition, ()))
+        return element
+
+
+model_elements_cache: TTLCache[str, ModelElements] = TTLCache(
+    name="model-elements",
+    maxsize=settings.MODEL_ELEMENTS_CACHE_MAX_SIZE,
+    ttl=settings.MODEL_ELEMENTS_CACHE_TTL_SECONDS,
+)
+_opening = threading.Lock()
+
+
+def load_element_index(step: StepFile, path: Path) -> ElementIndex:
+    """The element index of ``step`` saved at ``path``, built there if missing."""
+    if path.exists():
+        with open(path, "rb") as f:
+            return ElementIndex.load(f)
+    elements = ElementIndex.build(step)
+    save_atomically(path, elements.save)
+    return elements
+
+
+def open_model_elements(sha256: str) -> ModelElements:
+    """
+    Blob ``sha256`` open for element lookups, building its indexes if that was
+    not done yet. Blocking: call it from a worker thread.
+    """
+    cached = model_elements_cache.get(sha256)
+    if cached is not None:
+        return cached
+    with _opening:
+        cached = model_elements_cache.get(sha256)
+        if cached is not None:
+            return cached
+        step_path, elements_path = index_paths(sha256)
+        step = StepFile(blob_path(sha256), step_path)
+        model_elements = ModelElements(step, load_element_index(step, elements_path))
+        model_elements_cache.set(sha256, model_elements)
+        return model_elements
+
+
+def index_file(sha256: str) -> None:
+    step_path, elements_path = index_paths(sha256)
+    with StepFile(blob_path(sha256), step_path) as step:
+        load_element_index(step, elements_path)
+
+
+async def index_blob(sha256: str) -> None:
+    """Background job building the indexes of a new blob."""
+    try:
+        await anyio.to_thread.run_sync(index_file, sha256)
+    except FileNotFoundError:
+        # Removed before indexing
+        return
+    if not blob_path(sha256).exists():
+        # Removed while indexing
+        remove_blob_files([sha256])
+
+
+def read_elements(sha256: str, ids: list[int]) -> dict[int, ModelElementPublic | None]:
+    """Elements ``ids`` of blob ``sha256``, None for those that do not exist."""
+    model_elements = open_model_elements(sha256)
+    found: dict[int, ModelElementPublic | None] = {}
+    for id in ids:
+        try:
+            found[id] = model_elements.element(id)
+        except KeyError:
+            found[id] = None
+    return found
@@ -0,0 +1,356 @@
+"""
+Storage of IFC model files.
+
+Files live under ``settings.MODEL_STORAGE_DIR``, shared by every worker:
+
+- ``blobs/<ab>/<sha256>`` is a stored file, named by its SHA-256, so the same
+  IFC uploaded again (to any project) is stored once. ``<sha256>.gz`` next to
+  it is its precompressed variant, written in the background after upload,
+  and other files named ``<sha256>.*`` are indexes built from it.
+- ``uploads/<id>`` holds the bytes received so far of a resumable upload.
+
+Chunks are appended straight from the request stream under an exclusive
+flock on the partial file, so two requests never write one upload at once,
+and the partial file's size is the offset to resume from. A complete upload
+is hashed and moved into ``blobs``, or dropped if that blob is already stored.
+
+Downloads honour single byte ranges (the Starlette version in use does not)
+and serve the gzip variant to clients that accept it when no range is asked.
+"""
+
+import fcntl
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from collections.abc import AsyncIterator
+from pathlib import Path
+from urllib.parse import quote
+
+import anyio
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import delete, exists, update
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import Model, ModelBlob, ModelUpload
+
+IO_CHUNK_SIZE = 1024 * 1024
+BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class UploadOffsetError(Exception):
+    """A chunk does not start where the upload's received bytes end."""
+
+    def __init__(self, offset: int) -> None:
+        super().__init__(offset)
+        self.offset = offset
+
+
+class UploadBusyError(Exception):
+    """Another request is writing to the upload."""
+
+
+class UploadTooLargeError(Exception):
+    """A chunk runs past the declared size of the upload."""
+
+
+class UploadCompletedError(Exception):
+    """The upload was completed by another request."""
+
+
+class UploadHashMismatchError(Exception):
+    """The received file does not have the SHA-256 declared for the upload."""
+
+
+def blob_path(sha256: str, *, compressed: bool = False) -> Path:
+    name = f"{sha256}.gz" if compressed else sha256
+    return Path(settings.MODEL_STORAGE_DIR, "blobs", sha256[:2], name)
+
+
+def upload_path(id: uuid.UUID) -> Path:
+    return Path(settings.MODEL_STORAGE_DIR, "uploads", str(id))
+
+
+def upload_offset(id: uuid.UUID) -> int:
+    try:
+        return upload_path(id).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+async def append_chunk(
+    upload: ModelUpload, offset: int, chunks: AsyncIterator[bytes]
+) -> int:
+    """
+    Append ``chunks`` to ``upload`` if its received bytes end at ``offset``,
+    and return the new offset. What was written stays if the stream breaks.
+    """
+    path = upload_path(upload.id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusyError(str(upload.id))
+        received = os.fstat(f.fileno()).st_size
+        if received != offset:
+            raise UploadOffsetError(received)
+        # Request chunks are small; write them to disk a megabyte at a time
+        buffer = bytearray()
+        async for chunk in chunks:
+            if received + len(buffer) + len(chunk) > upload.size:
+                raise UploadTooLargeError(str(upload.id))
+            buffer += chunk
+            if len(buffer) >= IO_CHUNK_SIZE:
+                await anyio.to_thread.run_sync(f.write, buffer)
+                received += len(buffer)
+                buffer = bytearray()
+        await anyio.to_thread.run_sync(f.write, buffer)
+        return received + len(buffer)
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(IO_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def next_version(session: AsyncSession, project_id: uuid.UUID) -> int:
+    # Serializes concurrent uploads to one project on its advisory lock
+    await session.exec(
+        select(func.pg_advisory_xact_lock(func.hashtext(str(project_id))))
+    )
+    statement = select(func.coalesce(func.max(col(Model.version)), 0)).where(
+        Model.project_id == project_id
+    )
+    version: int = (await session.exec(statement)).one()
+    return version + 1
+
+
+async def locked_blob(session: AsyncSession, sha256: str) -> ModelBlob | None:
+    """The stored blob ``sha256``, locked against removal until commit."""
+    statement = select(ModelBlob).where(ModelBlob.sha256 == sha256)
+    return (await session.exec(statement.with_for_update(key_share=True))).first()
+
+
+async def add_model(
+    session: AsyncSession,
+    blob: ModelBlob,
+    *,
+    project_id: uuid.UUID,
+    filename: str,
+    created_by: uuid.UUID | None,
+) -> Model:
+    """Add ``blob`` as the next model version of a project; the caller commits."""
+    model = Model(
+        project_id=project_id,
+        version=await next_version(session, project_id),
+        filename=filename,
+        sha256=blob.sha256,
+        size=blob.size,
+        created_by=created_by,
+    )
+    session.add(model)
+    return model
+
+
+async def complete_upload(
+    session: AsyncSession, upload: ModelUpload
+) -> tuple[Model, bool]:
+    """
+    Store a fully received upload as the project's next model version. Returns
+    the model and whether its blob is new and still has to be compressed; the
+    caller commits, also when the file does not match its declared SHA-256
+    (UploadHashMismatchError), which drops the upload.
+    """
+    # Deleting the row first makes a concurrent completion wait, then fail
+    statement = delete(ModelUpload).where(col(ModelUpload.id) == upload.id)
+    result = await session.exec(statement)  # type: ignore[call-overload]
+    if not result.rowcount:
+        raise UploadCompletedError(str(upload.id))
+    session.expunge(upload)
+    path = upload_path(upload.id)
+    sha256 = await anyio.to_thread.run_sync(hash_file, path)
+    if upload.sha256 is not None and sha256 != upload.sha256:
+        path.unlink()
+        raise UploadHashMismatchError(sha256)
+    # Two uploads of the same new file wait here for each other, so the
+    # second finds the first one's blob instead of storing it again
+    await session.exec(select(func.pg_advisory_xact_lock(func.hashtext(sha256))))
+    blob = await locked_blob(session, sha256)
+    created = blob is None
+    if blob is None:
+        blob = ModelBlob(sha256=sha256, size=upload.size)
+        session.add(blob)
+        await session.flush()
+        target = blob_path(sha256)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+    else:
+        path.unlink()
+    model = await add_model(
+        session,
+        blob,
+        project_id=upload.project_id,
+        filename=upload.filename,
+        created_by=upload.created_by,
+    )
+    return model, created
+
+
+def compress_file(sha256: str) -> int:
+    source = blob_path(sha256)
+    target = blob_path(sha256, compressed=True)
+    partial = target.with_suffix(".gz.partial")
+    with open(source, "rb") as f, gzip.open(partial, "wb", compresslevel=6) as out:
+        shutil.copyfileobj(f, out, IO_CHUNK_SIZE)
+    os.replace(partial, target)
+    return target.stat().st_size
+
+
+async def compress_blob(sha256: str) -> None:
+    """Background job writing the gzip variant of a new blob."""
+    try:
+        gzip_size = await anyio.to_thread.run_sync(compress_file, sha256)
+    except FileNotFoundError:
+        # Removed while compressing
+        return
+    async with AsyncSession(async_engine) as session:
+        statement = update(ModelBlob).where(col(ModelBlob.sha256) == sha256)
+        result = await session.exec(statement.values(gzip_size=gzip_size))  # type: ignore[call-overload]
+        await session.commit()
+    if not result.rowcount:
+        remove_blob_files([sha256])
+
+
+async def drop_unused_blobs(session: AsyncSession, sha256s: list[str]) -> list[str]:
+    """
+    Delete the blobs among ``sha256s`` no model uses any more and return them;
+    their files are to be removed with remove_blob_files once committed.
+    """
+    if not sha256s:
+        return []
+    statement = (
+        delete(ModelBlob)
+        .where(
+            col(ModelBlob.sha256).in_(sha256s),
+            ~exists().where(col(Model.sha256) == ModelBlob.sha256),
+        )
+        .returning(col(ModelBlob.sha256))
+    )
+    return list((await session.exec(statement)).scalars())  # type: ignore[call-overload]
+
+
+def remove_blob_files(sha256s: list[str]) -> None:
+    for sha256 in sha256s:
+        # The blob, its gzip variant and whatever was derived from it
+        for path in blob_path(sha256).parent.glob(f"{sha256}*"):
+            path.unlink(missing_ok=True)
+
+
+def remove_upload_files(ids: list[uuid.UUID]) -> None:
+    for id in ids:
+        upload_path(id).unlink(missing_ok=True)
+
+
+def byte_range(header: str | None, size: int) -> tuple[int, int] | None | bool:
+    """
+    The inclusive (first, last) byte of a single-range Range header; None
+    when there is none to honour, False when it cannot be satisfied.
+    """
+    match = BYTE_RANGE.fullmatch(header.strip()) if header else None
+    if match is None:
+        # Absent, malformed or multipart: the whole file is sent instead
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        suffix = int(last)
+        if suffix == 0:
+            return False
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if start >= size:
+        return False
+    end = min(int(last), size - 1) if last else size - 1
+    if end < start:
+        return None
+    return start, end
+
+
+async def read_file(path: Path, start: int, length: int) -> AsyncIterator[bytes]:
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(IO_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def blob_response(
+    blob: ModelBlob,
+    filename: str,
+    *,
+    range: str | None,
+    if_range: str | None,
+    if_none_match: str | None,
+    accept_encoding: str | None,
+) -> Response:
+    """Response sending a stored file, or the part of it ``range`` asks for."""
+    etag = f'"{blob.sha256}"'
+    # A Range is only honoured if the file is still the one If-Range names
+    requested = byte_range(range, blob.size) if if_range in (None, etag) else None
+    compressed = (
+        requested is None
+        and blob.gzip_size is not None
+        and accepts_gzip(accept_encoding)
+    )
+    if compressed:
+        etag = f'"{blob.sha256}.gz"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+    }
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if requested is False:
+        headers["Content-Range"] = f"bytes */{blob.size}"
+        return Response(status_code=416, headers=headers)
+
+    path, start, length, status_code = blob_path(blob.sha256), 0, blob.size, 200
+    if isinstance(requested, tuple):
+        start, end = requested
+        length, status_code = end - start + 1, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+    elif compressed:
+        assert blob.gzip_size is not None
+        path, length = blob_path(blob.sha256, compressed=True), blob.gzip_size
+        headers["Content-Encoding"] = "gzip"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(
+        read_file(path, start, length),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
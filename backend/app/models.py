@@ -1,13 +1,32 @@
 import uuid
 from decimal import Decimal
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 from pydantic import EmailStr
-from sqlalchemy import Column, DateTime, JSON, Numeric, text
+from sqlalchemy import (
+    BigInteger,
+    CheckConstraint,
+    Column,
+    Computed,
+    DateTime,
+    Index,
+    Numeric,
+    UniqueConstraint,
+    text,
+)
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, ExcludeConstraint
 from sqlmodel import Field, Relationship, SQLModel
 
 
+# How the ``count`` of a list response was obtained: exact COUNT(*), planner
+# estimate, exact but served from a short-lived cache, or not computed at all
+CountType = Literal["exact", "estimated", "cached", "none"]
+
+# File formats of the streaming export endpoints
+ExportFormat = Literal["csv", "ndjson", "xlsx"]
+
+
 # Shared properties
 class UserBase(SQLModel):
     email: EmailStr = Field(unique=True, index=True, max_length=255)
@@ -45,8 +64,17 @@ class UpdatePassword(SQLModel):
 
 # Database model, database table inferred from class name
 class User(UserBase, table=True):
+    # Keyset pagination of the users list
+    __table_args__ = (Index("ix_user_created_at_id", "created_at", "id"),)
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     hashed_password: str
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
     items: list["Item"] = Relationship(back_populates="owner", cascade_delete=True)
     projects: list["Project"] = Relationship(
         back_populates="owner", cascade_delete=True
@@ -60,7 +88,9 @@ class UserPublic(UserBase):
 
 class UsersPublic(SQLModel):
     data: list[UserPublic]
-    count: int
+    count: int | None
+    count_type: CountType = "exact"
+    next_cursor: str | None = None
 
 
 # Shared properties
@@ -81,11 +111,23 @@ class ItemUpdate(ItemBase):
 
 # Database model, database table inferred from class name
 class Item(ItemBase, table=True):
+    # Keyset pagination of all items (superusers) and of one owner's items
+    __table_args__ = (
+        Index("ix_item_created_at_id", "created_at", "id"),
+        Index("ix_item_owner_id_created_at_id", "owner_id", "created_at", "id"),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     owner_id: uuid.UUID = Field(
         foreign_key="user.id", nullable=False, ondelete="CASCADE"
     )
     owner: User | None = Relationship(back_populates="items")
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
 
 
 # Properties to return via API, id is always required
@@ -96,7 +138,9 @@ class ItemPublic(ItemBase):
 
 class ItemsPublic(SQLModel):
     data: list[ItemPublic]
-    count: int
+    count: int | None
+    count_type: CountType = "exact"
+    next_cursor: str | None = None
 
 
 # Shared properties for Line Items (catalog of unit prices)
@@ -120,6 +164,18 @@ class LineItemUpdate(LineItemBase):
 
 
 class LineItem(LineItemBase, table=True):
+    __table_args__ = (
+        # Keyset pagination of the catalog
+        Index("ix_lineitem_created_at_id", "created_at", "id"),
+        # /line-items/changes
+        Index("ix_lineitem_updated_at_id", "updated_at", "id"),
+        # /line-items/search: full text on description, code prefix
+        Index("ix_lineitem_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_lineitem_lower_code_c", text('lower(code) COLLATE "C"')),
+    )
+    # Maintained by Postgres and only used in WHERE clauses, so never loaded
+    __mapper_args__ = {"exclude_properties": ["search_vector"]}
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     # Ensure uniqueness at the DB level when provided
     code: str | None = Field(
@@ -127,10 +183,19 @@ class LineItem(LineItemBase, table=True):
     )
     # Ensure unit_price has fixed precision/scale NUMERIC(12,2)
     unit_price: Decimal = Field(sa_column=Column(Numeric(12, 2), nullable=False))
+    search_vector: str | None = Field(
+        default=None,
+        sa_column=Column(
+            TSVECTOR,
+            Computed("to_tsvector('spanish'::regconfig, description)", persisted=True),
+        ),
+    )
     # Timestamps managed by DB server defaults
     created_at: datetime | None = Field(
         default=None,
-        sa_column=Column(DateTime(timezone=True), server_default=text("now()")),
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
     )
     updated_at: datetime | None = Field(
         default=None,
@@ -148,7 +213,207 @@ class LineItemPublic(LineItemBase):
 
 class LineItemsPublic(SQLModel):
     data: list[LineItemPublic]
-    count: int
+    count: int | None
+    count_type: CountType = "exact"
+    next_cursor: str | None = None
+
+
+# A component of a composite line item (APU): ``quantity`` units of it (its
+# yield) go into one unit of the parent, whose unit_price is derived from them
+class LineItemComponent(SQLModel, table=True):
+    __table_args__ = (
+        CheckConstraint("quantity > 0", name="lineitemcomponent_quantity_positive"),
+        CheckConstraint("parent_id <> component_id", name="lineitemcomponent_not_self"),
+    )
+
+    parent_id: uuid.UUID = Field(
+        foreign_key="lineitem.id", primary_key=True, ondelete="CASCADE"
+    )
+    # Indexed to find the composites an item goes into
+    component_id: uuid.UUID = Field(
+        foreign_key="lineitem.id", primary_key=True, index=True, ondelete="RESTRICT"
+    )
+    quantity: Decimal = Field(sa_column=Column(Numeric(14, 6), nullable=False))
+
+
+class LineItemComponentIn(SQLModel):
+    line_item_id: uuid.UUID
+    quantity: Decimal = Field(gt=0, max_digits=14, decimal_places=6)
+
+
+# The whole composition of a line item; an empty list makes it a plain one
+class LineItemComponentsUpdate(SQLModel):
+    components: list[LineItemComponentIn] = Field(default=[], max_length=500)
+
+
+class LineItemComponentPublic(SQLModel):
+    line_item: LineItemPublic
+    quantity: Decimal
+    amount: Decimal
+
+
+class LineItemComponentsPublic(SQLModel):
+    data: list[LineItemComponentPublic]
+    unit_price: Decimal
+
+
+# The catalog price of a line item from valid_from until valid_to (null while
+# current), recorded by triggers on lineitem whenever unit_price is set
+class LineItemPrice(SQLModel, table=True):
+    __table_args__ = (
+        # An item has one price at a time; the constraint's GiST index also
+        # finds the price in effect at a date
+        ExcludeConstraint(  # type: ignore[no-untyped-call]
+            (Column("line_item_id"), "="),
+            (text("tstzrange(valid_from, valid_to)"), "&&"),
+            name="lineitemprice_no_overlap",
+            using="gist",
+        ),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    line_item_id: uuid.UUID = Field(
+        foreign_key="lineitem.id", nullable=False, ondelete="CASCADE"
+    )
+    unit_price: Decimal = Field(sa_column=Column(Numeric(12, 2), nullable=False))
+    valid_from: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False)
+    )
+    valid_to: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(timezone=True))
+    )
+
+
+class LineItemPricePublic(SQLModel):
+    unit_price: Decimal
+    valid_from: datetime
+    valid_to: datetime | None
+
+
+class LineItemPricesPublic(SQLModel):
+    data: list[LineItemPricePublic]
+
+
+# Line items to price as of a date, by id and/or by code
+class LineItemPricesQuery(SQLModel):
+    as_of: datetime
+    ids: list[uuid.UUID] = Field(default=[], max_length=1000)
+    codes: list[str] = Field(default=[], max_length=1000)
+
+
+# Every requested id and code, mapped to its catalog price at ``as_of`` or to
+# null if it had none then
+class LineItemPricesAsOf(SQLModel):
+    as_of: datetime
+    ids: dict[uuid.UUID, Decimal | None]
+    codes: dict[str, Decimal | None]
+
+
+# A deleted line item, logged by a trigger on lineitem so that clients syncing
+# the catalog through /line-items/changes learn about deletions too
+class LineItemDeletion(SQLModel, table=True):
+    __table_args__ = (Index("ix_lineitemdeletion_deleted_at_id", "deleted_at", "id"),)
+
+    id: uuid.UUID = Field(primary_key=True)
+    code: str | None = Field(default=None, max_length=50)
+    deleted_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
+
+
+# Catalog changes after a sync watermark: line items added or updated, and
+# the ids of deleted ones. ``next_since`` is the watermark to sync from next.
+class LineItemChanges(SQLModel):
+    upserts: list[LineItemPublic]
+    deletes: list[uuid.UUID]
+    next_since: str | None
+    has_more: bool
+
+
+# Distinct words of the catalog's descriptions, kept by a trigger on lineitem.
+# Search corrects misspelled query words against it with trigram similarity.
+class LineItemWord(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "ix_lineitemword_word_trgm",
+            "word",
+            postgresql_using="gin",
+            postgresql_ops={"word": "gin_trgm_ops"},
+        ),
+    )
+
+    word: str = Field(primary_key=True, max_length=255)
+
+
+# Line items to resolve in one request, by id and/or by code
+class LineItemBatchGet(SQLModel):
+    ids: list[uuid.UUID] = Field(default=[], max_length=1000)
+    codes: list[str] = Field(default=[], max_length=1000)
+
+
+# Every requested id and code, mapped to its line item or to null if missing
+class LineItemBatchGetResults(SQLModel):
+    ids: dict[uuid.UUID, LineItemPublic | None]
+    codes: dict[str, LineItemPublic | None]
+
+
+class LineItemSearchHit(LineItemPublic):
+    rank: float
+
+
+class LineItemSearchResults(SQLModel):
+    data: list[LineItemSearchHit]
+
+
+LineItemImportStatus = Literal["pending", "loading", "upserting", "done", "failed"]
+
+
+# A bulk catalog import, updated as its background job progresses
+class LineItemImport(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    filename: str = Field(max_length=255)
+    status: str = Field(default="pending", max_length=20)
+    rows_read: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+    # The first rejected rows: {"line", "code", "reason"}
+    errors: list[dict[str, Any]] = Field(
+        default_factory=list, sa_column=Column(JSONB, nullable=False)
+    )
+    # Why a failed import failed
+    detail: str | None = Field(default=None, max_length=255)
+    created_by: uuid.UUID | None = Field(
+        default=None, foreign_key="user.id", ondelete="SET NULL"
+    )
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
+    finished_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(timezone=True))
+    )
+
+
+class LineItemImportPublic(SQLModel):
+    id: uuid.UUID
+    filename: str
+    status: LineItemImportStatus
+    rows_read: int
+    inserted: int
+    updated: int
+    unchanged: int
+    rejected: int
+    errors: list[dict[str, Any]]
+    detail: str | None
+    created_at: datetime | None
+    finished_at: datetime | None
 
 
 # Project model to persist saved budget state (as JSON)
@@ -167,16 +432,41 @@ class ProjectUpdate(SQLModel):
 
 
 class Project(ProjectBase, table=True):
+    # Keyset pagination of all projects (superusers) and of one owner's projects
+    __table_args__ = (
+        Index("ix_project_created_at_id", "created_at", "id"),
+        Index("ix_project_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        # Serves the @> containment and @? / @@ JSONPath filters on data
+        Index(
+            "ix_project_data_path_ops",
+            "data",
+            postgresql_using="gin",
+            postgresql_ops={"data": "jsonb_path_ops"},
+        ),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     owner_id: uuid.UUID = Field(
         foreign_key="user.id", nullable=False, ondelete="CASCADE"
     )
-    # Persist arbitrary JSON (PostgreSQL JSON/JSONB)
-    data: dict[str, Any] = Field(sa_column=Column(JSON))
+    # Persist arbitrary JSON as JSONB so it can be indexed and queried in place
+    data: dict[str, Any] = Field(sa_column=Column(JSONB))
+    # Derived from data on every save so listings never have to read it
+    data_size: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    item_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    total_cost: Decimal | None = Field(default=None, sa_column=Column(Numeric(14, 2)))
+    # Grand total of the cached ProjectBudget, overheads, profit and tax included
+    budget_total: Decimal | None = Field(
+        default=None, sa_column=Column(Numeric(16, 2))
+    )
+    # Bumped on every save; the project's ETag and If-Match precondition
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
     owner: Optional["User"] = Relationship(back_populates="projects")
     created_at: datetime | None = Field(
         default=None,
-        sa_column=Column(DateTime(timezone=True), server_default=text("now()")),
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
     )
     updated_at: datetime | None = Field(
         default=None,
@@ -191,11 +481,388 @@ class Project(ProjectBase, table=True):
 class ProjectPublic(ProjectBase):
     id: uuid.UUID
     owner_id: uuid.UUID
+    version: int
+    total_cost: Decimal | None = None
+    budget_total: Decimal | None = None
 
 
 class ProjectsPublic(SQLModel):
     data: list[ProjectPublic]
+    count: int | None
+    count_type: CountType = "exact"
+    next_cursor: str | None = None
+
+
+# Project listing entry without the data document
+class ProjectSummary(SQLModel):
+    id: uuid.UUID
+    name: str
+    owner_id: uuid.UUID
+    created_at: datetime | None
+    updated_at: datetime | None
+    data_size: int
+    item_count: int
+    total_cost: Decimal | None
+    budget_total: Decimal | None
+    version: int
+
+
+class ProjectSummariesPublic(SQLModel):
+    data: list[ProjectSummary]
+    count: int | None
+    count_type: CountType = "exact"
+    next_cursor: str | None = None
+
+
+# One saved version of a project. Every PROJECT_REVISION_SNAPSHOT_INTERVAL-th
+# revision stores the full {"name", "data"} document; the others store the
+# JSON Patch from the previous revision.
+class ProjectRevision(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("project_id", "version"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    project_id: uuid.UUID = Field(
+        foreign_key="project.id", nullable=False, ondelete="CASCADE"
+    )
+    version: int
+    author_id: uuid.UUID | None = Field(
+        default=None, foreign_key="user.id", ondelete="SET NULL"
+    )
+    snapshot: dict[str, Any] | None = Field(
+        default=None,
+        sa_column=Column(JSONB(none_as_null=True)),  # type: ignore[no-untyped-call]
+    )
+    delta: list[dict[str, Any]] | None = Field(
+        default=None,
+        sa_column=Column(JSONB(none_as_null=True)),  # type: ignore[no-untyped-call]
+    )
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
+
+
+class ProjectRevisionPublic(SQLModel):
+    version: int
+    author_id: uuid.UUID | None
+    created_at: datetime
+    is_snapshot: bool
+
+
+class ProjectRevisionsPublic(SQLModel):
+    data: list[ProjectRevisionPublic]
+    count: int
+
+
+class ProjectRevisionDocument(ProjectRevisionPublic):
+    name: str
+    data: dict[str, Any] | None
+
+
+# One entry of a project's data["budgetItems"], rebuilt from it on every save
+# so budgets can be filtered and aggregated in SQL
+class ProjectBudgetLine(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("project_id", "position"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    project_id: uuid.UUID = Field(
+        foreign_key="project.id", nullable=False, ondelete="CASCADE"
+    )
+    position: int
+    # BudgetItem fields: id, expressId, name, type, qtyName, qtyValue, unit,
+    # unitPrice, and the optional chapter the item is budgeted under
+    key: str | None = None
+    express_id: int | None = None
+    name: str | None = None
+    ifc_type: str | None = Field(default=None, index=True)
+    chapter: str | None = None
+    qty_name: str | None = None
+    qty: Decimal | None = Field(default=None, sa_column=Column(Numeric))
+    unit: str | None = None
+    unit_price: Decimal | None = Field(default=None, sa_column=Column(Numeric))
+    # From the item's lineItemId or lineItemCode, if it names a catalog entry
+    line_item_id: uuid.UUID | None = Field(
+        default=None, foreign_key="lineitem.id", ondelete="SET NULL", index=True
+    )
+
+
+class ProjectBudgetLinePublic(SQLModel):
+    position: int
+    key: str | None
+    express_id: int | None
+    name: str | None
+    ifc_type: str | None
+    chapter: str | None
+    qty_name: str | None
+    qty: Decimal | None
+    unit: str | None
+    unit_price: Decimal | None
+    line_item_id: uuid.UUID | None
+
+
+class ProjectBudgetLinesPublic(SQLModel):
+    data: list[ProjectBudgetLinePublic]
+    count: int
+
+
+# Budget items to add or update (matched by their "id") and ids to remove
+class ProjectBudgetLinesBatch(SQLModel):
+    upsert: list[dict[str, Any]] = []
+    delete: list[str] = []
+
+
+BudgetGroupBy = Literal["project", "line_item", "ifc_type", "chapter", "unit"]
+
+
+class BudgetTotal(SQLModel):
+    key: str | None
+    lines: int
+    qty: Decimal
+    total: Decimal
+
+
+class BudgetTotalsPublic(SQLModel):
+    data: list[BudgetTotal]
+    group_by: BudgetGroupBy
+
+
+# Computed budget of a project as of ``version``. ``subtotals`` keeps the exact
+# direct cost of every line item, IFC type and chapter so that a save only has
+# to add and subtract the lines it changed.
+class ProjectBudget(SQLModel, table=True):
+    project_id: uuid.UUID = Field(
+        foreign_key="project.id", primary_key=True, ondelete="CASCADE"
+    )
+    version: int
+    subtotals: dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    direct_cost: Decimal = Field(sa_column=Column(Numeric, nullable=False))
+    overhead_pct: Decimal = Field(sa_column=Column(Numeric, nullable=False))
+    profit_pct: Decimal = Field(sa_column=Column(Numeric, nullable=False))
+    tax_pct: Decimal = Field(sa_column=Column(Numeric, nullable=False))
+    total: Decimal = Field(sa_column=Column(Numeric(16, 2), nullable=False))
+    computed_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            server_default=text("now()"),
+            onupdate=text("now()"),
+            nullable=False,
+        ),
+    )
+
+
+class BudgetSubtotal(SQLModel):
+    key: str | None
+    lines: int
+    amount: Decimal
+
+
+class ProjectBudgetPublic(SQLModel):
+    project_id: uuid.UUID
+    version: int
+    # Catalog prices the budget was evaluated at, if not its own
+    price_as_of: datetime | None = None
+    by_line_item: list[BudgetSubtotal]
+    by_ifc_type: list[BudgetSubtotal]
+    by_chapter: list[BudgetSubtotal]
+    direct_cost: Decimal
+    overhead_pct: Decimal
+    overhead: Decimal
+    profit_pct: Decimal
+    profit: Decimal
+    subtotal: Decimal
+    tax_pct: Decimal
+    tax: Decimal
+    total: Decimal
+
+
+# An IFC file stored once under its SHA-256, however many models use it.
+# gzip_size is set once the precompressed variant has been written
+class ModelBlob(SQLModel, table=True):
+    sha256: str = Field(primary_key=True, min_length=64, max_length=64)
+    size: int = Field(sa_column=Column(BigInteger, nullable=False))
+    gzip_size: int | None = Field(default=None, sa_column=Column(BigInteger))
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
+
+
+# A version of a project's IFC model; versions are numbered from 1 per project
+class Model(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("project_id", "version"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    project_id: uuid.UUID = Field(foreign_key="project.id", ondelete="CASCADE")
+    version: int
+    filename: str = Field(max_length=255)
+    sha256: str = Field(foreign_key="modelblob.sha256", index=True, max_length=64)
+    size: int = Field(sa_column=Column(BigInteger, nullable=False))
+    created_by: uuid.UUID | None = Field(
+        default=None, foreign_key="user.id", ondelete="SET NULL"
+    )
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
+
+
+class ModelPublic(SQLModel):
+    id: uuid.UUID
+    project_id: uuid.UUID
+    version: int
+    filename: str
+    sha256: str
+    size: int
+    created_at: datetime | None
+
+
+class ModelsPublic(SQLModel):
+    data: list[ModelPublic]
+
+
+# A resumable upload of a model. The bytes received so far are the partial
+# file on disk, so an interrupted chunk resumes from whatever reached it
+class ModelUpload(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    project_id: uuid.UUID = Field(foreign_key="project.id", ondelete="CASCADE")
+    filename: str = Field(max_length=255)
+    size: int = Field(sa_column=Column(BigInteger, nullable=False))
+    # The SHA-256 the client declared, checked against the received file
+    sha256: str | None = Field(default=None, max_length=64)
+    created_by: uuid.UUID | None = Field(
+        default=None, foreign_key="user.id", ondelete="SET NULL"
+    )
+    created_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), server_default=text("now()"), nullable=False
+        ),
+    )
+
+
+class ModelUploadCreate(SQLModel):
+    project_id: uuid.UUID
+    filename: str = Field(max_length=255)
+    size: int = Field(gt=0)
+    # When given and already stored for a project the user can access, the
+    # model is created without any upload; otherwise the file must match it
+    sha256: str | None = Field(default=None, regex="^[0-9a-f]{64}$")
+
+
+# ``model`` is set once the upload is complete
+class ModelUploadPublic(SQLModel):
+    id: uuid.UUID | None
+    project_id: uuid.UUID
+    filename: str
+    size: int
+    offset: int
+    model: ModelPublic | None = None
+
+
+# An IfcPropertySet or IfcElementQuantity of an element, its properties or
+# quantities by name. Complex properties and quantities nest as objects
+class ModelElementPropertySet(SQLModel):
+    id: int
+    type: str
+    name: str | None
+    properties: dict[str, Any]
+
+
+# An entity of a model's IFC file, by express id. ``attributes`` are its
+# parameters as written (references as {"id": ...}); the named ones are only
+# set for IfcRoot entities. ``quantities`` flattens the numeric quantities
+class ModelElementPublic(SQLModel):
+    id: int
+    type: str
+    global_id: str | None = None
+    name: str | None = None
+    description: str | None = None
+    attributes: list[Any]
+    property_sets: list[ModelElementPropertySet]
+    quantity_sets: list[ModelElementPropertySet]
+    quantities: dict[str, float]
+
+
+class ModelElementsBatchGet(SQLModel):
+    ids: list[int] = Field(max_length=1000)
+
+
+# Every requested id, mapped to its element or to null if there is none
+class ModelElementsBatchGetResults(SQLModel):
+    ids: dict[int, ModelElementPublic | None]
+
+
+# Keys the quantity takeoff of a model can be grouped by, besides the quantity
+TakeoffGroupBy = Literal["type", "storey", "material"]
+
+
+# Sum of one quantity over a group of elements. The keys not grouped by are
+# null, as are the storey or material of elements that have none
+class TakeoffTotal(SQLModel):
+    type: str | None = None
+    storey: str | None = None
+    material: str | None = None
+    quantity: str
     count: int
+    total: float
+
+
+# Quantity takeoff of a project, from one of its model versions
+class ProjectTakeoff(SQLModel):
+    project_id: uuid.UUID
+    model: ModelPublic
+    group_by: list[TakeoffGroupBy]
+    data: list[TakeoffTotal]
+
+
+# Comparisons a mapping rule can make on a property of an element
+MappingRuleOperator = Literal[
+    "eq", "ne", "in", "lt", "le", "gt", "ge", "contains", "exists"
+]
+
+
+# A test on a property or quantity of an element, named "Name" or
+# "SetName.Name" to only look in that property or quantity set. ``value`` is a
+# list for "in", a string for "contains" and unused by "exists"
+class MappingRuleCondition(SQLModel):
+    property: str = Field(min_length=1, max_length=255)
+    op: MappingRuleOperator = "eq"
+    value: Any = None
+
+
+# Budget the elements of an IFC class that pass every condition: one item per
+# element, for its quantity ``quantity`` times ``factor`` (a unit conversion)
+# of the catalog line item with code ``line_item_code``
+class MappingRule(SQLModel):
+    ifc_class: str = Field(min_length=1, max_length=100)
+    where: list[MappingRuleCondition] = Field(default=[], max_length=20)
+    quantity: str = Field(min_length=1, max_length=255)
+    line_item_code: str = Field(min_length=1, max_length=50)
+    factor: float = Field(default=1, gt=0)
+    chapter: str | None = Field(default=None, max_length=255)
+
+
+# Rules are tried in order; an element mapped to a line item by one rule is
+# not mapped to it again by a later one. ``replace`` discards the current
+# budget items, otherwise the generated ones are merged into them by id
+class ProjectBudgetGenerate(SQLModel):
+    rules: list[MappingRule] = Field(min_length=1, max_length=1000)
+    replace: bool = False
+
+
+# The saved project, and the number of budget items each rule generated
+class ProjectBudgetGenerated(SQLModel):
+    project: ProjectSummary
+    model: ModelPublic
+    items: int
+    rule_items: list[int]
 
 
 # Generic message
@@ -203,6 +870,25 @@ class Message(SQLModel):
     message: str
 
 
+# Hit/miss counters of an in-process cache
+class CacheStats(SQLModel):
+    name: str
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+
+
+# Latency counters of the password hashing process pool
+class PasswordHashingStats(SQLModel):
+    operation: str
+    calls: int
+    rejected: int
+    in_flight: int
+    avg_ms: float
+    max_ms: float
+
+
 # JSON payload containing access token
 class Token(SQLModel):
     access_token: str
@@ -217,3 +903,4 @@ class TokenPayload(SQLModel):
 class NewPassword(SQLModel):
     token: str
     new_password: str = Field(min_length=8, max_length=40)
+
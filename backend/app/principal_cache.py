@@ -0,0 +1,96 @@
+"""
+Per-worker cache of authenticated principals, kept coherent across workers.
+
+The principal of each token is cached by the worker that resolved it. Every
+change to a user (deactivation, a new role or password, deletion) sends a
+NOTIFY on PRINCIPAL_CHANNEL with the user's id in the transaction making it,
+so it is delivered on commit; each worker LISTENs on a connection of its own
+and drops that user's entries when one arrives.
+
+Principals are only cached while the listener is connected: a worker that
+may have missed notifications resolves every token from the database.
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Any
+
+import psycopg
+from psycopg import sql
+from sqlalchemy.engine import make_url
+from sqlmodel import func, select
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.security import Principal
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_CHANNEL = "principal_changed"
+LISTEN_RETRY_SECONDS = 5
+
+PrincipalCache = TTLCache[tuple[str, str], Principal]
+
+# Keyed by (user id, token) so a new login never reuses another token's entry
+principal_cache: PrincipalCache = TTLCache(
+    name="principals",
+    maxsize=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
+
+# The caches whose listener is connected
+_listening: set[int] = set()
+
+
+def is_listening(cache: PrincipalCache = principal_cache) -> bool:
+    return id(cache) in _listening
+
+
+def invalidate_principal(
+    user_id: uuid.UUID | str, cache: PrincipalCache = principal_cache
+) -> None:
+    key_id = str(user_id)
+    cache.invalidate_where(lambda key: key[0] == key_id)
+
+
+def principal_changed(user_id: uuid.UUID) -> Any:
+    """
+    A statement telling every worker that the user changed: run it in the
+    transaction changing the user, so it is delivered once that commits.
+    """
+    return select(func.pg_notify(PRINCIPAL_CHANNEL, str(user_id)))
+
+
+async def listen_for_principal_changes(
+    cache: PrincipalCache = principal_cache,
+) -> None:
+    """Drop changed users from ``cache``; runs for the app's lifetime."""
+    conninfo = (
+        make_url(str(settings.SQLALCHEMY_DATABASE_URI))
+        .set(drivername="postgresql")
+        .render_as_string(hide_password=False)
+    )
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(
+                conninfo, autocommit=True
+            ) as conn:
+                await conn.execute(
+                    sql.SQL("LISTEN {}").format(sql.Identifier(PRINCIPAL_CHANNEL))
+                )
+                # Whatever changed before now went unnoticed
+                cache.clear()
+                _listening.add(id(cache))
+                async for notify in conn.notifies():
+                    invalidate_principal(notify.payload, cache)
+        except (psycopg.Error, OSError):
+            logger.warning(
+                "Principal cache listener disconnected, retrying in %ss",
+                LISTEN_RETRY_SECONDS,
+                exc_info=True,
+            )
+        finally:
+            _listening.discard(id(cache))
+            cache.clear()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
@@ -0,0 +1,130 @@
+"""
+Project revision history.
+
+Each save of a project adds a ProjectRevision for its new version. Most
+revisions only hold the JSON Patch from the previous one; every
+PROJECT_REVISION_SNAPSHOT_INTERVAL-th holds the whole document, so rebuilding
+any revision applies at most that many deltas to the closest snapshot.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import delete, exists
+from sqlalchemy.orm import aliased
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.db import async_engine
+from app.json_patch import apply_json_patch, make_json_patch
+from app.models import Project, ProjectRevision
+
+logger = logging.getLogger(__name__)
+
+
+def project_document(project: Project) -> dict[str, Any]:
+    return {"name": project.name, "data": project.data}
+
+
+def record_revision(
+    session: AsyncSession,
+    project: Project,
+    previous: dict[str, Any] | None,
+    author_id: uuid.UUID | None,
+) -> ProjectRevision:
+    """
+    Add the revision for ``project``'s current version to the session.
+
+    ``previous`` is the document of the version before it, or None for a new
+    project.
+    """
+    document = project_document(project)
+    revision = ProjectRevision(
+        project_id=project.id, version=project.version, author_id=author_id
+    )
+    interval = max(settings.PROJECT_REVISION_SNAPSHOT_INTERVAL, 1)
+    if previous is None or (project.version - 1) % interval == 0:
+        revision.snapshot = document
+    else:
+        revision.delta = make_json_patch(previous, document)
+    session.add(revision)
+    return revision
+
+
+async def load_revision(
+    session: AsyncSession, project_id: uuid.UUID, version: int
+) -> tuple[ProjectRevision, dict[str, Any]] | None:
+    """
+    The revision ``version`` of a project and its rebuilt document, or None if
+    it never existed or has been compacted away.
+    """
+    base = (
+        await session.exec(
+            select(ProjectRevision)
+            .where(
+                ProjectRevision.project_id == project_id,
+                col(ProjectRevision.snapshot).is_not(None),
+                ProjectRevision.version <= version,
+            )
+            .order_by(col(ProjectRevision.version).desc())
+            .limit(1)
+        )
+    ).first()
+    if base is None or base.snapshot is None:
+        return None
+    revision, document = base, base.snapshot
+    deltas = await session.exec(
+        select(ProjectRevision)
+        .where(
+            ProjectRevision.project_id == project_id,
+            ProjectRevision.version > base.version,
+            ProjectRevision.version <= version,
+        )
+        .order_by(col(ProjectRevision.version))
+    )
+    for delta in deltas:
+        if delta.version != revision.version + 1 or delta.delta is None:
+            return None
+        revision, document = delta, apply_json_patch(document, delta.delta)
+    if revision.version != version:
+        return None
+    return revision, document
+
+
+async def compact_revisions(session: AsyncSession, older_than: datetime) -> int:
+    """
+    Delete deltas created before ``older_than`` that a later snapshot makes
+    unnecessary for rebuilding newer revisions. Returns how many were removed.
+    """
+    later_snapshot = aliased(ProjectRevision)
+    statement = delete(ProjectRevision).where(
+        col(ProjectRevision.delta).is_not(None),
+        col(ProjectRevision.created_at) < older_than,
+        exists().where(
+            col(later_snapshot.project_id) == ProjectRevision.project_id,
+            col(later_snapshot.snapshot).is_not(None),
+            col(later_snapshot.version) > ProjectRevision.version,
+        ),
+    )
+    result = await session.exec(statement)  # type: ignore[call-overload]
+    await session.commit()
+    return int(result.rowcount)
+
+
+async def run_compactor() -> None:
+    """Compact revision history every PROJECT_REVISION_COMPACT_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.PROJECT_REVISION_COMPACT_INTERVAL_SECONDS)
+        older_than = datetime.now(timezone.utc) - timedelta(
+            days=settings.PROJECT_REVISION_RETENTION_DAYS
+        )
+        try:
+            async with AsyncSession(async_engine) as session:
+                removed = await compact_revisions(session, older_than)
+            logger.info("Compacted %d project revision deltas", removed)
+        except Exception:
+            logger.exception("Project revision compaction failed")
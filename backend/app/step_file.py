@@ -0,0 +1,365 @@
+"""
+Reading IFC files (STEP physical files, ISO 10303-21) without loading them.
+
+A StepFile maps the file into memory and indexes it in one pass: a regular
+expression matching whole entity instances runs over the DATA section, so the
+scan itself happens in C and Python only handles one match per entity. The
+StepIndex it builds is four parallel arrays (express id, byte offset, byte
+length and type of every instance), about 14 bytes per entity whatever the
+file size, and can be saved next to the file and loaded back in one read.
+
+Entities are only parsed when asked for, from their bytes in the mapping.
+Parameters come back as Python values: None for ``$`` and ``*``, Ref for
+``#123``, Typed for ``IFCLABEL('x')``, str for strings and enumerations
+(``.T.`` and ``.F.`` as booleans), int, float and tuples for lists.
+"""
+
+import bisect
+import mmap
+import os
+import re
+import struct
+import tempfile
+from array import array
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+# An entity instance, "#12=IFCWALL(...);". The parameters are unrolled into
+# runs outside strings and whole strings ('' escapes are two strings in a
+# row), so a ";" inside a string does not end it and matching stays linear
+INSTANCE = re.compile(
+    rb"#(\d+)[ \t\r\n]*=[ \t\r\n]*([A-Za-z0-9_]*)[ \t\r\n]*\("
+    rb"[^';]*(?:'[^']*'[^';]*)*;"
+)
+DATA_SECTION = re.compile(rb"\bDATA\s*(?:\([^;]*\))?\s*;")
+FILE_SCHEMA = re.compile(rb"FILE_SCHEMA\s*\(\s*\(\s*'([^']*)'")
+
+TOKEN = re.compile(
+    rb"""[ \t\r\n]*(?:
+        (?P<string>'(?:[^']|'')*')
+        |\#(?P<ref>\d+)
+        |\.(?P<enum>[A-Za-z0-9_]+)\.
+        |(?P<number>[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+        |(?P<typed>[A-Za-z][A-Za-z0-9_]*)[ \t\r\n]*\(
+        |(?P<open>\()
+        |(?P<close>\))
+        |(?P<comma>,)
+        |(?P<null>[$*])
+        |"(?P<binary>[0-9A-Fa-f]*)"
+    )""",
+    re.VERBOSE,
+)
+STRING_ESCAPE = re.compile(
+    r"\\X2\\((?:[0-9A-Fa-f]{4})+)\\X0\\"
+    r"|\\X4\\((?:[0-9A-Fa-f]{8})+)\\X0\\"
+    r"|\\X\\([0-9A-Fa-f]{2})"
+    r"|\\S\\(.)"
+    r"|\\P[A-I]\\"
+    r"|\\\\"
+)
+
+INDEX_MAGIC = b"STEPIDX1"
+INDEX_HEADER = struct.Struct("<8sQ4sI")
+
+
+class StepSyntaxError(ValueError):
+    """An entity instance cannot be parsed."""
+
+
+@dataclass(frozen=True)
+class Ref:
+    id: int
+
+
+@dataclass(frozen=True)
+class Typed:
+    type: str
+    value: Any
+
+
+@dataclass(frozen=True)
+class Entity:
+    id: int
+    type: str
+    args: tuple[Any, ...]
+
+
+def _unescape(match: re.Match[str]) -> str:
+    x2, x4, x, s = match.groups()
+    if x2:
+        return bytes.fromhex(x2).decode("utf-16-be")
+    if x4:
+        return bytes.fromhex(x4).decode("utf-32-be")
+    if x:
+        return bytes.fromhex(x).decode("latin-1")
+    if s:
+        return chr(ord(s) + 128)
+    # A code page switch (\P?\) or an escaped backslash
+    return "\\" if match[0] == "\\\\" else ""
+
+
+def decode_string(raw: bytes) -> str:
+    """The text of a STEP string, given without its enclosing quotes."""
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        # Out of spec, but some exporters write their code page as is
+        text = raw.decode("latin-1")
+    text = text.replace("''", "'")
+    if "\\" not in text:
+        return text
+    return STRING_ESCAPE.sub(_unescape, text)
+
+
+def parse_parameters(data: bytes, pos: int = 0) -> tuple[tuple[Any, ...], int]:
+    """
+    The parameter list opening at ``data[pos]``, and the position after its
+    closing parenthesis.
+    """
+    stack: list[tuple[list[Any], str | None]] = []
+    items: list[Any] = []
+    while True:
+        match = TOKEN.match(data, pos)
+        if match is None:
+            raise StepSyntaxError(f"Unexpected {data[pos : pos + 20]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "comma":
+            continue
+        if kind == "open" or kind == "typed":
+            typed = match["typed"].decode().upper() if kind == "typed" else None
+            stack.append((items, typed))
+            items = []
+            continue
+        if kind == "close":
+            if not stack:
+                raise StepSyntaxError("Unbalanced parentheses")
+            value: Any = tuple(items)
+            items, typed = stack.pop()
+            if not stack:
+                return value, pos
+            if typed is not None:
+                value = Typed(typed, value[0] if len(value) == 1 else value)
+        elif not stack:
+            raise StepSyntaxError("Parameters must start with a parenthesis")
+        elif kind == "string":
+            value = decode_string(match["string"][1:-1])
+        elif kind == "ref":
+            value = Ref(int(match["ref"]))
+        elif kind == "enum":
+            enum = match["enum"].decode().upper()
+            value = {"T": True, "F": False}.get(enum, enum)
+        elif kind == "number":
+            number = match["number"]
+            is_real = b"." in number or b"e" in number or b"E" in number
+            value = float(number) if is_real else int(number)
+        elif kind == "binary":
+            value = match["binary"].decode()
+        else:
+            value = None
+        items.append(value)
+
+
+def save_atomically(path: str | Path, write: Callable[[BinaryIO], None]) -> None:
+    """
+    Write a file with ``write`` under a temporary name, then move it to
+    ``path``: readers never see it half written, and concurrent writers of
+    the same file each write their own copy.
+    """
+    path = Path(path)
+    fd, partial = tempfile.mkstemp(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".partial"
+    )
+    try:
+        with open(fd, "wb") as f:
+            write(f)
+        os.replace(partial, path)
+    except BaseException:
+        os.unlink(partial)
+        raise
+
+
+class StepIndex:
+    """Where every entity instance of a file is, in parallel arrays by id."""
+
+    def __init__(
+        self,
+        ids: "array[int]",
+        offsets: "array[int]",
+        lengths: "array[int]",
+        type_ids: "array[int]",
+        types: list[str],
+        schema: str | None,
+    ) -> None:
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = lengths
+        self.type_ids = type_ids
+        self.types = types
+        self.schema = schema
+
+    @classmethod
+    def build(cls, buffer: bytes | mmap.mmap) -> "StepIndex":
+        """Index the entity instances of a whole file's contents."""
+        data_section = DATA_SECTION.search(buffer)
+        start = data_section.end() if data_section else 0
+        schema = FILE_SCHEMA.search(buffer, 0, start)
+        # Offsets only need 8 bytes past 4 GiB
+        offsets = array("Q" if len(buffer) > 0xFFFFFFFF else "I")
+        ids, lengths, type_ids = array("I"), array("I"), array("H")
+        types: list[bytes] = []
+        type_ids_by_name: dict[bytes, int] = {}
+        # This loop runs once per entity: keep it to bound methods and locals
+        add_offset, add_length, add_type_id = (
+            offsets.append,
+            lengths.append,
+            type_ids.append,
+        )
+        last_id, in_order = -1, True
+        for match in INSTANCE.finditer(buffer, start):
+            id_text, name = match.groups()
+            try:
+                type_id = type_ids_by_name[name]
+            except KeyError:
+                type_id = type_ids_by_name[name] = len(types)
+                types.append(name)
+            id = int(id_text)
+            try:
+                ids.append(id)
+            except OverflowError:
+                # Ids past 2**32 - 1 are legal, if never seen in practice
+                ids = array("Q", ids)
+                ids.append(id)
+            if id <= last_id:
+                in_order = False
+            last_id = id
+            begin, end = match.span()
+            add_offset(begin)
+            add_length(end - begin)
+            add_type_id(type_id)
+        index = cls(
+            ids,
+            offsets,
+            lengths,
+            type_ids,
+            [name.decode().upper() for name in types],
+            schema[1].decode() if schema else None,
+        )
+        if not in_order:
+            index._sort()
+        return index
+
+    def _sort(self) -> None:
+        # Files are nearly always written in id order; this is the exception
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        for name in ("ids", "offsets", "lengths", "type_ids"):
+            column: array[int] = getattr(self, name)
+            setattr(self, name, array(column.typecode, map(column.__getitem__, order)))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, id: int) -> int:
+        """Position of entity ``id`` in the arrays; raises KeyError if absent."""
+        i = bisect.bisect_left(self.ids, id)
+        if i == len(self.ids) or self.ids[i] != id:
+            raise KeyError(id)
+        return i
+
+    def save(self, f: BinaryIO) -> None:
+        typecodes = (self.ids.typecode + self.offsets.typecode).encode() + b"IH"
+        types = "\n".join([self.schema or "", *self.types]).encode()
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self), typecodes, len(types)))
+        f.write(types)
+        for column in (self.ids, self.offsets, self.lengths, self.type_ids):
+            column.tofile(f)
+
+    @classmethod
+    def load(cls, f: BinaryIO) -> "StepIndex":
+        magic, count, typecodes, types_size = INDEX_HEADER.unpack(
+            f.read(INDEX_HEADER.size)
+        )
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a STEP index")
+        schema, *types = f.read(types_size).decode().split("\n")
+        columns = []
+        for typecode in typecodes.decode():
+            column = array(typecode)
+            column.fromfile(f, count)
+            columns.append(column)
+        ids, offsets, lengths, type_ids = columns
+        return cls(ids, offsets, lengths, type_ids, types, schema or None)
+
+
+class StepFile:
+    """
+    An IFC file mapped into memory, with its index. Built from the file when
+    ``index_path`` is None or missing, and saved there if given.
+    """
+
+    def __init__(self, path: str | Path, index_path: str | Path | None = None) -> None:
+        with open(path, "rb") as f:
+            size = f.seek(0, 2)
+            self.buffer: bytes | mmap.mmap = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            )
+        if index_path is not None and Path(index_path).exists():
+            with open(index_path, "rb") as f:
+                self.index = StepIndex.load(f)
+        else:
+            self.index = StepIndex.build(self.buffer)
+            if index_path is not None:
+                save_atomically(index_path, self.index.save)
+        self._type_ids = {name: i for i, name in enumerate(self.index.types)}
+
+    def close(self) -> None:
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self) -> "StepFile":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, id: int) -> bool:
+        try:
+            self.index.position(id)
+        except KeyError:
+            return False
+        return True
+
+    @property
+    def schema(self) -> str | None:
+        return self.index.schema
+
+    def type_of(self, id: int) -> str:
+        return self.index.types[self.index.type_ids[self.index.position(id)]]
+
+    def raw(self, id: int) -> bytes:
+        """The text of entity ``id``, as in the file."""
+        i = self.index.position(id)
+        offset = self.index.offsets[i]
+        return self.buffer[offset : offset + self.index.lengths[i]]
+
+    def entity(self, id: int) -> Entity:
+        """Entity ``id`` with its parameters parsed; raises KeyError if absent."""
+        i = self.index.position(id)
+        offset = self.index.offsets[i]
+        data = self.buffer[offset : offset + self.index.lengths[i]]
+        type = self.index.types[self.index.type_ids[i]]
+        args, _ = parse_parameters(data, data.index(b"(", data.index(b"=")))
+        return Entity(id, type, args)
+
+    def ids_of_type(self, *types: str) -> list[int]:
+        """Ids of the entities of any of ``types`` (not of their subtypes)."""
+        wanted = {
+            self._type_ids[t.upper()] for t in types if t.upper() in self._type_ids
+        }
+        type_ids, ids = self.index.type_ids, self.index.ids
+        return [ids[i] for i, type_id in enumerate(type_ids) if type_id in wanted]
@@ -0,0 +1,417 @@
+"""
+Quantity takeoff of stored IFC models.
+
+Every quantity of every element (the IfcQuantityLength, Area, Volume, Count,
+Weight and Time of its IfcElementQuantity sets) is extracted once per stored
+file, right after upload, into columns saved as ``<sha256>.takeoff.npz`` next
+to the blob: one row per quantity with the element's express id, IFC type,
+building storey and material, the quantity's name and its value. Types,
+storeys, materials and quantity names are stored once, in tables, and the
+columns hold their positions in them (-1 for no storey or material).
+
+Totals are then a filter and a group-by sum over those columns in NumPy.
+The group keys of a row are folded into one integer; when the keys can only
+take a moderate number of values, sums are a single bincount, otherwise the
+keys are sorted first.
+"""
+
+import re
+import threading
+from collections.abc import Collection, Sequence
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import anyio
+import numpy as np
+import numpy.typing as npt
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.model_elements import (
+    REF,
+    ElementIndex,
+    index_paths,
+    load_element_index,
+    related_and_relating,
+)
+from app.model_storage import blob_path, remove_blob_files
+from app.models import TakeoffGroupBy, TakeoffTotal
+from app.step_file import Ref, StepFile, decode_string, save_atomically
+
+# Group keys spanning at most this many values are summed with a bincount
+DENSE_KEYS_MAX = 1 << 22
+# Levels of aggregation walked up from an element to find its storey
+MAX_DEPTH = 16
+
+# A list of references ending an instance, such as the HasProperties of an
+# IfcPropertySet or the Quantities of an IfcElementQuantity
+TRAILING_REFS = re.compile(rb"\(([#\d\s,]*)\)\s*\)\s*;\Z")
+# IfcQuantityLength, Area, Volume, Count, Weight and Time: Name, Description,
+# Unit, then the value
+QUANTITY = re.compile(
+    rb"#\d+\s*=\s*IFCQUANTITY[A-Z]+\s*\(\s*'((?:[^']|'')*)'\s*,"
+    rb"\s*(?:'(?:[^']|'')*'|\$)\s*,\s*(?:#\d+|\$)\s*,"
+    rb"\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*[,)]",
+    re.IGNORECASE,
+)
+COLUMNS = ("express_id", "type_id", "storey_id", "material_id", "quantity_id")
+TABLES = ("types", "storeys", "materials", "quantities")
+
+
+def takeoff_path(sha256: str) -> Path:
+    return blob_path(sha256).with_name(f"{sha256}.takeoff.npz")
+
+
+def element_quantities(
+    step: StepFile, elements: ElementIndex
+) -> tuple[
+    npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.float64], list[str]
+]:
+    """Element ids, quantity name ids and values of every element quantity."""
+    names: dict[str, int] = {}
+    set_ids: list[int] = []
+    name_ids: list[int] = []
+    values: list[float] = []
+    for set_id in step.ids_of_type("IFCELEMENTQUANTITY"):
+        # Quantities ends the set, and quantities start with their name, unit
+        # and value: both are read off the instance without parsing it all
+        match = TRAILING_REFS.search(step.raw(set_id))
+        if match is not None:
+            quantity_ids = [int(id) for id in REF.findall(match[1])]
+        else:
+            refs = step.entity(set_id).args[5]
+            quantity_ids = [ref.id for ref in refs or () if isinstance(ref, Ref)]
+        for quantity_id in quantity_ids:
+            if quantity_id not in step:
+                continue
+            quantity = step.raw(quantity_id)
+            match = QUANTITY.match(quantity)
+            if match is None:
+                continue
+            set_ids.append(set_id)
+            name = decode_string(match[1])
+            name_ids.append(names.setdefault(name, len(names)))
+            values.append(float(match[2]))
+
+    pair_elements, rows = join_definitions(elements, np.array(set_ids, np.int64))
+    return (
+        pair_elements,
+        np.array(name_ids, dtype=np.int64)[rows],
+        np.array(values, dtype=np.float64)[rows],
+        list(names),
+    )
+
+
+def join_definitions(
+    elements: ElementIndex, definitions: npt.NDArray[np.int64]
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """
+    Join the rows of a table, whose ``definitions`` are property or quantity
+    set ids, with the elements those sets are defined on: the element id and
+    the row of every match.
+    """
+    # For each (element, definition) pair of the index, the range of rows of
+    # that definition
+    order = np.argsort(definitions, kind="stable")
+    sets = definitions[order]
+    starts = np.asarray(elements.starts, dtype=np.int64)
+    counts = starts[1:] - starts[:-1]
+    pair_elements = np.repeat(np.asarray(elements.element_ids, dtype=np.int64), counts)
+    pair_definitions = np.asarray(elements.definition_ids, dtype=np.int64)
+    first = np.searchsorted(sets, pair_definitions, side="left")
+    rows_per_pair = np.searchsorted(sets, pair_definitions, side="right") - first
+    total = int(rows_per_pair.sum())
+    pair_starts = np.cumsum(rows_per_pair) - rows_per_pair
+    rows = np.repeat(first - pair_starts, rows_per_pair) + np.arange(total)
+    return np.repeat(pair_elements, rows_per_pair), order[rows]
+
+
+def element_storeys(step: StepFile, ids: Sequence[int]) -> tuple[list[int], list[str]]:
+    """
+    The storey of each of ``ids`` as a position in the returned storey names,
+    -1 for none. Elements contained in a space, or parts of an aggregate,
+    belong to the storey of what contains them.
+    """
+    storey_ids = step.ids_of_type("IFCBUILDINGSTOREY")
+    positions = {id: i for i, id in enumerate(storey_ids)}
+    storeys = []
+    for id in storey_ids:
+        name = step.entity(id).args[2]
+        storeys.append(name if isinstance(name, str) else f"#{id}")
+
+    parents: dict[int, int] = {}
+    for rel_id in step.ids_of_type("IFCRELCONTAINEDINSPATIALSTRUCTURE"):
+        related, relating = related_and_relating(step, rel_id)
+        if not relating:
+            continue
+        for id in related:
+            parents.setdefault(id, relating[0])
+    for rel_id in step.ids_of_type("IFCRELAGGREGATES"):
+        # RelatingObject comes before RelatedObjects here
+        relating, related = step.entity(rel_id).args[4:6]
+        if isinstance(relating, Ref):
+            for ref in related or ():
+                if isinstance(ref, Ref):
+                    parents.setdefault(ref.id, relating.id)
+
+    found: dict[int, int] = {}
+
+    def storey_of(id: int) -> int:
+        path = []
+        for _ in range(MAX_DEPTH):
+            if id in positions or id in found or id not in parents:
+                break
+            path.append(id)
+            id = parents[id]
+        storey = positions.get(id, found.get(id, -1))
+        for id in path:
+            found[id] = storey
+        return storey
+
+    return [storey_of(id) for id in ids], storeys
+
+
+def material_name(step: StepFile, id: int, depth: int = 0) -> str | None:
+    """The name of an IfcMaterialSelect: of the material, set or list."""
+    if depth > 4 or id not in step:
+        return None
+    material = step.entity(id)
+    args = material.args
+
+    def names(refs: Any) -> str | None:
+        found = [
+            name
+            for ref in refs or ()
+            if isinstance(ref, Ref)
+            and (name := material_name(step, ref.id, depth + 1)) is not None
+        ]
+        return " / ".join(dict.fromkeys(found)) or None
+
+    if material.type in ("IFCMATERIAL", "IFCMATERIALPROFILESET"):
+        return args[0] if isinstance(args[0], str) else None
+    if material.type == "IFCMATERIALCONSTITUENTSET":
+        return args[0] if isinstance(args[0], str) else names(args[2])
+    if material.type == "IFCMATERIALLAYERSET":
+        return args[1] if isinstance(args[1], str) else names(args[0])
+    if material.type in ("IFCMATERIALLAYER", "IFCMATERIALCONSTITUENT"):
+        # IFC4 constituents: Name, Description, Material...
+        ref = args[0] if material.type == "IFCMATERIALLAYER" else args[2]
+        return material_name(step, ref.id, depth + 1) if isinstance(ref, Ref) else None
+    if material.type in (
+        "IFCMATERIALLAYERSETUSAGE",
+        "IFCMATERIALPROFILESETUSAGE",
+        "IFCMATERIALPROFILESETUSAGETAPERING",
+    ):
+        ref = args[0]
+        return material_name(step, ref.id, depth + 1) if isinstance(ref, Ref) else None
+    if material.type == "IFCMATERIALLIST":
+        return names(args[0])
+    return None
+
+
+def element_materials(
+    step: StepFile, ids: Sequence[int]
+) -> tuple[list[int], list[str]]:
+    """The material of each of ``ids`` as a position in the returned names."""
+    element_material: dict[int, int] = {}
+    names: dict[str, int] = {}
+    name_of: dict[int, int] = {}
+    for rel_id in step.ids_of_type("IFCRELASSOCIATESMATERIAL"):
+        related, relating = related_and_relating(step, rel_id)
+        if not relating:
+            continue
+        material = relating[0]
+        if material not in name_of:
+            name = material_name(step, material)
+            name_of[material] = (
+                -1 if name is None else names.setdefault(name, len(names))
+            )
+        for id in related:
+            element_material.setdefault(id, name_of[material])
+    return [element_material.get(id, -1) for id in ids], list(names)
+
+
+class Takeoff:
+    """The quantities of a model's elements, in columns."""
+
+    def __init__(
+        self,
+        columns: dict[str, npt.NDArray[Any]],
+        values: npt.NDArray[np.float64],
+        tables: dict[str, list[str]],
+    ) -> None:
+        self.columns = columns
+        self.values = values
+        self.tables = tables
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @classmethod
+    def build(cls, step: StepFile, elements: ElementIndex) -> "Takeoff":
+        express_ids, quantity_ids, values, quantities = element_quantities(
+            step, elements
+        )
+        # Views of the step index's arrays, not copies
+        step_ids = np.frombuffer(step.index.ids, dtype=f"u{step.index.ids.itemsize}")
+        step_type_ids = np.frombuffer(step.index.type_ids, dtype=np.uint16)
+        ids, inverse = np.unique(express_ids, return_inverse=True)
+        positions = np.searchsorted(step_ids, ids)
+        # Relationships may name elements missing from a malformed file
+        inside = positions < len(step_ids)
+        inside[inside] = step_ids[positions[inside]] == ids[inside]
+        if not inside.all():
+            rows = inside[inverse]
+            express_ids, quantity_ids, values = (
+                express_ids[rows],
+                quantity_ids[rows],
+                values[rows],
+            )
+            ids, inverse = np.unique(express_ids, return_inverse=True)
+            positions = positions[inside]
+        type_ids = step_type_ids[positions]
+        id_list = ids.tolist()
+        storey_ids, storeys = element_storeys(step, id_list)
+        material_ids, materials = element_materials(step, id_list)
+        columns = {
+            "express_id": express_ids.astype(step_ids.dtype),
+            "type_id": type_ids[inverse].astype(np.int32),
+            "storey_id": np.array(storey_ids, dtype=np.int32)[inverse],
+            "material_id": np.array(material_ids, dtype=np.int32)[inverse],
+            "quantity_id": quantity_ids.astype(np.int32),
+        }
+        tables = {
+            "types": step.index.types,
+            "storeys": storeys,
+            "materials": materials,
+            "quantities": quantities,
+        }
+        return cls(columns, values, tables)
+
+    def save(self, f: BinaryIO) -> None:
+        arrays: dict[str, Any] = {"values": self.values, **self.columns}
+        for name, table in self.tables.items():
+            arrays[name] = np.asarray(table, dtype=str)
+        np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, f: BinaryIO) -> "Takeoff":
+        with np.load(f) as data:
+            columns = {name: data[name] for name in COLUMNS}
+            tables = {name: data[name].tolist() for name in TABLES}
+            return cls(columns, data["values"], tables)
+
+    def totals(
+        self, group_by: Sequence[TakeoffGroupBy], quantities: Collection[str] | None
+    ) -> list[TakeoffTotal]:
+        """Sums of each quantity (of ``quantities`` if given) per group."""
+        keys: list[tuple[TakeoffGroupBy, npt.NDArray[Any], list[str]]] = [
+            (name, self.columns[f"{name}_id"], self.tables[f"{name}s"])
+            for name in group_by
+        ]
+        codes = self.columns["quantity_id"]
+        # One integer per row, mixing its keys: -1 (none) is shifted to 0
+        key = codes.astype(np.int64)
+        sizes = [len(self.tables["quantities"])]
+        for _, ids, table in keys:
+            key = key * (len(table) + 1) + (ids.astype(np.int64) + 1)
+            sizes.append(len(table) + 1)
+        space = int(np.prod(sizes, dtype=np.float64))
+        if space <= max(DENSE_KEYS_MAX, 4 * len(key)):
+            counts = np.bincount(key, minlength=space)
+            sums = np.bincount(key, weights=self.values, minlength=space)
+            groups = np.flatnonzero(counts)
+            counts, sums = counts[groups], sums[groups]
+        else:
+            groups, inverse = np.unique(key, return_inverse=True)
+            counts = np.bincount(inverse)
+            sums = np.bincount(inverse, weights=self.values)
+
+        labels: dict[str, npt.NDArray[np.int64]] = {}
+        rest = groups
+        for name, _, table in reversed(keys):
+            rest, labels[name] = np.divmod(rest, len(table) + 1)
+        quantity_names = self.tables["quantities"]
+        if quantities is not None:
+            # Filtering the few groups is cheaper than filtering every row
+            wanted = np.array([name in quantities for name in quantity_names], bool)
+            kept = wanted[rest]
+            rest, counts, sums = rest[kept], counts[kept], sums[kept]
+            labels = {name: codes[kept] for name, codes in labels.items()}
+        totals = []
+        for i in range(len(rest)):
+            fields: dict[str, Any] = {}
+            for name, _, table in keys:
+                code = int(labels[name][i])
+                fields[name] = table[code - 1] if code else None
+            totals.append(
+                TakeoffTotal(
+                    **fields,
+                    quantity=quantity_names[int(rest[i])],
+                    count=int(counts[i]),
+                    total=float(sums[i]),
+                )
+            )
+        totals.sort(
+            key=lambda t: (
+                t.quantity,
+                *(
+                    (getattr(t, name) is None, getattr(t, name) or "")
+                    for name in group_by
+                ),
+            )
+        )
+        return totals
+
+
+takeoff_cache: TTLCache[str, Takeoff] = TTLCache(
+    name="takeoffs",
+    maxsize=settings.TAKEOFF_CACHE_MAX_SIZE,
+    ttl=settings.TAKEOFF_CACHE_TTL_SECONDS,
+)
+_opening = threading.Lock()
+
+
+def takeoff_file(sha256: str) -> Takeoff:
+    """The takeoff of blob ``sha256``, extracted and saved if it was not yet."""
+    path = takeoff_path(sha256)
+    if path.exists():
+        with open(path, "rb") as f:
+            return Takeoff.load(f)
+    step_path, elements_path = index_paths(sha256)
+    with StepFile(blob_path(sha256), step_path) as step:
+        takeoff = Takeoff.build(step, load_element_index(step, elements_path))
+    save_atomically(path, takeoff.save)
+    return takeoff
+
+
+def open_takeoff(sha256: str) -> Takeoff:
+    """Takeoff of blob ``sha256``, cached. Blocking: call it from a worker thread."""
+    cached = takeoff_cache.get(sha256)
+    if cached is not None:
+        return cached
+    with _opening:
+        cached = takeoff_cache.get(sha256)
+        if cached is None:
+            cached = takeoff_file(sha256)
+            takeoff_cache.set(sha256, cached)
+        return cached
+
+
+async def extract_takeoff(sha256: str) -> None:
+    """Background job extracting the takeoff of a new blob."""
+    try:
+        await anyio.to_thread.run_sync(takeoff_file, sha256)
+    except FileNotFoundError:
+        # Removed before extracting
+        return
+    if not blob_path(sha256).exists():
+        # Removed while extracting
+        remove_blob_files([sha256])
+
+
+def read_takeoff(
+    sha256: str, group_by: Sequence[TakeoffGroupBy], quantities: Collection[str] | None
+) -> list[TakeoffTotal]:
+    """Takeoff totals of blob ``sha256``; blocking, call it from a worker thread."""
+    return open_takeoff(sha256).totals(group_by, quantities)
@@ -1,7 +1,15 @@
+import csv
+import io
+import random
+import string
+import time
 import uuid
+from decimal import Decimal
+from typing import Any
 
+import openpyxl
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, text
 
 from app.core.config import settings
 
@@ -126,3 +134,609 @@ def test_line_item_not_found(
     )
     assert response.status_code == 404
     assert response.json()["detail"] == "Line item not found"
+
+
+def test_read_line_items_cursor_pagination(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    for _ in range(3):
+        r = client.post(
+            f"{settings.API_V1_STR}/line-items/",
+            headers=superuser_token_headers,
+            json={
+                "code": f"PU-{uuid.uuid4().hex[:8]}",
+                "description": "paged",
+                "unit": "u",
+                "unit_price": "1.00",
+            },
+        )
+        assert r.status_code == 200, r.text
+
+    r = client.get(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        params={"limit": 1000},
+    )
+    expected = [row["id"] for row in r.json()["data"]]
+
+    seen: list[str] = []
+    params: dict[str, str | int] = {"limit": 2}
+    while True:
+        r = client.get(
+            f"{settings.API_V1_STR}/line-items/",
+            headers=superuser_token_headers,
+            params=params,
+        )
+        assert r.status_code == 200, r.text
+        content = r.json()
+        seen.extend(row["id"] for row in content["data"])
+        if not content["next_cursor"]:
+            break
+        params = {"limit": 2, "cursor": content["next_cursor"]}
+    assert seen == expected
+
+
+def test_read_line_items_invalid_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        params={"cursor": "not-a-cursor"},
+    )
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Invalid cursor"
+
+
+def test_search_line_items(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    prefix = f"SRCH-{uuid.uuid4().hex[:8]}"
+    word = "".join(random.choices(string.ascii_lowercase, k=16))
+    for code, description in [
+        (f"{prefix}.02", f"Tarrajeo de muros {word}"),
+        (f"{prefix}.01", f"Pintura de muro {word}"),
+        (f"PU-{uuid.uuid4().hex[:8]}", f"Tarrajeo de vigas {word}"),
+        (f"CO-{uuid.uuid4().hex[:8]}", f"Concreto en losas {word}"),
+    ]:
+        r = client.post(
+            f"{settings.API_V1_STR}/line-items/",
+            headers=superuser_token_headers,
+            json={
+                "code": code,
+                "description": description,
+                "unit": "m2",
+                "unit_price": "1.00",
+            },
+        )
+        assert r.status_code == 200, r.text
+
+    def search(q: str, **params: str) -> list[dict[str, Any]]:
+        r = client.get(
+            f"{settings.API_V1_STR}/line-items/search",
+            headers=superuser_token_headers,
+            params={"q": q, **params},
+        )
+        assert r.status_code == 200, r.text
+        data: list[dict[str, Any]] = r.json()["data"]
+        return data
+
+    # Code prefixes first, in code order
+    hits = search(prefix.lower())
+    assert [hit["code"] for hit in hits] == [f"{prefix}.01", f"{prefix}.02"]
+    assert all(hit["rank"] == 1 for hit in hits)
+
+    # Stemmed words: "muro" matches "muros" but not "vigas"
+    hits = search(f"muro {word}")
+    assert {hit["code"] for hit in hits} == {f"{prefix}.01", f"{prefix}.02"}
+
+    # A misspelled word is corrected to the catalog's
+    misspelled = word[:-1] + ("a" if word[-1] != "a" else "b")
+    hits = search(f"tarrajeo {misspelled}")
+    assert {hit["description"] for hit in hits} == {
+        f"Tarrajeo de muros {word}",
+        f"Tarrajeo de vigas {word}",
+    }
+
+    # Autocomplete matches the last word as a prefix
+    hits = search(f"{word} tarrajeo vig", autocomplete="true")
+    assert [hit["description"] for hit in hits] == [f"Tarrajeo de vigas {word}"]
+
+    # Including prefixes of stopwords, which the Spanish config drops
+    hits = search(f"{word} con", autocomplete="true")
+    assert [hit["description"] for hit in hits] == [f"Concreto en losas {word}"]
+
+
+def test_import_line_items_csv(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    prefix = f"IMP-{uuid.uuid4().hex[:8]}"
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={
+            "code": f"{prefix}-1",
+            "description": "Old description",
+            "unit": "m2",
+            "unit_price": "1.00",
+        },
+    )
+    assert r.status_code == 200, r.text
+    rows = [
+        "Unit;Code;Description;Unit_Price",
+        f"m2;{prefix}-1;Tarrajeo de muros;25.50",
+        f"m3;{prefix}-2;Excavación manual;40",
+        f"m3;{prefix}-3;Vaciado de concreto;not a price",
+        f"kg;{prefix}-4;Acero (first);5",
+        f"kg;{prefix}-4;Acero corrugado;5.125",
+        ";;;",
+        "und;;Sin código;1",
+    ]
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/import",
+        headers=superuser_token_headers,
+        files={"file": ("prices.csv", "\n".join(rows).encode(), "text/csv")},
+    )
+    assert r.status_code == 202, r.text
+    # The test client runs background tasks before returning the response
+    r = client.get(
+        f"{settings.API_V1_STR}/line-items/import/{r.json()['id']}",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 200, r.text
+    job = r.json()
+    assert job["status"] == "done", job
+    assert job["filename"] == "prices.csv"
+    assert (job["rows_read"], job["inserted"], job["updated"]) == (6, 2, 1)
+    assert (job["unchanged"], job["rejected"]) == (0, 3)
+    assert [(error["line"], error["reason"]) for error in job["errors"]] == [
+        (4, "unit_price must be a non-negative amount"),
+        (5, "code is repeated on line 6"),
+        (8, "code is required"),
+    ]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/line-items/search",
+        headers=superuser_token_headers,
+        params={"q": prefix, "autocomplete": "true"},
+    )
+    items = {hit["code"]: hit for hit in r.json()["data"]}
+    assert set(items) == {f"{prefix}-1", f"{prefix}-2", f"{prefix}-4"}
+    assert items[f"{prefix}-1"]["description"] == "Tarrajeo de muros"
+    assert items[f"{prefix}-1"]["unit_price"] == "25.50"
+    assert items[f"{prefix}-4"]["unit_price"] == "5.13"
+
+
+def test_import_line_items_xlsx(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    prefix = f"IMP-{uuid.uuid4().hex[:8]}"
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    assert sheet is not None
+    sheet.append(["code", "description", "unit", "unit_price", "notes"])
+    sheet.append([f"{prefix}-1", "Pintura látex", "m2", 12.5, "extra column"])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    url = f"{settings.API_V1_STR}/line-items/import"
+    r = client.post(
+        url,
+        headers=superuser_token_headers,
+        files={"file": ("prices.xlsx", buffer.getvalue())},
+    )
+    assert r.status_code == 202, r.text
+    job = client.get(f"{url}/{r.json()['id']}", headers=superuser_token_headers).json()
+    assert (job["status"], job["inserted"], job["rejected"]) == ("done", 1, 0)
+
+    # A file without the expected columns fails the job
+    r = client.post(
+        url,
+        headers=superuser_token_headers,
+        files={"file": ("prices.csv", b"code,price\nA,1\n")},
+    )
+    job = client.get(f"{url}/{r.json()['id']}", headers=superuser_token_headers).json()
+    assert job["status"] == "failed"
+    assert job["detail"] == "Missing columns: description, unit, unit_price"
+
+    r = client.post(
+        url,
+        headers=superuser_token_headers,
+        files={"file": ("prices.pdf", b"%PDF")},
+    )
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Only .csv and .xlsx files can be imported"
+
+
+def test_export_line_items(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    code = f"EXP-{uuid.uuid4().hex[:8]}"
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={
+            "code": code,
+            "description": "Cerámica, 60x60",
+            "unit": "m2",
+            "unit_price": "45.90",
+        },
+    )
+    assert r.status_code == 200, r.text
+    url = f"{settings.API_V1_STR}/line-items/export"
+
+    r = client.get(url, headers=superuser_token_headers)
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"] == "text/csv; charset=utf-8"
+    assert r.headers["content-disposition"] == 'attachment; filename="line-items.csv"'
+    rows = list(csv.reader(io.StringIO(r.text)))
+    assert rows[0][:4] == ["code", "description", "unit", "unit_price"]
+    assert [row[:4] for row in rows if row[0] == code] == [
+        [code, "Cerámica, 60x60", "m2", "45.90"]
+    ]
+
+    r = client.get(url, headers=superuser_token_headers, params={"format": "xlsx"})
+    assert r.status_code == 200, r.text
+    workbook = openpyxl.load_workbook(io.BytesIO(r.content), read_only=True)
+    sheet = workbook.active
+    assert sheet is not None
+    xlsx_rows = list(sheet.iter_rows(values_only=True))
+    assert len(xlsx_rows) == len(rows)
+    assert [row[:4] for row in xlsx_rows if row[0] == code] == [
+        (code, "Cerámica, 60x60", "m2", 45.9)
+    ]
+
+
+def test_batch_get_line_items(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    items = []
+    for description in ("Zapata", "Columna"):
+        r = client.post(
+            f"{settings.API_V1_STR}/line-items/",
+            headers=superuser_token_headers,
+            json={
+                "code": f"BG-{uuid.uuid4().hex[:8]}",
+                "description": description,
+                "unit": "m3",
+                "unit_price": "10.00",
+            },
+        )
+        assert r.status_code == 200, r.text
+        items.append(r.json())
+    missing_id = str(uuid.uuid4())
+    url = f"{settings.API_V1_STR}/line-items/batch-get"
+
+    r = client.post(
+        url,
+        headers=normal_user_token_headers,
+        json={
+            "ids": [items[0]["id"], missing_id, items[0]["id"]],
+            "codes": [items[1]["code"], "BG-missing"],
+        },
+    )
+    assert r.status_code == 200, r.text
+    content = r.json()
+    assert content["ids"] == {items[0]["id"]: items[0], missing_id: None}
+    assert content["codes"] == {items[1]["code"]: items[1], "BG-missing": None}
+
+    r = client.post(url, headers=normal_user_token_headers, json={})
+    assert r.status_code == 200, r.text
+    assert r.json() == {"ids": {}, "codes": {}}
+
+    r = client.post(
+        url, headers=normal_user_token_headers, json={"codes": ["X"] * 1001}
+    )
+    assert r.status_code == 422
+
+
+def test_read_line_item_is_cached_until_catalog_changes(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={
+            "code": f"CACHE-{uuid.uuid4().hex[:8]}",
+            "description": "Losa aligerada",
+            "unit": "m2",
+            "unit_price": "80.00",
+        },
+    )
+    assert r.status_code == 200, r.text
+    url = f"{settings.API_V1_STR}/line-items/{r.json()['id']}"
+
+    def line_item_stats() -> dict[str, int]:
+        r = client.get(
+            f"{settings.API_V1_STR}/utils/cache-stats/",
+            headers=superuser_token_headers,
+        )
+        return next(s for s in r.json() if s["name"] == "line-items")
+
+    # Once this worker listens for catalog changes, reads come from the cache
+    deadline = time.monotonic() + 5
+    while True:
+        hits = line_item_stats()["hits"]
+        assert client.get(url, headers=superuser_token_headers).status_code == 200
+        if line_item_stats()["hits"] > hits:
+            break
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    # A change the cache is not told about is not seen...
+    db.execute(
+        text("UPDATE lineitem SET description = 'Losa maciza' WHERE id = :id"),
+        {"id": r.json()["id"]},
+    )
+    db.commit()
+    r = client.get(url, headers=superuser_token_headers)
+    assert r.json()["description"] == "Losa aligerada"
+
+    # ...until another worker announces a catalog write
+    db.execute(text("NOTIFY lineitem_changed"))
+    db.commit()
+    deadline = time.monotonic() + 5
+    while r.json()["description"] != "Losa maciza":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+        r = client.get(url, headers=superuser_token_headers)
+
+    r = client.put(
+        url, headers=superuser_token_headers, json={"description": "Losa nervada"}
+    )
+    assert r.status_code == 200, r.text
+    r = client.get(url, headers=superuser_token_headers)
+    assert r.json()["description"] == "Losa nervada"
+
+
+def test_read_line_item_changes(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/line-items/changes"
+    # Catch up with the whole catalog first
+    since = None
+    while True:
+        r = client.get(
+            url,
+            headers=superuser_token_headers,
+            params={"since": since} if since else {},
+        )
+        assert r.status_code == 200, r.text
+        since = r.json()["next_since"]
+        if not r.json()["has_more"]:
+            break
+
+    ids = []
+    for n in range(3):
+        r = client.post(
+            f"{settings.API_V1_STR}/line-items/",
+            headers=superuser_token_headers,
+            json={
+                "code": f"SYNC-{uuid.uuid4().hex[:8]}",
+                "description": f"Partida {n}",
+                "unit": "und",
+                "unit_price": "1.00",
+            },
+        )
+        assert r.status_code == 200, r.text
+        ids.append(r.json()["id"])
+    r = client.put(
+        f"{settings.API_V1_STR}/line-items/{ids[0]}",
+        headers=superuser_token_headers,
+        json={"description": "Partida cambiada"},
+    )
+    assert r.status_code == 200, r.text
+    r = client.delete(
+        f"{settings.API_V1_STR}/line-items/{ids[1]}", headers=superuser_token_headers
+    )
+    assert r.status_code == 200, r.text
+
+    r = client.get(
+        url, headers=superuser_token_headers, params={"since": since, "limit": 1}
+    )
+    assert r.status_code == 200, r.text
+    page = r.json()
+    assert page["has_more"] is True
+    assert [item["id"] for item in page["upserts"]] == [ids[2]]
+
+    r = client.get(url, headers=superuser_token_headers, params={"since": since})
+    changes = r.json()
+    assert changes["has_more"] is False
+    assert [(i["id"], i["description"]) for i in changes["upserts"]] == [
+        (ids[2], "Partida 2"),
+        (ids[0], "Partida cambiada"),
+    ]
+    assert changes["deletes"] == [ids[1]]
+
+    r = client.get(
+        url, headers=superuser_token_headers, params={"since": changes["next_since"]}
+    )
+    assert r.json() == {
+        "upserts": [],
+        "deletes": [],
+        "next_since": changes["next_since"],
+        "has_more": False,
+    }
+
+    r = client.get(url, headers=superuser_token_headers, params={"since": "nope"})
+    assert r.status_code == 400
+
+
+def test_line_item_price_history(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    code = f"PRICE-{uuid.uuid4().hex[:8]}"
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={"code": code, "description": "Muro", "unit": "m2", "unit_price": "10"},
+    )
+    assert r.status_code == 200, r.text
+    url = f"{settings.API_V1_STR}/line-items/{r.json()['id']}"
+    for change in (
+        {"unit_price": "12.50"},
+        {"description": "Muro de ladrillo"},
+        {"unit_price": "15"},
+    ):
+        r = client.put(url, headers=superuser_token_headers, json=change)
+        assert r.status_code == 200, r.text
+
+    r = client.get(f"{url}/prices", headers=superuser_token_headers)
+    assert r.status_code == 200, r.text
+    prices = r.json()["data"]
+    assert [p["unit_price"] for p in prices] == ["10.00", "12.50", "15.00"]
+    # Each price lasts until the next one starts
+    assert [p["valid_to"] for p in prices] == [
+        prices[1]["valid_from"],
+        prices[2]["valid_from"],
+        None,
+    ]
+
+    def price_as_of(as_of: str) -> dict[str, Any]:
+        r = client.post(
+            f"{settings.API_V1_STR}/line-items/prices",
+            headers=superuser_token_headers,
+            json={
+                "as_of": as_of,
+                "ids": [url.rsplit("/", 1)[1]],
+                "codes": [code, "PRICE-missing"],
+            },
+        )
+        assert r.status_code == 200, r.text
+        content: dict[str, Any] = r.json()
+        return content
+
+    content = price_as_of(prices[1]["valid_from"])
+    assert list(content["ids"].values()) == ["12.50"]
+    assert content["codes"] == {code: "12.50", "PRICE-missing": None}
+    assert price_as_of(prices[1]["valid_to"])["codes"][code] == "15.00"
+    assert price_as_of("2000-01-01T00:00:00Z")["codes"][code] is None
+
+
+def test_line_item_components_rollup(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/line-items"
+    tag = uuid.uuid4().hex[:8]
+
+    def create(name: str, unit_price: str) -> str:
+        r = client.post(
+            f"{url}/",
+            headers=superuser_token_headers,
+            json={
+                "code": f"APU-{tag}-{name}",
+                "description": name,
+                "unit": "u",
+                "unit_price": unit_price,
+            },
+        )
+        assert r.status_code == 200, r.text
+        id: str = r.json()["id"]
+        return id
+
+    def compose(id: str, *components: tuple[str, str]) -> Any:
+        return client.put(
+            f"{url}/{id}/components",
+            headers=superuser_token_headers,
+            json={
+                "components": [
+                    {"line_item_id": c, "quantity": q} for c, q in components
+                ]
+            },
+        )
+
+    def unit_price(id: str) -> Decimal:
+        r = client.get(f"{url}/{id}", headers=superuser_token_headers)
+        return Decimal(r.json()["unit_price"])
+
+    cement, sand, labour = (
+        create("cement", "30"),
+        create("sand", "20"),
+        create("labour", "50"),
+    )
+    mortar, wall, other = (
+        create("mortar", "0"),
+        create("wall", "0"),
+        create("other", "7"),
+    )
+    r = compose(mortar, (cement, "0.25"), (sand, "0.5"))
+    assert r.status_code == 200, r.text
+    assert r.json()["unit_price"] == "17.50"
+    amounts = {c["line_item"]["id"]: Decimal(c["amount"]) for c in r.json()["data"]}
+    assert amounts == {cement: Decimal("7.5"), sand: Decimal("10")}
+    r = compose(wall, (mortar, "0.03"), (labour, "0.8"))
+    assert r.status_code == 200, r.text
+    assert r.json()["unit_price"] == "40.53"
+
+    # A new input price reaches every composite above it, and only those
+    r = client.put(
+        f"{url}/{sand}", headers=superuser_token_headers, json={"unit_price": "40"}
+    )
+    assert r.status_code == 200, r.text
+    assert unit_price(mortar) == Decimal("27.50")
+    assert unit_price(wall) == Decimal("40.83")
+    assert unit_price(other) == Decimal("7")
+    r = client.get(f"{url}/{wall}/prices", headers=superuser_token_headers)
+    prices = [Decimal(p["unit_price"]) for p in r.json()["data"]]
+    assert prices == [Decimal("0"), Decimal("40.53"), Decimal("40.83")]
+
+    r = client.get(f"{url}/{wall}/components", headers=superuser_token_headers)
+    assert r.status_code == 200, r.text
+    assert {c["line_item"]["id"] for c in r.json()["data"]} == {mortar, labour}
+
+    # Derived prices cannot be set, nor used items deleted
+    r = client.put(
+        f"{url}/{mortar}", headers=superuser_token_headers, json={"unit_price": "1"}
+    )
+    assert r.status_code == 400
+    r = client.delete(f"{url}/{sand}", headers=superuser_token_headers)
+    assert r.status_code == 400
+
+    # An empty composition makes it a plain line item again, keeping its price
+    r = compose(wall)
+    assert r.status_code == 200, r.text
+    assert r.json() == {"data": [], "unit_price": "40.83"}
+
+
+def test_line_item_components_cycle(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/line-items"
+    ids = []
+    for _ in range(3):
+        r = client.post(
+            f"{url}/",
+            headers=superuser_token_headers,
+            json={
+                "code": f"CYC-{uuid.uuid4().hex[:8]}",
+                "description": "Ciclo",
+                "unit": "u",
+                "unit_price": "1",
+            },
+        )
+        assert r.status_code == 200, r.text
+        ids.append(r.json()["id"])
+    a, b, c = ids
+    for parent, component in ((a, b), (b, c)):
+        r = client.put(
+            f"{url}/{parent}/components",
+            headers=superuser_token_headers,
+            json={"components": [{"line_item_id": component, "quantity": "2"}]},
+        )
+        assert r.status_code == 200, r.text
+    assert r.json()["unit_price"] == "2.00"
+
+    for components in (
+        [{"line_item_id": a, "quantity": "1"}],
+        [{"line_item_id": c, "quantity": "1"}],
+    ):
+        r = client.put(
+            f"{url}/{c}/components",
+            headers=superuser_token_headers,
+            json={"components": components},
+        )
+        assert r.status_code == 400
+        assert r.json()["detail"] == "A line item cannot be a component of itself"
+    r = client.get(f"{url}/{a}", headers=superuser_token_headers)
+    assert r.json()["unit_price"] == "4.00"
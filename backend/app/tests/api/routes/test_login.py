@@ -1,9 +1,13 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
 from unittest.mock import patch
 
+import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
 from app.core.config import settings
+from app.core.hashing import password_hasher
 from app.core.security import verify_password
 from app.crud import create_user
 from app.models import UserCreate
@@ -33,6 +37,29 @@ def test_get_access_token_incorrect_password(client: TestClient) -> None:
     assert r.status_code == 400
 
 
+def test_get_access_token_hashing_queue_full(client: TestClient) -> None:
+    login_data = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    with patch.object(password_hasher, "queue_depth", 0):
+        r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+
+
+def test_get_access_token_after_hashing_worker_died(client: TestClient) -> None:
+    # A worker exiting abruptly breaks the pool it belongs to
+    with pytest.raises(BrokenProcessPool):
+        password_hasher._get_executor().submit(os._exit, 1).result()
+    login_data = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 200, r.text
+
+
 def test_use_access_token(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -45,6 +72,29 @@ def test_use_access_token(
     assert "email" in result
 
 
+def test_access_token_principal_is_cached(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    def principal_stats() -> dict[str, int]:
+        r = client.get(
+            f"{settings.API_V1_STR}/utils/cache-stats/",
+            headers=superuser_token_headers,
+        )
+        assert r.status_code == 200
+        return next(s for s in r.json() if s["name"] == "principals")
+
+    before = principal_stats()
+    r = client.post(
+        f"{settings.API_V1_STR}/login/test-token",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 200
+    after = principal_stats()
+    # Both the test-token call and the second stats call hit the cache
+    assert after["hits"] >= before["hits"] + 2
+    assert after["misses"] == before["misses"]
+
+
 def test_recovery_password(
     client: TestClient, normal_user_token_headers: dict[str, str]
 ) -> None:
@@ -0,0 +1,293 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import uuid
+
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.model_storage import blob_path, complete_upload, upload_path
+from app.models import ModelUpload
+from app.tests.utils.model import create_project, upload_model
+from app.tests.utils.user import authentication_token_from_email
+from app.tests.utils.utils import random_email
+
+IFC = (
+    b"ISO-10303-21;\nHEADER;\nENDSEC;\nDATA;\n"
+    + b"#1=IFCWALL('0001',$,'Muro',$,$,$,$,$,$);\n" * 1000
+    + b"ENDSEC;\nEND-ISO-10303-21;\n"
+)
+
+
+def test_upload_model(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = normal_user_token_headers
+    project_id = create_project(client, headers)
+    content = IFC + os.urandom(16)
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    model = upload_model(client, headers, project_id, content)
+    assert model["version"] == 1
+    assert model["sha256"] == sha256
+    assert model["size"] == len(content)
+    assert blob_path(sha256).read_bytes() == content
+
+    # The same file again is stored once, and need not be sent at all
+    r = client.post(
+        f"{settings.API_V1_STR}/models/uploads",
+        headers=headers,
+        json={
+            "project_id": project_id,
+            "filename": "casa-v2.ifc",
+            "size": len(content),
+            "sha256": sha256,
+        },
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["id"] is None
+    assert r.json()["model"]["version"] == 2
+    again = upload_model(client, headers, project_id, content)
+    assert again["version"] == 3
+    assert again["sha256"] == sha256
+
+    r = client.get(
+        f"{settings.API_V1_STR}/models/",
+        headers=headers,
+        params={"project_id": project_id},
+    )
+    assert r.status_code == 200, r.text
+    assert [m["version"] for m in r.json()["data"]] == [3, 2, 1]
+
+    # The file goes with the last model using it
+    for m in r.json()["data"]:
+        assert blob_path(sha256).exists()
+        r = client.delete(f"{settings.API_V1_STR}/models/{m['id']}", headers=headers)
+        assert r.status_code == 200, r.text
+    assert not blob_path(sha256).exists()
+
+
+def test_upload_model_declared_sha256(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    content = IFC + os.urandom(16)
+    sha256 = hashlib.sha256(content).hexdigest()
+    upload_model(
+        client,
+        normal_user_token_headers,
+        create_project(client, normal_user_token_headers),
+        content,
+    )
+    headers = authentication_token_from_email(
+        client=client, email=random_email(), db=db
+    )
+    project_id = create_project(client, headers)
+    url = f"{settings.API_V1_STR}/models/uploads"
+    upload = {
+        "project_id": project_id,
+        "filename": "ajeno.ifc",
+        "size": len(content),
+        "sha256": sha256,
+    }
+
+    # Another user's file is not linked by its hash: it has to be sent, and
+    # must be the declared one
+    r = client.post(url, headers=headers, json=upload)
+    assert r.status_code == 200, r.text
+    assert r.json()["model"] is None
+    other = content[:-1] + bytes([content[-1] ^ 1])
+    r = client.patch(
+        f"{url}/{r.json()['id']}",
+        headers={**headers, "Upload-Offset": "0"},
+        content=other,
+    )
+    assert r.status_code == 422, r.text
+    r = client.get(
+        f"{settings.API_V1_STR}/models/",
+        headers=headers,
+        params={"project_id": project_id},
+    )
+    assert r.json()["data"] == []
+
+    r = client.post(url, headers=headers, json=upload)
+    r = client.patch(
+        f"{url}/{r.json()['id']}",
+        headers={**headers, "Upload-Offset": "0"},
+        content=content,
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["model"]["sha256"] == sha256
+
+
+def test_complete_uploads_of_one_file_concurrently(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = normal_user_token_headers
+    content = IFC + os.urandom(16)
+    ids = []
+    for _ in range(2):
+        project_id = create_project(client, headers)
+        r = client.post(
+            f"{settings.API_V1_STR}/models/uploads",
+            headers=headers,
+            json={"project_id": project_id, "filename": "a.ifc", "size": len(content)},
+        )
+        assert r.status_code == 200, r.text
+        ids.append(uuid.UUID(r.json()["id"]))
+        upload_path(ids[-1]).parent.mkdir(parents=True, exist_ok=True)
+        upload_path(ids[-1]).write_bytes(content)
+
+    async def complete_both() -> list[bool]:
+        engine = create_async_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+        async with AsyncSession(engine) as first, AsyncSession(engine) as second:
+            upload = await first.get(ModelUpload, ids[0])
+            assert upload
+            _, first_created = await complete_upload(first, upload)
+            upload = await second.get(ModelUpload, ids[1])
+            assert upload
+            task = asyncio.create_task(complete_upload(second, upload))
+            await asyncio.sleep(0.5)
+            # The second completion waits for the first to commit its blob
+            assert not task.done()
+            await first.commit()
+            _, second_created = await task
+            await second.commit()
+        await engine.dispose()
+        return [first_created, second_created]
+
+    assert asyncio.run(complete_both()) == [True, False]
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert blob_path(sha256).read_bytes() == content
+    assert not upload_path(ids[1]).exists()
+
+
+def test_download_model(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+) -> None:
+    headers = normal_user_token_headers
+    project_id = create_project(client, headers)
+    content = IFC + os.urandom(16)
+    model = upload_model(client, headers, project_id, content)
+    url = f"{settings.API_V1_STR}/models/{model['id']}/file"
+
+    r = client.get(url, headers={**headers, "Range": "bytes=10-19"})
+    assert r.status_code == 206
+    assert r.content == content[10:20]
+    assert r.headers["content-range"] == f"bytes 10-19/{len(content)}"
+    r = client.get(url, headers={**headers, "Range": "bytes=-16"})
+    assert r.status_code == 206
+    assert r.content == content[-16:]
+    r = client.get(url, headers={**headers, "Range": f"bytes={len(content)}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(content)}"
+
+    # The gzip variant was made after the upload, in the background
+    r = client.get(url, headers={**headers, "Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert int(r.headers["content-length"]) < len(content) // 10
+    assert r.content == content
+    with gzip.open(blob_path(model["sha256"], compressed=True)) as f:
+        assert f.read() == content
+    r = client.get(url, headers={**headers, "Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert "content-encoding" not in r.headers
+    assert r.content == content
+    r = client.get(
+        url,
+        headers={
+            **headers,
+            "Accept-Encoding": "identity",
+            "If-None-Match": r.headers["etag"],
+        },
+    )
+    assert r.status_code == 304
+
+    other_user_project = create_project(client, superuser_token_headers)
+    r = client.get(
+        f"{settings.API_V1_STR}/models/",
+        headers=headers,
+        params={"project_id": other_user_project},
+    )
+    assert r.status_code == 400
+
+    # Deleting the project deletes its models and their files
+    r = client.delete(f"{settings.API_V1_STR}/projects/{project_id}", headers=headers)
+    assert r.status_code == 200, r.text
+    assert not blob_path(model["sha256"]).exists()
+    assert not blob_path(model["sha256"], compressed=True).exists()
+
+
+def test_read_model_elements(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = normal_user_token_headers
+    project_id = create_project(client, headers)
+    content = (
+        b"""ISO-10303-21;
+HEADER;
+FILE_SCHEMA(('IFC4'));
+ENDSEC;
+DATA;
+#1=IFCOWNERHISTORY($,$,$,.ADDED.,$,$,$,0);
+#10=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOH',#1,'Muro 1',$,$,$,$,'T-1',$);
+#11=IFCSLAB('1kTvXnbbzCWw8lcMd1dR4o',#1,'Losa',$,$,$,$,$,.FLOOR.);
+#20=IFCPROPERTYSINGLEVALUE('IsExternal',$,IFCBOOLEAN(.T.),$);
+#21=IFCPROPERTYSINGLEVALUE('FireRating',$,IFCLABEL('EI 60'),$);
+#22=IFCPROPERTYSET('3Ks2Q3b1T0nA2ZnF$6XHxk',#1,'Pset_WallCommon',$,(#20,#21));
+#30=IFCQUANTITYVOLUME('NetVolume','',$,2.5,$);
+#31=IFCQUANTITYAREA('NetSideArea','',$,10.,$);
+#32=IFCELEMENTQUANTITY('0hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto_WallBaseQuantities',$,$,(#30,#31));
+#40=IFCRELDEFINESBYPROPERTIES('2bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#10,#11),#22);
+#41=IFCRELDEFINESBYPROPERTIES('0Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,(#10),#32);
+ENDSEC;
+END-ISO-10303-21;
+"""
+        + b"/*"
+        + os.urandom(500).hex().encode()
+        + b"*/\n"
+    )
+    model = upload_model(client, headers, project_id, content)
+    url = f"{settings.API_V1_STR}/models/{model['id']}/elements"
+
+    r = client.get(f"{url}/10", headers=headers)
+    assert r.status_code == 200, r.text
+    wall = r.json()
+    assert wall["type"] == "IFCWALL"
+    assert wall["global_id"] == "2O2Fr$t4X7Zf8NOew3FLOH"
+    assert wall["name"] == "Muro 1"
+    assert wall["attributes"][1] == {"id": 1}
+    assert wall["attributes"][7] == "T-1"
+    assert wall["property_sets"] == [
+        {
+            "id": 22,
+            "type": "IFCPROPERTYSET",
+            "name": "Pset_WallCommon",
+            "properties": {"IsExternal": True, "FireRating": "EI 60"},
+        }
+    ]
+    assert wall["quantity_sets"][0]["name"] == "Qto_WallBaseQuantities"
+    assert wall["quantities"] == {"NetVolume": 2.5, "NetSideArea": 10.0}
+    blob = blob_path(model["sha256"])
+    assert blob.with_name(f"{model['sha256']}.elements").exists()
+
+    r = client.post(f"{url}/batch-get", headers=headers, json={"ids": [11, 20, 99]})
+    assert r.status_code == 200, r.text
+    found = r.json()["ids"]
+    assert [ps["id"] for ps in found["11"]["property_sets"]] == [22]
+    assert found["11"]["quantities"] == {}
+    assert found["20"]["type"] == "IFCPROPERTYSINGLEVALUE"
+    assert found["20"]["global_id"] is None
+    assert found["99"] is None
+    r = client.get(f"{url}/99", headers=headers)
+    assert r.status_code == 404
+
+    r = client.delete(f"{settings.API_V1_STR}/models/{model['id']}", headers=headers)
+    assert r.status_code == 200, r.text
+    assert list(blob.parent.glob(f"{model['sha256']}*")) == []
@@ -1,11 +1,28 @@
+import asyncio
+import json
+import os
 import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from typing import Any
+from unittest.mock import patch
 
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, String, cast, col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
+from app.models import (
+    Project,
+    ProjectBudget,
+    ProjectBudgetLine,
+    ProjectRevision,
+)
+from app.revisions import compact_revisions
+from app.tests.utils.model import create_project, upload_model
 from app.tests.utils.user import authentication_token_from_email
+from app.tests.utils.utils import random_lower_string
 
 
 def test_create_project_as_normal_user(
@@ -99,3 +116,1034 @@ def test_project_not_found(
     )
     assert response.status_code == 404
     assert response.json()["detail"] == "Project not found"
+
+
+def test_read_projects_count_types(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={"name": "Counted", "data": {}},
+    )
+    assert r.status_code == 200, r.text
+
+    for count_type in ("exact", "estimated", "cached", "none"):
+        r = client.get(
+            f"{settings.API_V1_STR}/projects/",
+            headers=normal_user_token_headers,
+            params={"count_type": count_type},
+        )
+        assert r.status_code == 200, r.text
+        content = r.json()
+        assert content["count_type"] == count_type
+        if count_type == "none":
+            assert content["count"] is None
+        elif count_type == "estimated":
+            assert isinstance(content["count"], int)
+        else:
+            assert content["count"] >= 1
+
+
+def test_read_projects_estimated_count_with_data_filters(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    for params in (
+        {"contains": '{"budgetItems": [{"type": "IfcWall"}]}'},
+        {"jsonpath": "$.budgetItems[*] ? (@.unitPrice > 100)"},
+    ):
+        r = client.get(
+            f"{settings.API_V1_STR}/projects/",
+            headers=normal_user_token_headers,
+            params={**params, "count_type": "estimated"},
+        )
+        assert r.status_code == 200, r.text
+        assert r.json()["count_type"] == "estimated"
+        assert isinstance(r.json()["count"], int)
+
+
+def test_read_project_summaries(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    data = {
+        "budgetItems": [
+            {
+                "id": "a",
+                "expressId": 1,
+                "name": "Muro",
+                "qtyValue": 2.5,
+                "unitPrice": 10.1,
+            },
+            {
+                "id": "b",
+                "expressId": 2,
+                "name": "Losa",
+                "qtyValue": 3,
+                "unitPrice": 0.1,
+            },
+        ]
+    }
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={"name": "Summarized", "data": data},
+    )
+    assert r.status_code == 200, r.text
+    project = r.json()
+
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/summary",
+        headers=normal_user_token_headers,
+        params={"limit": 1000},
+    )
+    assert r.status_code == 200, r.text
+    summary = next(p for p in r.json()["data"] if p["id"] == project["id"])
+    assert "data" not in summary
+    assert summary["name"] == "Summarized"
+    assert summary["item_count"] == 2
+    assert summary["total_cost"] == "25.55"
+    assert summary["data_size"] > 0
+
+    r = client.put(
+        f"{settings.API_V1_STR}/projects/{project['id']}",
+        headers=normal_user_token_headers,
+        json={"data": {"budgetItems": data["budgetItems"][:1]}},
+    )
+    assert r.status_code == 200, r.text
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/summary",
+        headers=normal_user_token_headers,
+        params={"limit": 1000},
+    )
+    summary = next(p for p in r.json()["data"] if p["id"] == project["id"])
+    assert summary["item_count"] == 1
+    assert summary["total_cost"] == "25.25"
+
+
+def test_project_summary_matches_stored_data(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    data = {
+        "budgetItems": [
+            {"id": "a", "name": "Cimentación", "qtyValue": 2, "unitPrice": 1.5},
+            # Numeric strings are not summed, like in the budget lines
+            {"id": "b", "name": "Losa de hormigón", "qtyValue": "3", "unitPrice": 2},
+        ],
+        "notas": "Añadir partidas de carpintería",
+    }
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={"name": "Resumen", "data": data},
+    )
+    assert r.status_code == 200, r.text
+    project_id = uuid.UUID(r.json()["id"])
+
+    project = db.get(Project, project_id)
+    assert project
+    stored_size = db.exec(
+        select(func.octet_length(cast(col(Project.data), String))).where(
+            Project.id == project_id
+        )
+    ).one()
+    assert project.data_size == stored_size
+    assert project.total_cost == Decimal("3.00")
+
+
+def test_patch_project(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={
+            "name": "Patched",
+            "data": {"budgetItems": [{"id": "a", "qtyValue": 1, "unitPrice": 2}]},
+        },
+    )
+    assert r.status_code == 200, r.text
+    url = f"{settings.API_V1_STR}/projects/{r.json()['id']}"
+
+    r = client.patch(
+        url,
+        headers={
+            **normal_user_token_headers,
+            "Content-Type": "application/json-patch+json",
+        },
+        json=[
+            {"op": "test", "path": "/data/budgetItems/0/id", "value": "a"},
+            {"op": "replace", "path": "/data/budgetItems/0/qtyValue", "value": 4},
+            {"op": "add", "path": "/data/budgetItems/-", "value": {"id": "b"}},
+        ],
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["data"]["budgetItems"] == [
+        {"id": "a", "qtyValue": 4, "unitPrice": 2},
+        {"id": "b"},
+    ]
+
+    r = client.patch(
+        url,
+        headers={
+            **normal_user_token_headers,
+            "Content-Type": "application/merge-patch+json",
+        },
+        json={"name": "Patched again", "data": {"meta": {"rev": 2}}},
+    )
+    assert r.status_code == 200, r.text
+    content = r.json()
+    assert content["name"] == "Patched again"
+    assert content["data"]["meta"] == {"rev": 2}
+    assert len(content["data"]["budgetItems"]) == 2
+
+    r = client.patch(
+        url,
+        headers=normal_user_token_headers,
+        json=[{"op": "test", "path": "/name", "value": "other"}],
+    )
+    assert r.status_code == 409
+
+    r = client.patch(
+        url,
+        headers=normal_user_token_headers,
+        json=[{"op": "remove", "path": "/data/missing"}],
+    )
+    assert r.status_code == 422
+
+    # Array indexes are ASCII digits only, and test compares JSON types
+    for operations, status_code in (
+        ([{"op": "remove", "path": "/data/budgetItems/\u00b2"}], 422),
+        ([{"op": "remove", "path": "/data/budgetItems/01"}], 422),
+        ([{"op": "test", "path": "/data/budgetItems/0/qtyValue", "value": 4.0}], 409),
+        ([{"op": "test", "path": "/data/meta/rev", "value": True}], 409),
+    ):
+        r = client.patch(url, headers=normal_user_token_headers, json=operations)
+        assert r.status_code == status_code, r.text
+
+    r = client.patch(
+        url, headers=normal_user_token_headers, json={"owner_id": None, "id": "x"}
+    )
+    assert r.status_code == 422
+
+
+def test_read_projects_data_filters(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    tag = random_lower_string()
+    for name, unit_price in (("cheap", 5), ("pricey", 500)):
+        r = client.post(
+            f"{settings.API_V1_STR}/projects/",
+            headers=normal_user_token_headers,
+            json={
+                "name": name,
+                "data": {
+                    "tag": tag,
+                    "budgetItems": [{"type": "IfcWall", "unitPrice": unit_price}],
+                },
+            },
+        )
+        assert r.status_code == 200, r.text
+
+    contains = json.dumps({"tag": tag, "budgetItems": [{"type": "IfcWall"}]})
+    for path in ("/projects/", "/projects/summary"):
+        r = client.get(
+            f"{settings.API_V1_STR}{path}",
+            headers=normal_user_token_headers,
+            params={"contains": contains, "count_type": "cached"},
+        )
+        assert r.status_code == 200, r.text
+        assert r.json()["count"] == 2
+
+        r = client.get(
+            f"{settings.API_V1_STR}{path}",
+            headers=normal_user_token_headers,
+            params={
+                "contains": json.dumps({"tag": tag}),
+                "jsonpath": "$.budgetItems[*] ? (@.unitPrice > 100)",
+            },
+        )
+        assert r.status_code == 200, r.text
+        assert [p["name"] for p in r.json()["data"]] == ["pricey"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        params={"jsonpath": "$.budgetItems[*"},
+    )
+    assert r.status_code == 400
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        params={"contains": "42"},
+    )
+    assert r.status_code == 400
+
+
+def test_project_conditional_requests(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={"name": "Versioned", "data": {"budgetItems": []}},
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["version"] == 1
+    etag = r.headers["ETag"]
+    url = f"{settings.API_V1_STR}/projects/{r.json()['id']}"
+
+    r = client.get(url, headers={**normal_user_token_headers, "If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["ETag"] == etag
+
+    r = client.put(
+        url,
+        headers={**normal_user_token_headers, "If-Match": etag},
+        json={"name": "Saved in tab 1"},
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["version"] == 2
+    new_etag = r.headers["ETag"]
+    assert new_etag != etag
+
+    # A second tab still holding the first ETag must not overwrite the save
+    r = client.put(
+        url,
+        headers={**normal_user_token_headers, "If-Match": etag},
+        json={"name": "Saved in tab 2"},
+    )
+    assert r.status_code == 412
+    r = client.patch(
+        url,
+        headers={**normal_user_token_headers, "If-Match": etag},
+        json={"name": "Saved in tab 2"},
+    )
+    assert r.status_code == 412
+
+    r = client.get(url, headers={**normal_user_token_headers, "If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] == new_etag
+    assert r.json()["name"] == "Saved in tab 1"
+
+
+def test_project_revisions(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    items = [{"id": "a", "qtyValue": 1, "unitPrice": 10}]
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={"name": "History", "data": {"budgetItems": items}},
+    )
+    assert r.status_code == 200, r.text
+    project_id = r.json()["id"]
+    url = f"{settings.API_V1_STR}/projects/{project_id}"
+
+    with patch.object(settings, "PROJECT_REVISION_SNAPSHOT_INTERVAL", 3):
+        for qty in range(2, 7):
+            r = client.patch(
+                url,
+                headers=normal_user_token_headers,
+                json=[
+                    {
+                        "op": "replace",
+                        "path": "/data/budgetItems/0/qtyValue",
+                        "value": qty,
+                    }
+                ],
+            )
+            assert r.status_code == 200, r.text
+    assert r.json()["version"] == 6
+
+    r = client.get(f"{url}/revisions", headers=normal_user_token_headers)
+    assert r.status_code == 200, r.text
+    content = r.json()
+    assert content["count"] == 6
+    assert [rev["version"] for rev in content["data"]] == [6, 5, 4, 3, 2, 1]
+    snapshots = [rev["is_snapshot"] for rev in content["data"]]
+    assert snapshots == [False, False, True, False, False, True]
+    revisions = db.exec(
+        select(ProjectRevision).where(
+            ProjectRevision.project_id == uuid.UUID(project_id)
+        )
+    ).all()
+    assert all(rev.snapshot is not None or rev.delta for rev in revisions)
+    delta = next(rev.delta for rev in revisions if rev.version == 3)
+    assert delta == [
+        {"op": "replace", "path": "/data/budgetItems/0/qtyValue", "value": 3}
+    ]
+
+    for version in range(1, 7):
+        r = client.get(f"{url}/revisions/{version}", headers=normal_user_token_headers)
+        assert r.status_code == 200, r.text
+        assert r.json()["data"]["budgetItems"][0]["qtyValue"] == version
+    r = client.get(f"{url}/revisions/7", headers=normal_user_token_headers)
+    assert r.status_code == 404
+
+    with patch.object(settings, "PROJECT_REVISION_SNAPSHOT_INTERVAL", 3):
+        r = client.post(f"{url}/revisions/2/restore", headers=normal_user_token_headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["version"] == 7
+    assert r.json()["data"]["budgetItems"][0]["qtyValue"] == 2
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/summary", headers=normal_user_token_headers
+    )
+    summary = next(p for p in r.json()["data"] if p["id"] == project_id)
+    assert summary["total_cost"] == "20.00"
+
+    # Deltas 2, 3, 5 and 6 are superseded by the snapshots at 4 and 7
+    async def compact() -> int:
+        engine = create_async_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+        async with AsyncSession(engine) as session:
+            removed = await compact_revisions(
+                session, datetime.now(timezone.utc) + timedelta(minutes=1)
+            )
+        await engine.dispose()
+        return removed
+
+    assert asyncio.run(compact()) >= 4
+    r = client.get(f"{url}/revisions", headers=normal_user_token_headers)
+    assert [rev["version"] for rev in r.json()["data"]] == [7, 4, 1]
+    r = client.get(f"{url}/revisions/4", headers=normal_user_token_headers)
+    assert r.json()["data"]["budgetItems"][0]["qtyValue"] == 4
+    r = client.get(f"{url}/revisions/5", headers=normal_user_token_headers)
+    assert r.status_code == 404
+
+
+def test_project_budget_lines(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    code = random_lower_string()[:20]
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={"code": code, "description": "Muro", "unit": "m2", "unit_price": "12.50"},
+    )
+    assert r.status_code == 200, r.text
+    line_item_id = r.json()["id"]
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={
+            "name": "Lines",
+            "data": {
+                "budgetItems": [
+                    {
+                        "id": "w1",
+                        "expressId": 101,
+                        "type": "IfcWall",
+                        "qtyValue": 2.5,
+                        "unit": "m2",
+                        "unitPrice": 12.5,
+                        "lineItemCode": code,
+                    },
+                    {"id": "s1", "expressId": 102, "type": "IfcSlab", "qtyValue": 4},
+                ]
+            },
+        },
+    )
+    assert r.status_code == 200, r.text
+    project_id = r.json()["id"]
+    url = f"{settings.API_V1_STR}/projects/{project_id}"
+
+    r = client.get(f"{url}/budget-lines", headers=normal_user_token_headers)
+    assert r.status_code == 200, r.text
+    lines = r.json()["data"]
+    assert [line["key"] for line in lines] == ["w1", "s1"]
+    assert lines[0]["line_item_id"] == line_item_id
+    assert lines[1]["unit_price"] is None
+
+    r = client.post(
+        f"{url}/budget-lines/batch",
+        headers=normal_user_token_headers,
+        json={
+            "upsert": [
+                {"id": "w1", "qtyValue": 3},
+                {"id": "w2", "type": "IfcWall", "qtyValue": 1, "unitPrice": 7},
+            ],
+            "delete": ["s1"],
+        },
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["version"] == 2
+    assert r.json()["total_cost"] == "44.50"
+    r = client.get(url, headers=normal_user_token_headers)
+    assert [item["id"] for item in r.json()["data"]["budgetItems"]] == ["w1", "w2"]
+    assert r.json()["data"]["budgetItems"][0]["lineItemCode"] == code
+
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/budget-totals",
+        headers=normal_user_token_headers,
+        params={"group_by": "ifc_type", "project_id": project_id},
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["data"] == [
+        {"key": "IfcWall", "lines": 2, "qty": "4", "total": "44.50"}
+    ]
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/budget-totals",
+        headers=normal_user_token_headers,
+        params={"group_by": "line_item"},
+    )
+    totals = {row["key"]: row for row in r.json()["data"]}
+    assert totals[line_item_id]["total"] == "37.50"
+
+    r = client.post(
+        f"{url}/budget-lines/batch",
+        headers=normal_user_token_headers,
+        json={"upsert": [{"qtyValue": 1}]},
+    )
+    assert r.status_code == 422
+
+
+def test_project_budget(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    items = [
+        {
+            "id": "w1",
+            "type": "IfcWall",
+            "chapter": "02",
+            "qtyValue": 2.5,
+            "unitPrice": 10.1,
+        },
+        {
+            "id": "w2",
+            "type": "IfcWall",
+            "chapter": "02",
+            "qtyValue": 3,
+            "unitPrice": 0.1,
+        },
+        {
+            "id": "s1",
+            "type": "IfcSlab",
+            "chapter": "01",
+            "qtyValue": 1.25,
+            "unitPrice": 80,
+        },
+        {"id": "d1", "type": "IfcDoor", "qtyValue": 2},
+    ]
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={
+            "name": "Budget",
+            "data": {
+                "budgetItems": items,
+                "budgetSettings": {"overheadPct": 10, "profitPct": 5, "taxPct": 18},
+            },
+        },
+    )
+    assert r.status_code == 200, r.text
+    # 25.25 + 0.30 + 100 = 125.55; +12.56 +6.28 = 144.39; +25.99 tax
+    assert r.json()["budget_total"] == "170.38"
+    project_id = r.json()["id"]
+    url = f"{settings.API_V1_STR}/projects/{project_id}"
+
+    r = client.get(f"{url}/budget", headers=normal_user_token_headers)
+    assert r.status_code == 200, r.text
+    budget = r.json()
+    assert budget["direct_cost"] == "125.55"
+    assert budget["overhead"] == "12.56"
+    assert budget["profit"] == "6.28"
+    assert budget["subtotal"] == "144.39"
+    assert budget["tax"] == "25.99"
+    assert budget["total"] == "170.38"
+    assert budget["by_chapter"] == [
+        {"key": "01", "lines": 1, "amount": "100.00"},
+        {"key": "02", "lines": 2, "amount": "25.55"},
+        {"key": None, "lines": 1, "amount": "0.00"},
+    ]
+    assert [s["key"] for s in budget["by_ifc_type"]] == [
+        "IfcDoor",
+        "IfcSlab",
+        "IfcWall",
+    ]
+
+    line_ids = {
+        line.position: line.id
+        for line in db.exec(
+            select(ProjectBudgetLine).where(
+                ProjectBudgetLine.project_id == uuid.UUID(project_id)
+            )
+        )
+    }
+    r = client.patch(
+        url,
+        headers=normal_user_token_headers,
+        json=[
+            {"op": "replace", "path": "/data/budgetItems/1/unitPrice", "value": 0.2},
+            {"op": "replace", "path": "/data/budgetSettings/taxPct", "value": 0},
+        ],
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["budget_total"] == "144.73"
+    db.expire_all()
+    new_line_ids = {
+        line.position: line.id
+        for line in db.exec(
+            select(ProjectBudgetLine).where(
+                ProjectBudgetLine.project_id == uuid.UUID(project_id)
+            )
+        )
+    }
+    # Only the edited item's line was rewritten
+    assert [p for p in line_ids if line_ids[p] != new_line_ids[p]] == [1]
+
+    r = client.get(f"{url}/budget", headers=normal_user_token_headers)
+    incremental = r.json()
+    assert incremental["version"] == 2
+    assert incremental["direct_cost"] == "125.85"
+    budget_row = db.get(ProjectBudget, uuid.UUID(project_id))
+    assert budget_row
+    db.delete(budget_row)
+    db.commit()
+    r = client.get(f"{url}/budget", headers=normal_user_token_headers)
+    assert r.json() == incremental
+
+
+def test_project_budget_after_line_item_deleted(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    code = random_lower_string()[:20]
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={"code": code, "description": "Muro", "unit": "m2", "unit_price": "10"},
+    )
+    assert r.status_code == 200, r.text
+    line_item_id = r.json()["id"]
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={
+            "name": "Unlinked",
+            "data": {
+                "budgetItems": [
+                    {"id": "a", "qtyValue": 2, "unitPrice": 10, "lineItemCode": code},
+                    {"id": "b", "qtyValue": 1, "unitPrice": 5},
+                ]
+            },
+        },
+    )
+    assert r.status_code == 200, r.text
+    url = f"{settings.API_V1_STR}/projects/{r.json()['id']}"
+    r = client.get(f"{url}/budget", headers=normal_user_token_headers)
+    assert [s["key"] for s in r.json()["by_line_item"]] == [line_item_id, None]
+
+    r = client.delete(
+        f"{settings.API_V1_STR}/line-items/{line_item_id}",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 200, r.text
+    r = client.get(f"{url}/budget", headers=normal_user_token_headers)
+    assert r.json()["by_line_item"] == [{"key": None, "lines": 2, "amount": "25.00"}]
+
+    # The next save updates the budget from the unlinked lines
+    r = client.patch(
+        url,
+        headers=normal_user_token_headers,
+        json=[{"op": "replace", "path": "/data/budgetItems/0/qtyValue", "value": 3}],
+    )
+    assert r.status_code == 200, r.text
+    r = client.get(f"{url}/budget", headers=normal_user_token_headers)
+    assert r.json()["by_line_item"] == [{"key": None, "lines": 2, "amount": "35.00"}]
+    assert r.json()["direct_cost"] == "35.00"
+
+
+def test_project_budget_price_as_of(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    code = random_lower_string()[:20]
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={"code": code, "description": "Losa", "unit": "m3", "unit_price": "100"},
+    )
+    assert r.status_code == 200, r.text
+    line_item_url = f"{settings.API_V1_STR}/line-items/{r.json()['id']}"
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={
+            "name": "Repricing",
+            "data": {
+                "budgetItems": [
+                    {"id": "a", "qtyValue": 2, "unitPrice": 90, "lineItemCode": code},
+                    {"id": "b", "qtyValue": 1, "unitPrice": 5},
+                ]
+            },
+        },
+    )
+    assert r.status_code == 200, r.text
+    project_id = r.json()["id"]
+    url = f"{settings.API_V1_STR}/projects/{project_id}/budget"
+    r = client.put(
+        line_item_url, headers=superuser_token_headers, json={"unit_price": "150"}
+    )
+    assert r.status_code == 200, r.text
+    first_price, _ = client.get(
+        f"{line_item_url}/prices", headers=superuser_token_headers
+    ).json()["data"]
+
+    r = client.get(url, headers=normal_user_token_headers)
+    assert (r.json()["direct_cost"], r.json()["price_as_of"]) == ("185.00", None)
+    for as_of, direct_cost in (
+        (first_price["valid_from"], "205.00"),
+        (first_price["valid_to"], "305.00"),
+        # Before the catalog had the item: the budget's own prices
+        ("2000-01-01T00:00:00Z", "185.00"),
+    ):
+        r = client.get(
+            url, headers=normal_user_token_headers, params={"price_as_of": as_of}
+        )
+        assert r.status_code == 200, r.text
+        assert r.json()["direct_cost"] == direct_cost
+        assert r.json()["price_as_of"] is not None
+
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/budget-totals",
+        headers=normal_user_token_headers,
+        params={"project_id": project_id, "price_as_of": first_price["valid_to"]},
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["data"][0]["total"] == "305.00"
+
+
+def test_export_project_budget(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    code = random_lower_string()[:20]
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={"code": code, "description": "Losa", "unit": "m3", "unit_price": "300"},
+    )
+    assert r.status_code == 200, r.text
+    items = [
+        {
+            "id": "a",
+            "type": "IfcSlab",
+            "qtyValue": 1.255,
+            "unitPrice": 300,
+            "lineItemCode": code,
+        },
+        {"id": "b", "name": "Ñandú", "type": "IfcWall"},
+    ]
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=normal_user_token_headers,
+        json={"name": "Export", "data": {"budgetItems": items}},
+    )
+    assert r.status_code == 200, r.text
+    url = f"{settings.API_V1_STR}/projects/{r.json()['id']}/budget/export"
+
+    r = client.get(url, headers=normal_user_token_headers, params={"format": "ndjson"})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"] == "application/x-ndjson"
+    assert r.headers["content-disposition"].endswith('.ndjson"')
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [(row["position"], row["key"]) for row in rows] == [(0, "a"), (1, "b")]
+    assert rows[0]["amount"] == "376.50"
+    assert rows[0]["line_item_code"] == code
+    assert rows[1]["name"] == "Ñandú"
+    assert rows[1]["amount"] is None
+
+    r = client.get(url, headers=superuser_token_headers)
+    assert r.status_code == 200, r.text
+    header, first, second = r.text.splitlines()
+    assert header.startswith("position,key,express_id,name,ifc_type")
+    assert first.startswith("0,a,,,IfcSlab,") and first.endswith(f",376.50,{code}")
+    assert second.startswith("1,b,,Ñandú,IfcWall,")
+
+
+def test_project_takeoff(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = normal_user_token_headers
+    project_id = create_project(client, headers)
+    content = (
+        b"""ISO-10303-21;
+HEADER;
+FILE_SCHEMA(('IFC2X3'));
+ENDSEC;
+DATA;
+#1=IFCOWNERHISTORY($,$,$,.ADDED.,$,$,$,0);
+#2=IFCBUILDINGSTOREY('0w984V0GL6yR4z75YWgVfX',#1,'Nivel 1',$,$,$,$,$,.ELEMENT.,0.);
+#3=IFCBUILDINGSTOREY('2TMp5Hxsj9ZBXwFv$ZkHYd',#1,'Nivel 2',$,$,$,$,$,.ELEMENT.,3.);
+#4=IFCSPACE('1pM$hSzdr4QRHuBFBDWVsd',#1,'Sala',$,$,$,$,$,.ELEMENT.,.INTERNAL.,$);
+#5=IFCMATERIAL('Concreto');
+#6=IFCMATERIAL('Ladrillo');
+#7=IFCMATERIALLAYER(#6,0.15,$);
+#8=IFCMATERIALLAYERSET((#7),$);
+#9=IFCMATERIALLAYERSETUSAGE(#8,.AXIS2.,.POSITIVE.,0.);
+#10=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOH',#1,'Muro 1',$,$,$,$,$);
+#11=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOI',#1,'Muro 2',$,$,$,$,$);
+#12=IFCSLAB('1kTvXnbbzCWw8lcMd1dR4o',#1,'Losa',$,$,$,$,$,.FLOOR.);
+#20=IFCQUANTITYVOLUME('NetVolume','',$,2.5);
+#21=IFCQUANTITYAREA('NetSideArea','',$,10.);
+#22=IFCELEMENTQUANTITY('0hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#20,#21));
+#23=IFCQUANTITYVOLUME('NetVolume','',$,1.5);
+#24=IFCELEMENTQUANTITY('1hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#23));
+#25=IFCQUANTITYVOLUME('NetVolume','',$,4.);
+#26=IFCELEMENTQUANTITY('2hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto; #27',$,$,(#25));
+#30=IFCRELDEFINESBYPROPERTIES('2bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#10),#22);
+#31=IFCRELDEFINESBYPROPERTIES('3bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#11),#24);
+#32=IFCRELDEFINESBYPROPERTIES('4bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#12),#26);
+#40=IFCRELCONTAINEDINSPATIALSTRUCTURE('0Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,(#10,#12),#2);
+#41=IFCRELCONTAINEDINSPATIALSTRUCTURE('1Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,(#11),#4);
+#42=IFCRELAGGREGATES('2Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,#3,(#4));
+#43=IFCRELASSOCIATESMATERIAL('3Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,(#10,#11),#9);
+#44=IFCRELASSOCIATESMATERIAL('4Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,(#12),#5);
+ENDSEC;
+END-ISO-10303-21;
+"""
+        + b"/*"
+        + os.urandom(500).hex().encode()
+        + b"*/\n"
+    )
+    model = upload_model(client, headers, project_id, content)
+    url = f"{settings.API_V1_STR}/projects/{project_id}/takeoff"
+
+    r = client.get(url, headers=headers, params={"group_by": "type,storey"})
+    assert r.status_code == 200, r.text
+    takeoff = r.json()
+    assert takeoff["model"]["id"] == model["id"]
+    assert takeoff["group_by"] == ["type", "storey"]
+    totals = [
+        (t["quantity"], t["type"], t["storey"], t["material"], t["count"], t["total"])
+        for t in takeoff["data"]
+    ]
+    # Muro 2 is in a space of Nivel 2
+    assert totals == [
+        ("NetSideArea", "IFCWALL", "Nivel 1", None, 1, 10.0),
+        ("NetVolume", "IFCSLAB", "Nivel 1", None, 1, 4.0),
+        ("NetVolume", "IFCWALL", "Nivel 1", None, 1, 2.5),
+        ("NetVolume", "IFCWALL", "Nivel 2", None, 1, 1.5),
+    ]
+
+    r = client.get(
+        url, headers=headers, params={"group_by": "material", "qty": "NetVolume"}
+    )
+    assert r.status_code == 200, r.text
+    assert [(t["material"], t["total"]) for t in r.json()["data"]] == [
+        ("Concreto", 4.0),
+        ("Ladrillo", 4.0),
+    ]
+    r = client.get(url, headers=headers, params={"group_by": "", "qty": "Nada"})
+    assert r.json()["data"] == []
+    r = client.get(url, headers=headers, params={"group_by": "color"})
+    assert r.status_code == 400
+
+
+def test_project_takeoff_dangling_references(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    headers = normal_user_token_headers
+    project_id = create_project(client, headers)
+    # Quantities defined on missing elements #15 and #999, and a containment
+    # without a structure
+    content = (
+        b"""ISO-10303-21;
+HEADER;
+FILE_SCHEMA(('IFC2X3'));
+ENDSEC;
+DATA;
+#1=IFCOWNERHISTORY($,$,$,.ADDED.,$,$,$,0);
+#10=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOH',#1,'Muro 1',$,$,$,$,$);
+#11=IFCSLAB('1kTvXnbbzCWw8lcMd1dR4o',#1,'Losa',$,$,$,$,$,.FLOOR.);
+#20=IFCQUANTITYVOLUME('NetVolume','',$,2.5);
+#21=IFCELEMENTQUANTITY('0hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#20));
+#22=IFCQUANTITYVOLUME('NetVolume','',$,4.);
+#23=IFCELEMENTQUANTITY('1hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#22));
+#30=IFCRELDEFINESBYPROPERTIES('2bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#10,#999),#21);
+#31=IFCRELDEFINESBYPROPERTIES('3bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#15,#11),#23);
+#40=IFCRELCONTAINEDINSPATIALSTRUCTURE('0Zq5YQ9yz6F9sMhRP8rCkV',#1,$,$,(#10),$);
+ENDSEC;
+END-ISO-10303-21;
+"""
+        + b"/*"
+        + os.urandom(500).hex().encode()
+        + b"*/\n"
+    )
+    upload_model(client, headers, project_id, content)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/{project_id}/takeoff",
+        headers=headers,
+        params={"group_by": "type"},
+    )
+    assert r.status_code == 200, r.text
+    assert [(t["type"], t["count"], t["total"]) for t in r.json()["data"]] == [
+        ("IFCSLAB", 1, 4.0),
+        ("IFCWALL", 1, 2.5),
+    ]
+
+    code = random_lower_string()[:20]
+    r = client.post(
+        f"{settings.API_V1_STR}/line-items/",
+        headers=superuser_token_headers,
+        json={"code": code, "description": "Concreto", "unit": "m3", "unit_price": "1"},
+    )
+    assert r.status_code == 200, r.text
+    rule = {"ifc_class": "IfcWall", "quantity": "NetVolume", "line_item_code": code}
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/{project_id}/budget/generate",
+        headers=headers,
+        json={"rules": [rule]},
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["items"] == 1
+
+
+def test_generate_project_budget(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    headers = normal_user_token_headers
+    codes = []
+    for description, unit, unit_price in (
+        ("Tarrajeo", "m2", "25"),
+        ("Concreto", "m3", "300"),
+    ):
+        code = random_lower_string()[:20]
+        r = client.post(
+            f"{settings.API_V1_STR}/line-items/",
+            headers=superuser_token_headers,
+            json={
+                "code": code,
+                "description": description,
+                "unit": unit,
+                "unit_price": unit_price,
+            },
+        )
+        assert r.status_code == 200, r.text
+        codes.append(code)
+    plaster, concrete = codes
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=headers,
+        json={"name": "Reglas", "data": {"budgetItems": [{"id": "a", "qtyValue": 1}]}},
+    )
+    assert r.status_code == 200, r.text
+    project_id = r.json()["id"]
+    content = (
+        b"""ISO-10303-21;
+HEADER;
+FILE_SCHEMA(('IFC2X3'));
+ENDSEC;
+DATA;
+#1=IFCOWNERHISTORY($,$,$,.ADDED.,$,$,$,0);
+#10=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOH',#1,'Muro 1',$,$,$,$,$);
+#11=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOI',#1,'Muro 2',$,$,$,$,$);
+#12=IFCSLAB('1kTvXnbbzCWw8lcMd1dR4o',#1,'Losa',$,$,$,$,$,.FLOOR.);
+#13=IFCPROPERTYSINGLEVALUE('IsExternal',$,IFCBOOLEAN(.T.),$);
+#14=IFCPROPERTYSINGLEVALUE('FireRating',$,IFCLABEL('EI 60'),$);
+#15=IFCPROPERTYSET('3Ks2Q3b1T0nA2ZnF$6XHxk',#1,'Pset_WallCommon',$,(#13,#14));
+#16=IFCPROPERTYSINGLEVALUE('IsExternal',$,IFCBOOLEAN(.F.),$);
+#17=IFCPROPERTYSET('4Ks2Q3b1T0nA2ZnF$6XHxk',#1,'Pset_WallCommon',$,(#16));
+#20=IFCQUANTITYVOLUME('NetVolume','',$,2.5);
+#21=IFCQUANTITYAREA('NetSideArea','',$,10.);
+#22=IFCELEMENTQUANTITY('0hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#20,#21));
+#23=IFCQUANTITYVOLUME('NetVolume','',$,1.5);
+#24=IFCQUANTITYAREA('NetSideArea','',$,6.);
+#25=IFCELEMENTQUANTITY('1hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#23,#24));
+#26=IFCQUANTITYVOLUME('NetVolume','',$,4.);
+#27=IFCELEMENTQUANTITY('2hD$9w7zP1Xwh8ZdLQ1zGz',#1,'Qto',$,$,(#26));
+#30=IFCRELDEFINESBYPROPERTIES('2bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#10),#22);
+#31=IFCRELDEFINESBYPROPERTIES('3bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#11),#25);
+#32=IFCRELDEFINESBYPROPERTIES('4bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#12),#27);
+#33=IFCRELDEFINESBYPROPERTIES('5bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#10),#15);
+#34=IFCRELDEFINESBYPROPERTIES('6bF0DVL1b0QOj9$Wqg9V1n',#1,$,$,(#11),#17);
+ENDSEC;
+END-ISO-10303-21;
+"""
+        + b"/*"
+        + os.urandom(500).hex().encode()
+        + b"*/\n"
+    )
+    upload_model(client, headers, project_id, content)
+    url = f"{settings.API_V1_STR}/projects/{project_id}/budget/generate"
+    rules: list[dict[str, Any]] = [
+        {
+            "ifc_class": "IfcWall",
+            "where": [{"property": "Pset_WallCommon.IsExternal", "value": True}],
+            "quantity": "NetSideArea",
+            "line_item_code": plaster,
+        },
+        {
+            "ifc_class": "IfcWall",
+            "where": [{"property": "FireRating", "op": "in", "value": ["EI 60"]}],
+            "quantity": "NetVolume",
+            "line_item_code": concrete,
+            "factor": 1.1,
+            "chapter": "Muros",
+        },
+        # Muro 1 is already plastered by the first rule
+        {"ifc_class": "IfcWall", "quantity": "NetSideArea", "line_item_code": plaster},
+        {
+            "ifc_class": "IFCSLAB",
+            "where": [
+                {"property": "IsExternal", "op": "ne", "value": True},
+                {"property": "NetVolume", "op": "gt", "value": 3},
+            ],
+            "quantity": "NetVolume",
+            "line_item_code": concrete,
+        },
+    ]
+
+    r = client.post(url, headers=headers, json={"rules": rules})
+    assert r.status_code == 200, r.text
+    generated = r.json()
+    assert generated["items"] == 5
+    assert generated["rule_items"] == [1, 1, 1, 1]
+    assert generated["project"]["version"] == 2
+    assert r.headers["ETag"]
+    r = client.get(f"{settings.API_V1_STR}/projects/{project_id}", headers=headers)
+    items = r.json()["data"]["budgetItems"]
+    assert [
+        (item["id"], item["name"], item["type"], item["qtyName"], item["qtyValue"])
+        for item in items[1:]
+    ] == [
+        (f"10-{plaster}", "Muro 1", "IFCWALL", "NetSideArea", 10.0),
+        (f"10-{concrete}", "Muro 1", "IFCWALL", "NetVolume", 2.75),
+        (f"11-{plaster}", "Muro 2", "IFCWALL", "NetSideArea", 6.0),
+        (f"12-{concrete}", "Losa", "IFCSLAB", "NetVolume", 4.0),
+    ]
+    assert items[2]["unit"] == "m3" and items[2]["unitPrice"] == 300
+    assert items[2]["chapter"] == "Muros"
+    r = client.get(
+        f"{settings.API_V1_STR}/projects/{project_id}/budget", headers=headers
+    )
+    assert r.json()["direct_cost"] == "2425.00"
+
+    # Generating again updates the same items, or replaces every item
+    r = client.post(url, headers=headers, json={"rules": rules})
+    assert r.json()["items"] == 5
+    r = client.post(url, headers=headers, json={"rules": rules[3:], "replace": True})
+    assert (r.json()["items"], r.json()["rule_items"]) == (1, [1])
+    r = client.post(url, headers={**headers, "If-Match": '"1"'}, json={"rules": rules})
+    assert r.status_code == 412
+
+    rules[3]["where"][1]["value"] = "3"
+    r = client.post(url, headers=headers, json={"rules": rules})
+    assert r.status_code == 422
+    assert r.json()["detail"].startswith("Rule 4: NetVolume gt needs a number")
+    r = client.post(
+        url,
+        headers=headers,
+        json={"rules": [{**rules[0], "line_item_code": "no-such-code"}]},
+    )
+    assert r.status_code == 422
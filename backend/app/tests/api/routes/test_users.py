@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 from unittest.mock import patch
 
@@ -5,9 +6,12 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
 from app import crud
+from app.core.cache import TTLCache
 from app.core.config import settings
-from app.core.security import verify_password
+from app.core.security import Principal, verify_password
 from app.models import User, UserCreate
+from app.principal_cache import is_listening, listen_for_principal_changes
+from app.tests.utils.user import user_authentication_headers
 from app.tests.utils.utils import random_email, random_lower_string
 
 
@@ -484,3 +488,89 @@ def test_delete_user_without_privileges(
     )
     assert r.status_code == 403
     assert r.json()["detail"] == "The user doesn't have enough privileges"
+
+
+def test_update_user_invalidates_cached_principal(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    username = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=username, password=password)
+    )
+    headers = user_authentication_headers(
+        client=client, email=username, password=password
+    )
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/{user.id}",
+        headers=superuser_token_headers,
+        json={"is_active": False},
+    )
+    assert r.status_code == 200
+
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Inactive user"
+
+
+def test_update_user_invalidates_principal_on_every_worker(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    user = crud.create_user(
+        session=db,
+        user_create=UserCreate(email=random_email(), password=random_lower_string()),
+    )
+    principal = Principal(
+        id=user.id,
+        email=user.email,
+        full_name=None,
+        is_active=True,
+        is_superuser=False,
+    )
+    # The cache of another worker, kept by a listener of its own
+    other: TTLCache[tuple[str, str], Principal] = TTLCache(
+        name="other-worker", maxsize=10, ttl=60
+    )
+    key, unrelated = (str(user.id), "token"), (str(uuid.uuid4()), "token")
+
+    async def demote() -> tuple[Principal | None, Principal | None]:
+        listener = asyncio.create_task(listen_for_principal_changes(other))
+        for _ in range(100):
+            if is_listening(other):
+                break
+            await asyncio.sleep(0.05)
+        other.set(key, principal)
+        other.set(unrelated, principal)
+        r = await asyncio.to_thread(
+            client.patch,
+            f"{settings.API_V1_STR}/users/{user.id}",
+            headers=superuser_token_headers,
+            json={"is_active": False},
+        )
+        assert r.status_code == 200, r.text
+        for _ in range(100):
+            if other.get(key) is None:
+                break
+            await asyncio.sleep(0.05)
+        cached = other.get(key), other.get(unrelated)
+        listener.cancel()
+        return cached
+
+    assert asyncio.run(demote()) == (None, principal)
+
+
+def test_retrieve_users_estimated_count(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={"count_type": "estimated"},
+    )
+    assert r.status_code == 200
+    content = r.json()
+    assert content["count_type"] == "estimated"
+    assert content["count"] >= 0
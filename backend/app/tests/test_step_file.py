@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import pytest
+
+from app.step_file import Entity, Ref, StepFile, Typed
+
+IFC = b"""ISO-10303-21;
+HEADER;
+FILE_DESCRIPTION(('ViewDefinition [CoordinationView]'),'2;1');
+FILE_NAME('casa.ifc','2024-01-01T00:00:00',(''),(''),'','','');
+FILE_SCHEMA(('IFC2X3'));
+ENDSEC;
+DATA;
+#10=IFCWALL('2O2Fr$t4X7Zf8NOew3FLOH',#2,'Muro; b\\X2\\00E1\\X0\\sico ''A''',$,*,
+  #20,#30,$);
+#2 = IFCOWNERHISTORY(#3,$,.READWRITE.,$,$,$,$,0);
+#20=IFCPROPERTYSINGLEVALUE('IsExternal',$,IFCBOOLEAN(.T.),$);
+#30=IFCQUANTITYVOLUME('NetVolume','',$,1.25E1,$);
+#31=IFCCARTESIANPOINT((0.,-1.5,2));
+#32=IFCPROPERTYSET('x',$,'Cota #40=IFCWALL(',$,(#20,#30));
+ENDSEC;
+END-ISO-10303-21;
+"""
+
+
+def test_step_file_index(tmp_path: Path) -> None:
+    path = tmp_path / "casa.ifc"
+    path.write_bytes(IFC)
+    with StepFile(path, tmp_path / "casa.idx") as f:
+        assert f.schema == "IFC2X3"
+        assert len(f) == 6
+        # Ids are looked up in order whatever the order in the file
+        assert list(f.index.ids) == [2, 10, 20, 30, 31, 32]
+        assert f.type_of(30) == "IFCQUANTITYVOLUME"
+        assert f.ids_of_type("IfcWall", "IFCPROPERTYSET") == [10, 32]
+        assert 40 not in f
+        assert f.raw(31) == b"#31=IFCCARTESIANPOINT((0.,-1.5,2));"
+        with pytest.raises(KeyError):
+            f.entity(40)
+
+    # The saved index is used instead of scanning the file again
+    with StepFile(path, tmp_path / "casa.idx") as f:
+        assert list(f.index.offsets) == [IFC.index(b"#2 ="), IFC.index(b"#10=")] + [
+            IFC.index(b"#%d=" % id) for id in (20, 30, 31, 32)
+        ]
+        assert f.index.types == [
+            "IFCWALL",
+            "IFCOWNERHISTORY",
+            "IFCPROPERTYSINGLEVALUE",
+            "IFCQUANTITYVOLUME",
+            "IFCCARTESIANPOINT",
+            "IFCPROPERTYSET",
+        ]
+
+
+def test_step_file_entities(tmp_path: Path) -> None:
+    path = tmp_path / "casa.ifc"
+    path.write_bytes(IFC)
+    with StepFile(path) as f:
+        assert f.entity(10) == Entity(
+            10,
+            "IFCWALL",
+            (
+                "2O2Fr$t4X7Zf8NOew3FLOH",
+                Ref(2),
+                "Muro; básico 'A'",
+                None,
+                None,
+                Ref(20),
+                Ref(30),
+                None,
+            ),
+        )
+        assert f.entity(2).args[2] == "READWRITE"
+        assert f.entity(20).args[2] == Typed("IFCBOOLEAN", True)
+        assert f.entity(30).args == ("NetVolume", "", None, 12.5, None)
+        assert f.entity(31).args == ((0.0, -1.5, 2),)
+        assert f.entity(32).args == (
+            "x",
+            None,
+            "Cota #40=IFCWALL(",
+            None,
+            (Ref(20), Ref(30)),
+        )
@@ -0,0 +1,49 @@
+from typing import Any
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def create_project(client: TestClient, headers: dict[str, str]) -> str:
+    r = client.post(
+        f"{settings.API_V1_STR}/projects/",
+        headers=headers,
+        json={"name": "Proyecto con modelo", "data": {}},
+    )
+    assert r.status_code == 200, r.text
+    id: str = r.json()["id"]
+    return id
+
+
+def upload_model(
+    client: TestClient, headers: dict[str, str], project_id: str, content: bytes
+) -> dict[str, Any]:
+    url = f"{settings.API_V1_STR}/models/uploads"
+    r = client.post(
+        url,
+        headers=headers,
+        json={"project_id": project_id, "filename": "casa.ifc", "size": len(content)},
+    )
+    assert r.status_code == 200, r.text
+    url = f"{url}/{r.json()['id']}"
+    r = client.patch(
+        url, headers={**headers, "Upload-Offset": "0"}, content=content[:1000]
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["offset"] == 1000
+    assert r.json()["model"] is None
+
+    # A chunk sent twice is refused, and the upload resumes from its offset
+    r = client.patch(
+        url, headers={**headers, "Upload-Offset": "0"}, content=content[:1000]
+    )
+    assert r.status_code == 409
+    r = client.get(url, headers=headers)
+    assert r.json()["offset"] == 1000
+    r = client.patch(
+        url, headers={**headers, "Upload-Offset": "1000"}, content=content[1000:]
+    )
+    assert r.status_code == 200, r.text
+    model: dict[str, Any] = r.json()["model"]
+    return model
@@ -0,0 +1,105 @@
+"""
+Side-by-side benchmark of the sync and async database paths.
+
+The sync path mirrors how a `def` route used to run: each request is executed
+on AnyIO's worker threads (capacity 40 by default) with a `Session` on the sync
+engine. The async path awaits the same queries with an `AsyncSession` on the
+async engine, the way the routes run now. Each simulated request runs the count
+and page queries of `read_line_items`, plus an optional `pg_sleep` standing in
+for a slower query.
+
+Usage (from ./backend, with the database up):
+
+    python scripts/benchmark_db_stack.py --requests 2000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+
+import anyio
+from sqlmodel import Session, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import async_engine, engine
+from app.models import LineItem
+
+
+def sync_request(delay_ms: float) -> None:
+    with Session(engine) as session:
+        session.exec(select(func.count()).select_from(LineItem)).one()
+        session.exec(select(LineItem).limit(100)).all()
+        if delay_ms:
+            session.exec(select(func.pg_sleep(delay_ms / 1000))).one()
+
+
+async def async_request(delay_ms: float) -> None:
+    async with AsyncSession(async_engine) as session:
+        (await session.exec(select(func.count()).select_from(LineItem))).one()
+        (await session.exec(select(LineItem).limit(100))).all()
+        if delay_ms:
+            (await session.exec(select(func.pg_sleep(delay_ms / 1000)))).one()
+
+
+async def run(
+    name: str,
+    request: Callable[[], Awaitable[None]],
+    *,
+    requests: int,
+    concurrency: int,
+) -> None:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>5}: {requests / elapsed:8.1f} req/s  "
+        f"p50 {quantiles[49] * 1000:7.1f} ms  "
+        f"p95 {quantiles[94] * 1000:7.1f} ms  "
+        f"p99 {quantiles[98] * 1000:7.1f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--delay-ms", type=float, default=5.0)
+    parser.add_argument("--thread-limit", type=int, default=40)
+    args = parser.parse_args()
+
+    limiter = anyio.CapacityLimiter(args.thread_limit)
+
+    async def sync_path() -> None:
+        await anyio.to_thread.run_sync(sync_request, args.delay_ms, limiter=limiter)
+
+    async def async_path() -> None:
+        await async_request(args.delay_ms)
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, "
+        f"query delay {args.delay_ms} ms, sync threads {args.thread_limit}, "
+        f"pool {engine.pool.size()}+{engine.pool._max_overflow}"  # type: ignore[attr-defined]
+    )
+    # Warm both connection pools before measuring
+    await run("warm", sync_path, requests=50, concurrency=10)
+    await run("warm", async_path, requests=50, concurrency=10)
+    await run("sync", sync_path, requests=args.requests, concurrency=args.concurrency)
+    await run("async", async_path, requests=args.requests, concurrency=args.concurrency)
+    await async_engine.dispose()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
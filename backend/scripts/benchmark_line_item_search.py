@@ -0,0 +1,182 @@
+"""
+Latency benchmark of `/line-items/search` on a large catalog.
+
+Seeds the catalog up to `--rows` synthetic line items (codes `BENCH-…`, Spanish
+construction descriptions built from a small vocabulary) with a single
+server-side `generate_series` insert, then runs a mix of searches: word and
+phrase queries, misspellings, code prefixes and autocomplete. Each request
+opens its own `AsyncSession` and calls `search_line_items`, the way the route
+does.
+
+Usage (from ./backend, with the database up and migrated):
+
+    python scripts/benchmark_line_item_search.py --rows 1000000 --requests 2000
+    python scripts/benchmark_line_item_search.py --cleanup
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlmodel import col, delete, func, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import async_engine
+from app.line_item_search import search_line_items
+from app.models import LineItem
+
+ACTIVITIES = [
+    "Excavación", "Relleno compactado", "Encofrado y desencofrado", "Vaciado",
+    "Suministro e instalación", "Tarrajeo", "Pintura", "Demolición",
+    "Colocación", "Acarreo", "Nivelación", "Impermeabilización", "Perfilado",
+    "Curado", "Habilitación", "Montaje", "Limpieza", "Solaqueo", "Enchape",
+    "Sellado",
+]  # fmt: skip
+MATERIALS = [
+    "concreto f'c=210 kg/cm2", "concreto f'c=175 kg/cm2", "acero corrugado fy=4200",
+    "ladrillo King Kong", "muro de drywall", 'tubería PVC 4"', "cable THW 2.5 mm2",
+    "cerámica 60x60", "porcelanato", "piedra chancada", "arena gruesa",
+    "madera tornillo", "vidrio templado", "pintura látex", "mortero 1:4", "yeso",
+    "malla electrosoldada", "grava", "asfalto", "geomembrana",
+]  # fmt: skip
+PLACES = [
+    "zapatas", "columnas", "vigas", "losas aligeradas", "muros",
+    "cimientos corridos", "sobrecimientos", "escaleras", "techos", "pisos",
+    "veredas", "cisternas", "tanques elevados", "placas", "parapetos",
+]  # fmt: skip
+UNITS = ["m3", "m2", "ml", "kg", "und", "glb"]
+TYPOS = ["porcelanto", "excavacion", "ceramica", "impermeabilizacion", "encofardo"]
+
+# Row g gets a unique code and a description mixing the vocabulary with
+# coprime strides, so every combination appears
+SEED = text(
+    """
+    INSERT INTO lineitem (id, code, description, unit, unit_price)
+    SELECT
+        gen_random_uuid(),
+        format('BENCH-%s.%s.%s', lpad((g % 30 + 1)::text, 2, '0'),
+               lpad((g / 30 % 100)::text, 2, '0'), lpad((g / 3000)::text, 4, '0')),
+        format('%s de %s en %s, tipo %s',
+               (CAST(:activities AS text[]))[1 + g * 7 % 20], (CAST(:materials AS text[]))[1 + g * 13 / 20 % 20],
+               (CAST(:places AS text[]))[1 + g * 31 / 400 % 15], g % 97 + 1),
+        (CAST(:units AS text[]))[1 + g % 6],
+        round((g::bigint * 7919 % 100000) / 100.0 + 1, 2)
+    FROM generate_series(:start, :stop - 1) AS g
+    """
+)
+
+
+def random_query(rng: random.Random) -> tuple[str, bool]:
+    kind = rng.random()
+    if kind < 0.4:
+        words = [rng.choice(ACTIVITIES), rng.choice(MATERIALS), rng.choice(PLACES)]
+        return " ".join(rng.sample(words, rng.randint(1, 3))), False
+    if kind < 0.55:
+        return rng.choice(TYPOS), False
+    if kind < 0.75:
+        code = f"BENCH-{rng.randint(1, 30):02d}.{rng.randint(0, 99):02d}.{rng.randint(0, 333):04d}"
+        return code[: rng.randint(8, len(code))].lower(), True
+    phrase = f"{rng.choice(ACTIVITIES)} {rng.choice(PLACES)}"
+    return phrase[: rng.randint(3, len(phrase))], True
+
+
+async def seed(rows: int, batch: int) -> None:
+    async with AsyncSession(async_engine) as session:
+        existing = (
+            await session.exec(
+                select(func.count()).where(col(LineItem.code).startswith("BENCH-"))
+            )
+        ).one()
+        if existing >= rows:
+            print(f"{existing} benchmark line items already seeded")
+            return
+        conn = await session.connection()
+        for start in range(existing, rows, batch):
+            stop = min(start + batch, rows)
+            began = time.perf_counter()
+            await conn.execute(
+                SEED,
+                {
+                    "activities": ACTIVITIES,
+                    "materials": MATERIALS,
+                    "places": PLACES,
+                    "units": UNITS,
+                    "start": start,
+                    "stop": stop,
+                },
+            )
+            await session.commit()
+            conn = await session.connection()
+            print(f"seeded {stop}/{rows} ({time.perf_counter() - began:.1f} s)")
+        await conn.execute(text("ANALYZE lineitem"))
+        await session.commit()
+
+
+async def cleanup() -> None:
+    async with AsyncSession(async_engine) as session:
+        statement = delete(LineItem).where(col(LineItem.code).startswith("BENCH-"))
+        result = await session.exec(statement)  # type: ignore[call-overload]
+        await session.commit()
+        print(f"deleted {result.rowcount} benchmark line items")
+
+
+async def run(
+    name: str, queries: list[tuple[str, bool]], *, concurrency: int, limit: int
+) -> None:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(q: str, autocomplete: bool) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                await search_line_items(
+                    session, q, limit=limit, autocomplete=autocomplete
+                )
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(q, autocomplete) for q, autocomplete in queries))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>6}: {len(queries) / elapsed:8.1f} req/s  "
+        f"p50 {quantiles[49] * 1000:7.1f} ms  "
+        f"p95 {quantiles[94] * 1000:7.1f} ms  "
+        f"p99 {quantiles[98] * 1000:7.1f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument(
+        "--cleanup", action="store_true", help="delete the seeded line items"
+    )
+    args = parser.parse_args()
+
+    if args.cleanup:
+        await cleanup()
+    else:
+        await seed(args.rows, args.batch)
+        rng = random.Random(args.random_seed)
+        queries = [random_query(rng) for _ in range(args.requests)]
+        print(
+            f"{args.requests} searches, concurrency {args.concurrency}, "
+            f"limit {args.limit}"
+        )
+        # Warm the connection pool and the indexes' pages before measuring
+        await run("warm", queries[:200], concurrency=args.concurrency, limit=args.limit)
+        await run("search", queries, concurrency=args.concurrency, limit=args.limit)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())